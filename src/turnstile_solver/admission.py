@@ -0,0 +1,79 @@
+import logging
+from typing import Callable
+
+from turnstile_solver.constants import ADMISSION_MAX_QUEUE, SOLVE_BUDGET
+
+logger = logging.getLogger(__name__)
+
+# Weight of the latest solve in the service time moving average
+_SERVICE_TIME_ALPHA = 0.2
+
+
+class AdmissionController:
+  def __init__(self,
+               capacity: Callable[[], int],
+               max_queue: int = ADMISSION_MAX_QUEUE,
+               default_budget: float = SOLVE_BUDGET,
+               ):
+    """
+    Bounded admission queue in front of the browser pool. Requests that would wait longer than their budget are rejected right away instead of queueing
+    :param capacity: Solves the pool can run at the same time
+    :param max_queue: Max admitted requests waiting for a page
+    :param default_budget: Seconds a request can take, waiting included, when it doesn't set its own
+    """
+    self.capacity = capacity
+    self.max_queue = max_queue
+    self.default_budget = default_budget
+    # Admitted requests not finished yet, running or waiting for a page
+    self.in_flight = 0
+    # Moving average of the time a solve holds a page, None until a solve finishes
+    self.service_time: float | None = None
+    self.rejected = 0
+
+  @property
+  def queued(self) -> int:
+    return max(0, self.in_flight - self.capacity())
+
+  def estimated_wait(self, n: int = 1) -> float:
+    """Seconds before the n-th next request gets a page, from the current queue and recent throughput"""
+    if not (ahead := self.in_flight + n - self.capacity()) > 0 or self.service_time is None:
+      return 0
+    # Throughput is capacity / service_time solves per second
+    return ahead * self.service_time / self.capacity()
+
+  def check(self, budget: float | None = None, n: int = 1) -> float | None:
+    """None if n more requests would be admitted, else the seconds after which they should be retried"""
+    budget = budget or self.default_budget
+    if (overflow := self.in_flight + n - self.capacity() - self.max_queue) > 0:
+      # Queue full, retry once enough queued requests have got a page
+      return overflow * (self.service_time or 1) / self.capacity()
+    if (wait := self.estimated_wait(n)) and wait + self.service_time > budget:
+      return wait + self.service_time - budget
+    return None
+
+  def admit(self, budget: float | None = None) -> float | None:
+    """Admit a request, returning None, or reject it returning the seconds after which it should be retried. Admitted requests must be released"""
+    if (retryAfter := self.check(budget)) is not None:
+      self.rejected += 1
+      logger.debug(f"Request rejected, retry after {retryAfter:.1f} seconds. In flight: {self.in_flight}")
+      return retryAfter
+    self.in_flight += 1
+    return None
+
+  def release(self, n: int = 1):
+    self.in_flight -= n
+
+  def record_service_time(self, seconds: float):
+    if self.service_time is None:
+      self.service_time = seconds
+    else:
+      self.service_time += _SERVICE_TIME_ALPHA * (seconds - self.service_time)
+
+  def stats(self) -> dict:
+    return {
+      "in_flight": self.in_flight,
+      "queued": self.queued,
+      "estimated_wait": round(self.estimated_wait(), 3),
+      "service_time": None if self.service_time is None else round(self.service_time, 3),
+      "rejected": self.rejected,
+    }
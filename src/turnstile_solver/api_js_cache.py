@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import re
+import time
+
+from patchright.async_api import BrowserContext, Route
+
+from turnstile_solver.constants import TURNSTILE_API_JS_URL, API_JS_CACHE_MAX_STALE
+from turnstile_solver.metrics import API_JS_CACHE
+
+logger = logging.getLogger(__name__)
+
+_API_JS_URL_PATTERN = re.compile(re.escape(TURNSTILE_API_JS_URL) + r"(\?.*)?$")
+
+# Not valid anymore once the body has been decoded by the fetch
+_DROPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+
+def _max_age(headers: dict[str, str]) -> float | None:
+  """Seconds a response can be served without revalidation according to its Cache-Control header, None if it must not be stored"""
+  directives = {}
+  for directive in headers.get("cache-control", "").lower().split(","):
+    name, _, value = directive.strip().partition("=")
+    directives[name] = value.strip('"')
+  if "no-store" in directives:
+    return None
+  if "no-cache" in directives:
+    return 0
+  for name in ("s-maxage", "max-age"):
+    try:
+      return float(directives[name])
+    except (KeyError, ValueError):
+      pass
+  return 0
+
+
+class _Entry:
+  def __init__(self, body: bytes, headers: dict[str, str], max_age: float):
+    self.body = body
+    self.headers = {k: v for k, v in headers.items() if k.lower() not in _DROPPED_HEADERS}
+    self.max_age = max_age
+    self.fetched_at = time.monotonic()
+
+  @property
+  def age(self) -> float:
+    return time.monotonic() - self.fetched_at
+
+
+class ApiJsCache:
+  def __init__(self, max_stale: float = API_JS_CACHE_MAX_STALE):
+    """
+    In-memory cache of the Turnstile api.js shared by all browser contexts, so pages don't download it through their proxy on every navigation.
+    Fresh responses are served as is. Stale ones are still served while they're revalidated in background, unless stale for more than max_stale seconds
+    """
+    self.max_stale = max_stale
+    # url -> cached response
+    self._entries: dict[str, _Entry] = {}
+    # url -> response being fetched for a miss, concurrent misses wait for it
+    self._fetching: dict[str, asyncio.Future] = {}
+    self._revalidating: set[str] = set()
+    self._tasks: set[asyncio.Task] = set()
+
+    self.hits = 0
+    self.stale_hits = 0
+    self.misses = 0
+    self.revalidations = 0
+    self.revalidation_failures = 0
+
+  async def attach(self, context: BrowserContext):
+    """Serve api.js requests of the context from the cache"""
+    await context.route(_API_JS_URL_PATTERN, lambda route: self._handle(route, context))
+
+  def stats(self) -> dict:
+    return {
+      "hits": self.hits,
+      "stale_hits": self.stale_hits,
+      "misses": self.misses,
+      "revalidations": self.revalidations,
+      "revalidation_failures": self.revalidation_failures,
+    }
+
+  async def close(self):
+    for task in self._tasks:
+      task.cancel()
+
+  async def _handle(self, route: Route, context: BrowserContext):
+    url = route.request.url
+    if route.request.method != "GET":
+      await route.continue_()
+      return
+    if (entry := self._entries.get(url)) and entry.age < entry.max_age:
+      self.hits += 1
+      API_JS_CACHE.inc("hit")
+    elif entry and entry.age < entry.max_age + self.max_stale:
+      self.stale_hits += 1
+      API_JS_CACHE.inc("stale")
+      self._revalidate(url, entry, context)
+    else:
+      self.misses += 1
+      API_JS_CACHE.inc("miss")
+      if (entry := await self._fetch(url, route)) is None:
+        return
+    await route.fulfill(status=200, headers=entry.headers, body=entry.body)
+
+  async def _fetch(self, url: str, route: Route) -> _Entry | None:
+    """Fetch the response of a miss, or wait for the one already being fetched. None if the route has been handled without a cacheable response"""
+    if (fetching := self._fetching.get(url)) is not None:
+      if (entry := await asyncio.shield(fetching)) is None:
+        await route.continue_()
+      return entry
+    self._fetching[url] = fetching = asyncio.get_running_loop().create_future()
+    entry = None
+    try:
+      response = await route.fetch()
+      if response.status != 200:
+        await route.fulfill(response=response)
+        return None
+      maxAge = _max_age(response.headers)
+      entry = _Entry(await response.body(), response.headers, maxAge or 0)
+      if maxAge is not None:
+        self._entries[url] = entry
+      return entry
+    except Exception as ex:
+      logger.warning(f"Failed to fetch api.js: {ex}")
+      try:
+        await route.continue_()
+      except Exception:
+        pass
+      return None
+    finally:
+      del self._fetching[url]
+      fetching.set_result(entry)
+
+  def _revalidate(self, url: str, entry: _Entry, context: BrowserContext):
+    if url in self._revalidating:
+      return
+    self._revalidating.add(url)
+    self._tasks.add(task := asyncio.create_task(self._refresh(url, entry, context)))
+    task.add_done_callback(self._tasks.discard)
+
+  async def _refresh(self, url: str, entry: _Entry, context: BrowserContext):
+    headers = {}
+    if etag := entry.headers.get("etag"):
+      headers["If-None-Match"] = etag
+    if lastModified := entry.headers.get("last-modified"):
+      headers["If-Modified-Since"] = lastModified
+    try:
+      response = await context.request.get(url, headers=headers)
+      maxAge = _max_age(response.headers)
+      if response.status == 304:
+        entry.fetched_at = time.monotonic()
+        # A 304 may come without Cache-Control, the cached one still applies then
+        if "cache-control" in response.headers and maxAge is not None:
+          entry.max_age = maxAge
+      elif response.status == 200:
+        if maxAge is None:
+          self._entries.pop(url, None)
+        else:
+          self._entries[url] = _Entry(await response.body(), response.headers, maxAge)
+      else:
+        raise RuntimeError(f"HTTP {response.status}")
+      self.revalidations += 1
+      API_JS_CACHE.inc("revalidated")
+    except Exception as ex:
+      self.revalidation_failures += 1
+      API_JS_CACHE.inc("revalidation_failed")
+      logger.debug(f"Failed to revalidate api.js: {ex}")
+    finally:
+      self._revalidating.discard(url)
@@ -1,13 +1,19 @@
 import asyncio
 import logging
+import time
+from pathlib import Path
 from typing import TYPE_CHECKING
 
-from patchright.async_api import Browser
+from patchright.async_api import Browser, Page, async_playwright
 
-from turnstile_solver.constants import MAX_PAGES_PER_CONTEXT, MAX_CONTEXTS
+from turnstile_solver.browser_endpoint import BrowserEndpoint
+from turnstile_solver.constants import MAX_PAGES_PER_CONTEXT, WIDGETS_PER_PAGE, MAX_CONTEXTS, MIN_IDLE_CONTEXTS, MAX_IDLE_CONTEXTS, CONTEXT_IDLE_TTL, POOL_MAINTENANCE_INTERVAL, PAGE_PARK_TTL, MEMORY_PRESSURE_THRESHOLD, STANDBY_BROWSER
 from turnstile_solver.page_pool import PagePool
 from turnstile_solver.pool import Pool
+from turnstile_solver.profile_store import ProfileStore
 from turnstile_solver.proxy_provider import ProxyProvider
+from turnstile_solver.recycle_policy import RecyclePolicy
+from turnstile_solver.utils import available_memory
 
 if TYPE_CHECKING:
   from turnstile_solver.solver import TurnstileSolver
@@ -22,50 +28,355 @@ class BrowserContextPool(Pool):
                max_pages_per_context: int = MAX_PAGES_PER_CONTEXT,
                single_instance: bool = False,
                proxy_provider: ProxyProvider | None = None,
+               min_idle: int = MIN_IDLE_CONTEXTS,
+               max_idle: int = MAX_IDLE_CONTEXTS,
+               idle_ttl: float = CONTEXT_IDLE_TTL,
+               context_recycle_policy: RecyclePolicy | None = None,
+               page_recycle_policy: RecyclePolicy | None = None,
+               widgets_per_page: int = WIDGETS_PER_PAGE,
+               page_park_ttl: float = PAGE_PARK_TTL,
+               standby_browser: bool = STANDBY_BROWSER,
+               remote_browsers: list[BrowserEndpoint] | None = None,
+               profile_store: ProfileStore | None = None,
                ):
+    """
+    :param min_idle: Idle browser contexts, with all their pages already created, kept ready in background
+    :param max_idle: Idle browser contexts kept after idle_ttl. Any idle context beyond this number is closed once it has been idle for idle_ttl seconds
+    :param idle_ttl: Seconds a surplus context can stay idle before being closed
+    :param context_recycle_policy: When to retire a browser context. A replacement is built in background before the retired one is closed
+    :param page_recycle_policy: When to retire a page, same as context_recycle_policy
+    :param widgets_per_page: Turnstile widgets a page renders at the same time, each one serving its own solve
+    :param standby_browser: Keep a browser launched in background. If the shared browser crashes it takes over right away instead of waiting for a new one to launch. With multiple browser instances, new contexts take it to skip the launch time
+    :param page_park_ttl: Seconds an idle page stays on its last site, ready for the next solve of it, before being sent back to about:blank. Parked pages are sent back right away under memory pressure
+    :param remote_browsers: Open contexts on these browsers instead of launching one locally. Each context goes to the least loaded endpoint relative to its max contexts, endpoints failing to connect are skipped for a while
+    :param profile_store: Launch a browser on a persistent profile from the store for every context, instead of opening incognito contexts. Profiles keep their HTTP cache and service workers across contexts and restarts
+    """
+    if min_idle > max_idle:
+      raise ValueError(f"min_idle ({min_idle}) can't be greater than max_idle ({max_idle})")
+
     self._solver = solver
     self._browser: Browser | None = None
     self._max_pages_per_context = max_pages_per_context
-    self._get_lock = asyncio.Lock()
+    self.widgets_per_page = widgets_per_page
+    self.page_park_ttl = page_park_ttl
+    self.standby_browser = standby_browser
+    self._standby: asyncio.Task | None = None
+    self._browser_lock = asyncio.Lock()
+    self._closed = False
     self._playwright = None
     self._proxy_provider = proxy_provider
     self._single_instance = single_instance
+    self.remote_browsers = remote_browsers or []
+    # Remote endpoint each context was opened on
+    self._endpoints: dict[PagePool, BrowserEndpoint] = {}
+    self.profile_store = profile_store
+    # Profile each persistent context was launched on
+    self._profiles: dict[PagePool, Path] = {}
+    if self.remote_browsers and all(e.max_contexts for e in self.remote_browsers):
+      max_contexts = min(max_contexts, sum(e.max_contexts for e in self.remote_browsers))
+    self.min_idle = min_idle
+    self.max_idle = max_idle
+    self.idle_ttl = idle_ttl
+    self.context_recycle_policy = context_recycle_policy
+    self.page_recycle_policy = page_recycle_policy
+    self._maintenance_task: asyncio.Task | None = None
+    self._maintenance_event = asyncio.Event()
+    # Contexts handed out whose solve hasn't leased its page yet, see _compatible()
+    self._placing: set[PagePool] = set()
 
     super().__init__(
       size=max_contexts,
       item_getter=self._page_pool_getter,
+      item_capacity=max_pages_per_context * widgets_per_page,
     )
+    self._replacement_getter = self._warm_page_pool_getter
 
   @property
   def browser(self) -> Browser | None:
     return self._browser
 
   async def init(self):
-    self._browser, _ = await self._solver.get_browser(None)
+    if self.remote_browsers:
+      await self._connect_remote_browsers()
+    elif self.profile_store:
+      await self.profile_store.cleanup()
+      if not self._playwright:
+        self._playwright = await async_playwright().start()
+    else:
+      self._browser = await self._launch_browser()
+      self._launch_standby()
+    if self.min_idle:
+      await self._fill()
+    self._maintenance_task = asyncio.create_task(self._maintain(), name="browser_context_pool_maintenance")
+
+  async def close(self):
+    self._closed = True
+    if self._maintenance_task:
+      self._maintenance_task.cancel()
+      self._maintenance_task = None
+    if self._standby:
+      self._standby.cancel()
+      self._standby = None
 
-  async def get(self) -> PagePool:
+  async def get(self, timeout: float | None = None, key=None) -> PagePool:
+    """
+    Get a PagePool with a widget slot reserved for the caller. Every get() must be matched by a put_back() once the page is back on its PagePool
+    :param key: Site URL of the solve, a context with a page parked on it is preferred
+    """
 
-    if not self._browser:
+    if not (self._browser or self.remote_browsers or self.profile_store):
       raise RuntimeError("'self._browser' instance has not been assigned. Make sure to call init() method at least once")
 
-    # logger.debug('Acquiring lock to fetch PagePool')
-    async with self._get_lock:
-      # logger.debug('Fetching PagePool')
-      for pool in self.in_use:
-        if not pool.is_full:
-          # logger.debug(f"Reusing PagePool (size = {pool.size})")
-          return pool
-      # logger.debug("Getting PagePool from pool manager")
-      return await super().get()
+    pool = await super().get(timeout, key)
+    # The caller leases its page right away, other waiters can be placed on the context once it has
+    self._placing.discard(pool)
+    if self._waiters:
+      asyncio.get_running_loop().call_soon(self._dispatch)
+    pool.placements += 1
+    logger.debug(f"Solve placed on {pool} ({self.leases(pool)} reserved)")
+    # Refill idle contexts right away instead of waiting for the next maintenance tick
+    self._maintenance_event.set()
+    return pool
+
+  def record_solve(self, pool: PagePool, page: Page, elapsed: float | None):
+    """Record a solve outcome on the page and its context, retiring any of them if their recycle policy says so"""
+    pool.record_solve(elapsed, page)
+    if self.context_recycle_policy and (reason := self.context_recycle_policy.retire_reason(
+        pool.solves + pool.failures,
+        self.age(pool),
+        pool.consecutive_failures,
+    )):
+      self.retire(pool, reason)
+
+  def stats(self) -> list[dict]:
+    return [pool.stats() for pool in self.items]
+
+  def _compatible(self, pool: PagePool, key) -> bool:
+    # Only a context able to lease a page for the site right away: a page on it with a free widget, an idle page or a free page slot.
+    # Its page pool doesn't know about a context handed out until its page is leased, so one at a time
+    return pool not in self._placing and pool.can_grant(key)
+
+  def _select(self, key=None) -> PagePool | None:
+    """A context with a page parked on the site first, then least-loaded, ties go to the context with the best recent solve latency"""
+    return min(
+      (pool for pool in self._available if self._compatible(pool, key)),
+      key=lambda pool: (not pool.parked(key), self._leases[pool], pool.latency or 0),
+      default=None,
+    )
+
+  def _acquire(self, pool: PagePool, key=None):
+    super()._acquire(pool, key)
+    self._placing.add(pool)
+
+  def _revoke(self, grant):
+    self._placing.discard(grant)
+    super()._revoke(grant)
+
+  async def _create(self, leases: int, item_getter=None, key=None) -> PagePool:
+    if not leases:
+      return await super()._create(leases, item_getter, key)
+
+    # Handed out as soon as it is added to the pool
+    async def placing():
+      pool = await self._get_item(item_getter)
+      self._placing.add(pool)
+      return pool
+
+    return await super()._create(leases, placing, key)
+
+  async def _maintain(self):
+    while True:
+      try:
+        self._recycle_expired()
+        await self._unpark()
+        await self._fill()
+        await self._shrink()
+      except Exception as ex:
+        logger.error(f"BrowserContextPool maintenance failed: {ex}")
+      try:
+        await asyncio.wait_for(self._maintenance_event.wait(), POOL_MAINTENANCE_INTERVAL)
+      except asyncio.TimeoutError:
+        pass
+      self._maintenance_event.clear()
+
+  async def _unpark(self):
+    if (free := available_memory()) is not None and free < MEMORY_PRESSURE_THRESHOLD:
+      idleFor = 0
+      logger.debug(f"Memory pressure ({free:.0%} available), unparking all idle pages")
+    else:
+      idleFor = self.page_park_ttl
+    if n := sum(await asyncio.gather(*[pool.unpark(idleFor) for pool in self.items])):
+      logger.debug(f"{n} idle pages sent back to about:blank")
+
+  async def _fill(self):
+    if (missing := self.min_idle - len(self.idle)) <= 0:
+      return
+    if pools := [p for p in await asyncio.gather(*[self.prefill(self._warm_page_pool_getter) for _ in range(missing)]) if p]:
+      logger.debug(f"{len(pools)} warm browser contexts added. Idle: {len(self.idle)}")
+
+  async def _shrink(self):
+    idle = sorted(self.idle, key=self.idle_time, reverse=True)
+    for pool in idle[:max(0, len(idle) - self.max_idle)]:
+      if self.idle_time(pool) < self.idle_ttl:
+        break
+      self.remove(pool)
+      await self._close_page_pool(pool)
+      logger.debug(f"Browser context idle for more than {self.idle_ttl} seconds closed. Contexts: {len(self.items)}")
+
+  def _recycle_expired(self):
+    maxAge = self.context_recycle_policy.max_age if self.context_recycle_policy else None
+    for pool in self.items:
+      if maxAge and self.age(pool) >= maxAge:
+        self.retire(pool, f"{int(self.age(pool))} seconds old")
+      else:
+        pool.recycle_expired()
+
+  async def _close_item(self, pool: PagePool):
+    await self._close_page_pool(pool)
+
+  async def _close_page_pool(self, pool: PagePool):
+    if endpoint := self._endpoints.pop(pool, None):
+      endpoint.contexts -= 1
+    profile = self._profiles.pop(pool, None)
+    try:
+      # A persistent context closes its browser along
+      await pool.close()
+      if not self._single_instance and not endpoint and not profile:
+        await pool.context.browser.close()
+    except Exception as ex:
+      logger.warning(f"Failed to close browser context: {ex}")
+    if profile:
+      await self.profile_store.release(profile)
 
   async def _page_pool_getter(self):
     proxy = self._proxy_provider.get() if self._proxy_provider else None
     proxy and logger.debug(f"Using proxy: '{proxy.server}'")
-    logger.debug(f"Getting browser context for browser: '{self._browser}'")
+    if self.remote_browsers:
+      return await self._remote_page_pool(proxy)
+    if self.profile_store:
+      return await self._persistent_page_pool(proxy)
+    browser = await self._live_browser() if self._single_instance else await self._take_standby()
+    logger.debug(f"Getting browser context for browser: '{browser}'")
     context, self._playwright = await self._solver.get_browser_context(
-      browser=self._browser if self._single_instance else None,
+      browser=browser,
       playwright=self._playwright,
       proxy=proxy,
     )
-    pool = PagePool(context, self._max_pages_per_context)
-    return pool
\ No newline at end of file
+    pool = PagePool(context, self._max_pages_per_context, self.page_recycle_policy, self.widgets_per_page)
+    if browser is None:
+      # Launched along with the context
+      context.browser.on("disconnected", self._on_browser_disconnected)
+    context.on("close", lambda _: self._lose(pool, "Browser context closed"))
+    return pool
+
+  async def _remote_page_pool(self, proxy) -> PagePool:
+    """Open a context on the least loaded remote browser, moving on to the next one if it can't be reached"""
+    tried = set()
+    while endpoint := min([e for e in self.remote_browsers if e.available and e not in tried], key=lambda e: (not e.connected, e.load), default=None):
+      tried.add(endpoint)
+      # Counted right away, so concurrent context creations spread over endpoints
+      endpoint.contexts += 1
+      try:
+        browser = await self._connect(endpoint)
+        context, self._playwright = await self._solver.get_browser_context(
+          browser=browser,
+          playwright=self._playwright,
+          proxy=proxy,
+        )
+      except Exception as ex:
+        endpoint.contexts -= 1
+        if not endpoint.connected:
+          endpoint.mark_failed()
+        logger.warning(f"Failed to open a browser context on remote browser '{endpoint.url}': {ex}")
+        continue
+      pool = PagePool(context, self._max_pages_per_context, self.page_recycle_policy, self.widgets_per_page)
+      self._endpoints[pool] = endpoint
+      context.on("close", lambda _: self._lose(pool, "Browser context closed"))
+      logger.debug(f"Browser context opened on remote browser '{endpoint.url}' ({endpoint.contexts} contexts)")
+      return pool
+    raise RuntimeError("No remote browser available")
+
+  async def _persistent_page_pool(self, proxy) -> PagePool:
+    profile = await self.profile_store.acquire()
+    try:
+      context, self._playwright = await self._solver.get_persistent_context(
+        user_data_dir=profile,
+        playwright=self._playwright,
+        proxy=proxy,
+      )
+    except BaseException:
+      await self.profile_store.release(profile)
+      raise
+    pool = PagePool(context, self._max_pages_per_context, self.page_recycle_policy, self.widgets_per_page)
+    self._profiles[pool] = profile
+    context.on("close", lambda _: self._lose(pool, "Browser closed"))
+    return pool
+
+  async def _connect(self, endpoint: BrowserEndpoint) -> Browser:
+    if endpoint.connected:
+      return endpoint.browser
+    if not self._playwright:
+      self._playwright = await async_playwright().start()
+    return await endpoint.connect(self._playwright, on_disconnected=self._on_browser_disconnected)
+
+  async def _connect_remote_browsers(self):
+    if not self._playwright:
+      self._playwright = await async_playwright().start()
+    results = await asyncio.gather(*[self._connect(e) for e in self.remote_browsers], return_exceptions=True)
+    for endpoint, result in zip(self.remote_browsers, results):
+      if isinstance(result, BaseException):
+        logger.warning(f"Failed to connect to remote browser '{endpoint.url}': {result}")
+    if not any(e.connected for e in self.remote_browsers):
+      raise RuntimeError("Could not connect to any remote browser")
+
+  async def _launch_browser(self) -> Browser:
+    browser, self._playwright = await self._solver.get_browser(self._playwright)
+    browser.on("disconnected", self._on_browser_disconnected)
+    return browser
+
+  def _launch_standby(self):
+    if self.standby_browser and not self._standby and not self._closed:
+      self._standby = asyncio.create_task(self._launch_browser(), name="standby_browser")
+
+  async def _take_standby(self) -> Browser | None:
+    """The standby browser, once launched, if any. Another one is launched in its place"""
+    if not (standby := self._standby):
+      return None
+    self._standby = None
+    self._launch_standby()
+    try:
+      browser = await standby
+    except Exception as ex:
+      logger.warning(f"Standby browser failed to launch: {ex}")
+      return None
+    return browser if browser.is_connected() else None
+
+  async def _live_browser(self) -> Browser:
+    """The shared browser, replaced by the standby one, or a new one, if it's gone"""
+    async with self._browser_lock:
+      if not self._browser.is_connected():
+        startTime = time.perf_counter()
+        self._browser = await self._take_standby() or await self._launch_browser()
+        logger.info(f"Browser replaced in {time.perf_counter() - startTime:.3f} seconds")
+      return self._browser
+
+  def _on_browser_disconnected(self, browser: Browser):
+    if self._closed:
+      return
+    if pools := [pool for pool in [*self.items, *self._retiring] if pool.context.browser is browser]:
+      logger.error(f"Browser disconnected, {len(pools)} browser contexts lost")
+    for pool in pools:
+      self._lose(pool, "Browser disconnected")
+    if browser is self._browser:
+      # Fail over now rather than on the next context creation
+      self._spawn(self._live_browser())
+
+  def _lose(self, pool: PagePool, reason: str):
+    """Fail the solves running on a context that's gone and replace it"""
+    pool.lose(reason)
+    self.retire(pool, reason)
+
+  async def _warm_page_pool_getter(self):
+    pool = await self._page_pool_getter()
+    await pool.warm_up()
+    return pool
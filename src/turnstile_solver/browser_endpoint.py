@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import re
+import time
+from typing import Callable
+
+from patchright.async_api import Browser, Playwright
+
+from turnstile_solver.constants import REMOTE_BROWSER_RETRY_DELAY, REMOTE_BROWSER_MAX_RETRY_DELAY
+
+logger = logging.getLogger(__name__)
+
+# Browser-level DevTools WebSocket, as listed by http://host:port/json/version
+_CDP_WS_PATH_RE = re.compile(r'^wss?://[^/]+/devtools/browser/')
+
+
+class BrowserEndpoint:
+  def __init__(self, url: str, max_contexts: int | None = None):
+    """
+    Browser running on another host. Either a Playwright browser server WebSocket URL (`launch-server`) or a Chrome DevTools Protocol endpoint,
+    as an http(s):// URL or a ws://host:port/devtools/browser/<id> URL
+    :param max_contexts: Browser contexts opened on it at most, None for no limit besides the pool size
+    """
+    self.url = url
+    self.max_contexts = max_contexts
+    self.browser: Browser | None = None
+    # Open browser contexts, or being opened
+    self.contexts = 0
+    self.failures = 0
+    # time.monotonic() before which a failed endpoint isn't tried again
+    self.retry_at = 0.
+    self._connect_lock = asyncio.Lock()
+
+  @property
+  def cdp(self) -> bool:
+    return self.url.startswith(("http://", "https://")) or bool(_CDP_WS_PATH_RE.match(self.url))
+
+  @property
+  def connected(self) -> bool:
+    return self.browser is not None and self.browser.is_connected()
+
+  @property
+  def available(self) -> bool:
+    """Room for another context, and not backing off after a failure"""
+    return (self.max_contexts is None or self.contexts < self.max_contexts) and time.monotonic() >= self.retry_at
+
+  @property
+  def load(self) -> float:
+    return self.contexts / self.max_contexts if self.max_contexts else self.contexts
+
+  async def connect(self, playwright: Playwright, on_disconnected: Callable[[Browser], None] | None = None) -> Browser:
+    """
+    The connected browser, connecting first if needed. Failures back off exponentially before the endpoint is tried again
+    :param on_disconnected: Registered on every new connection
+    """
+    async with self._connect_lock:
+      if self.connected:
+        return self.browser
+      try:
+        if self.cdp:
+          self.browser = await playwright.chromium.connect_over_cdp(self.url)
+        else:
+          self.browser = await playwright.chromium.connect(self.url)
+      except Exception:
+        self.mark_failed()
+        raise
+      if on_disconnected:
+        self.browser.on("disconnected", on_disconnected)
+      self.failures = 0
+      logger.info(f"Connected to remote browser '{self.url}'")
+      return self.browser
+
+  def mark_failed(self):
+    self.browser = None
+    self.failures += 1
+    self.retry_at = time.monotonic() + min(REMOTE_BROWSER_MAX_RETRY_DELAY, REMOTE_BROWSER_RETRY_DELAY * 2 ** (self.failures - 1))
+
+  def __repr__(self) -> str:
+    return f"BrowserEndpoint({self.url!r})"
@@ -0,0 +1,52 @@
+import logging
+from inspect import isawaitable
+from types import NoneType
+from typing import Callable, Any, Awaitable
+
+from turnstile_solver.enums import CaptchaApiMessageEvent
+from turnstile_solver.metrics import CAPTCHA_EVENTS
+
+logger = logging.getLogger(__name__)
+
+
+class CaptchaEventDispatcher:
+  """Routes Turnstile API message events, whatever transport they arrive through, to the handler subscribed for their result ID"""
+
+  MessageEventHandler = Callable[[CaptchaApiMessageEvent, dict[str, Any]], NoneType | Awaitable[None]]
+
+  def __init__(self, ignore_food_events: bool = False):
+    self.ignore_food_events = ignore_food_events
+    self._handlers: dict[str, CaptchaEventDispatcher.MessageEventHandler] = {}
+
+  def subscribe(self, id: str, handler: MessageEventHandler):
+    logger.debug(f"Captcha message event handler with id '{id}' subscribed")
+    self._handlers[id] = handler
+
+  def unsubscribe(self, id: str):
+    logger.debug(f"Captcha message event handler with id '{id}' unsubscribed")
+    self._handlers.pop(id, None)
+
+  async def dispatch(self, id: str | None, data: dict[str, Any]):
+    """
+    Raises ValueError if the message is malformed, LookupError if there's no handler for it
+    """
+    evt: CaptchaApiMessageEvent | str | None = data.pop('event', None)
+    if not evt:
+      raise ValueError(f"message has no event entry. Data: {data}")
+    try:
+      evt = CaptchaApiMessageEvent(evt)
+    except ValueError:
+      raise ValueError(f"Unknown event: '{evt}'")
+    CAPTCHA_EVENTS.inc(evt.value)
+
+    if not id:
+      raise ValueError("id parameter not specified")
+
+    if not self._handlers:
+      raise LookupError("There's no handlers for handling captcha event")
+    if not (handler := self._handlers.get(id)):
+      raise LookupError(f"There's no handler for handling event with ID: {id}")
+    if evt != CaptchaApiMessageEvent.FOOD or not self.ignore_food_events:
+      logger.debug(f"Dispatching '{evt.value}' event")
+    if isawaitable(a := handler(evt, data)):
+      await a
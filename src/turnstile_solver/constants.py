@@ -13,49 +13,224 @@ HTML_TEMPLATE = '''
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Turnstile Solver</title>
     <script>
-        window.addEventListener("message", m => {{
-           if (m.origin !== "https://challenges.cloudflare.com" || !!m.data === false) return;
-
-           fetch("http://127.0.0.1:{local_server_port}/{local_callback_endpoint}?id={id}", {{
-             method: "POST",
-             body: JSON.stringify(m.data),
-             headers: {{
-               "Content-type": "application/json; charset=UTF-8",
-               Secret: "{secret}",
-             }},
-           }})
-          .catch(e => console.error("Error sending message to local server:", e))
-          .then(data => {{
-            console.log("Message sent to local server. Data:", data)
+        (() => {{
+          const allowedEvents = {allowed_events};
+          const stats = {event_stats_js} = {{received: 0, forwarded: 0}};
+          // Solve of the widget rendered by the page itself, handed over to the next solve when the page is reused
+          window.__solveId = {default_id};
+          // Turnstile widget id -> solve id, for widgets rendered with __renderWidget()
+          const widgets = {{}};
+          const pending = new Map();
+          const forward = (id, data) => {{
+            {forward_event}
+          }};
+          const flush = () => {{
+            for (const data of pending.values()) {{
+              const id = widgets[data.widgetId] ?? window.__solveId;
+              // Widget already removed
+              if (id == null) continue;
+              stats.forwarded++;
+              forward(id, data);
+            }}
+            pending.clear();
+          }};
+          window.addEventListener("message", m => {{
+            if (m.origin !== "https://challenges.cloudflare.com" || !!m.data === false) return;
+            stats.received++;
+            if (allowedEvents && !allowedEvents.includes(m.data.event)) return;
+            // Coalesce redundant events received within the same tick, latest one wins
+            if (!pending.size) setTimeout(flush, 0);
+            pending.set(`${{m.data.widgetId}}:${{m.data.event}}`, m.data);
           }});
-        }});
+          const loaded = new Promise(resolve => window.__onTurnstileLoad = resolve);
+          // Render a widget of its own for a solve, returns the Turnstile widget id
+          window.__renderWidget = async (id, sitekey) => {{
+            await loaded;
+            const container = document.createElement("div");
+            container.id = `w-${{id}}`;
+            container.style = "display: inline-block; background: white;";
+            document.body.appendChild(container);
+            const widgetId = turnstile.render(container, {{sitekey}});
+            widgets[widgetId] = id;
+            return widgetId;
+          }};
+          window.__removeWidget = widgetId => {{
+            const id = widgets[widgetId];
+            delete widgets[widgetId];
+            try {{
+              turnstile.remove(widgetId);
+            }} catch (e) {{}}
+            document.getElementById(`w-${{id}}`)?.remove();
+          }};
+        }})();
     </script>
-    <script src="https://challenges.cloudflare.com/turnstile/v0/api.js?onload=onloadTurnstileCallback"
+    <script src="https://challenges.cloudflare.com/turnstile/v0/api.js?{api_js_query}"
             async=""
             defer="">
     </script>
 </head>
 <body>
-<div class="cf-turnstile" data-sitekey="{site_key}" style="display: inline-block; background: white;"></div>
+{body}
 </body>
 </html>
 '''
 
+# Widget rendered by the page itself, for pages serving a single solve
+WIDGET_HTML_TEMPLATE = '<div class="cf-turnstile" data-sitekey="{site_key}" style="display: inline-block; background: white;"></div>'
+
+# Captcha event forwarders, the solve id is available as `id` and the message data as `data`
+HTTP_EVENT_FORWARDER_TEMPLATE = '''
+            fetch(`http://{callback_host}:{local_server_port}/{local_callback_endpoint}?id=${{encodeURIComponent(id)}}`, {{
+              method: "POST",
+              body: JSON.stringify(data),
+              headers: {{
+                "Content-type": "application/json; charset=UTF-8",
+                Secret: "{secret}",
+              }},
+            }})
+            .catch(e => console.error("Error sending message to local server:", e))
+            .then(res => {{
+              console.log("Message sent to local server. Response:", res)
+            }});
+'''
+
+BINDING_EVENT_FORWARDER_TEMPLATE = '''
+            window.{binding_name}(id, data)
+              .catch(e => console.error("Error sending message to solver:", e));
+'''
+
+# Captcha events received/forwarded by the page script since it was loaded
+CAPTCHA_EVENT_STATS_JS = "window.__captchaEventStats"
+
+TURNSTILE_API_JS_URL = "https://challenges.cloudflare.com/turnstile/v0/api.js"
+# Seconds a cached api.js is still served past its Cache-Control max-age while it's revalidated in background
+API_JS_CACHE_MAX_STALE = 3600
+
+# Resets a widget of a loaded page, the only one if no widget id is given. False if there's no working widget to reset
+RESET_WIDGET_JS = """
+  widgetId => {
+    try {
+      window.turnstile.reset(widgetId ?? undefined);
+      return true;
+    } catch (e) {
+      return false;
+    }
+  }
+"""
+
+# Hands the widget of a page parked on the site over to solve `id` and resets it. False if the page has no working widget for the site key
+REUSE_PAGE_JS = """
+  ([id, siteKey]) => {
+    if (document.querySelector('.cf-turnstile')?.dataset.sitekey !== siteKey || typeof window.turnstile?.reset !== 'function') return false;
+    window.__solveId = id;
+    Object.assign(window.__captchaEventStats, {received: 0, forwarded: 0});
+    try {
+      window.turnstile.reset();
+      return true;
+    } catch (e) {
+      return false;
+    }
+  }
+"""
+
+# Whether the page has the solver page script loaded, widgets can be rendered on it then
+WIDGET_PAGE_LOADED_JS = "typeof window.__renderWidget === 'function'"
+RENDER_WIDGET_JS = "([id, siteKey]) => window.__renderWidget(id, siteKey)"
+REMOVE_WIDGET_JS = "widgetId => window.__removeWidget(widgetId)"
+
 TOKEN_JS_SELECTOR = "document.querySelector('[name=cf-turnstile-response]')?.value"
 
 PROJECT_HOME_DIR = Path.home() / '.turnstile_solver'
 
+# Persistent browser profiles
+PROFILES_DIR = PROJECT_HOME_DIR / 'profiles'
+PROFILE_MAX_SIZE = 256 * 2 ** 20
+# Unused profiles are deleted after a week
+PROFILE_MAX_IDLE = 7 * 24 * 60 * 60
+# Removed in this order from a profile bigger than PROFILE_MAX_SIZE: crash dumps and compiled code/shader caches first,
+# the HTTP cache and service worker state last since they're what make first solves fast
+PROFILE_COMPACTION_PATHS = (
+  "Crashpad",
+  "Default/Code Cache",
+  "Default/GPUCache",
+  "GrShaderCache",
+  "GraphiteDawnCache",
+  "ShaderCache",
+  "Default/Cache",
+  "Default/Service Worker",
+)
+
 HOST = "0.0.0.0"
 PORT = 8088
 CAPTCHA_EVENT_CALLBACK_ENDPOINT = '/api_js_message_callback'
+# Host pages POST captcha events to with the http event transport. Must be reachable from remote browsers
+CALLBACK_HOST = "127.0.0.1"
+CAPTCHA_EVENT_BINDING_NAME = '__captchaApiMessageEvent'
+CAPTCHA_EVENT_TRANSPORT = "binding"
 
 SECRET = "jWRN7DH6"
+# Solve timelines waiting to be written to the trace file, newer ones are dropped beyond it
+TRACE_EXPORT_MAX_QUEUE = 10000
+
+# Multi-process mode. Workers listen on 127.0.0.1, on the ports following the dispatcher one
+WORKERS = 1
+WORKER_CHECK_INTERVAL = 1
+# A worker that dies sooner than this after starting waits WORKER_RESTART_DELAY seconds before being restarted, so a crash loop doesn't spin
+WORKER_MIN_UPTIME = 60
+WORKER_RESTART_DELAY = 5
+WORKER_STOP_TIMEOUT = 10
 
 MAX_ATTEMPTS_TO_SOLVE_CAPTCHA = 3
 CAPTCHA_ATTEMPT_TIMEOUT = 15
+RESET_WIDGET_ON_RETRY = True
 MAX_CONTEXTS = 40
 MAX_PAGES_PER_CONTEXT = 2
+WIDGETS_PER_PAGE = 1
 PAGE_LOAD_TIMEOUT = 20
+MIN_IDLE_CONTEXTS = 1
+MAX_IDLE_CONTEXTS = 4
+# Seconds an idle page stays parked on its last site before being sent back to about:blank
+PAGE_PARK_TTL = 300
+# Parked pages are sent back to about:blank right away when the available memory fraction drops below this
+MEMORY_PRESSURE_THRESHOLD = 0.1
+CONTEXT_IDLE_TTL = 120
+POOL_MAINTENANCE_INTERVAL = 5
+# Keep a browser launched in background to replace the shared one right away if it crashes
+STANDBY_BROWSER = True
+# Xvfb virtual displays headful browsers are spread over, 0 to use the DISPLAY the server runs on
+VIRTUAL_DISPLAYS = 0
+XVFB_EXECUTABLE = "Xvfb"
+# Width x height x depth
+VIRTUAL_DISPLAY_SCREEN = "1920x1080x24"
+VIRTUAL_DISPLAY_START_TIMEOUT = 10
+# Seconds between health checks. A display whose Xvfb exited or doesn't accept connections is restarted
+VIRTUAL_DISPLAY_CHECK_INTERVAL = 5
+VIRTUAL_DISPLAY_CHECK_TIMEOUT = 2
+# Seconds a remote browser endpoint is left alone after failing to connect, doubled on every failure in a row up to the max
+REMOTE_BROWSER_RETRY_DELAY = 5
+REMOTE_BROWSER_MAX_RETRY_DELAY = 120
+# Times a solve is moved to another page when its page crashes or its browser goes away
+PAGE_LOST_RETRIES = 2
+PAGE_MAX_SOLVES = 100
+PAGE_MAX_AGE = 30 * 60
+CONTEXT_MAX_SOLVES = 1000
+CONTEXT_MAX_AGE = 2 * 60 * 60
+MAX_CONSECUTIVE_FAILURES = 3
+TOKEN_BANK_SIZE = 5
+# Turnstile tokens are valid for 300 seconds
+TOKEN_TTL = 240
+TOKEN_BANK_REFILL_INTERVAL = 1
+TOKEN_BANK_FAILURE_BACKOFF = 10
+MAX_BATCH_SIZE = 200
+WS_MAX_IN_FLIGHT = 1000
+
+# Admission control
+ADMISSION_MAX_QUEUE = 100
+SOLVE_BUDGET = 60
+MAX_JOBS = 10000
+JOB_TTL = 10 * 60
+JOB_MAX_WAIT = 60
+WEBHOOK_TIMEOUT = 10
 BROWSER_POSITION = 2000, 2000
 BROWSER = "chrome"
 BROWSERS = [
@@ -0,0 +1,381 @@
+import asyncio
+import logging
+import os
+import signal
+import time
+from multiprocessing.process import BaseProcess
+from typing import AsyncIterator, Callable
+
+import h11
+from quart import Quart, Response, request, websocket
+from wsproto import ConnectionType, WSConnection
+from wsproto.events import AcceptConnection, BytesMessage, CloseConnection, Message, Ping, RejectConnection, Request, TextMessage
+
+from turnstile_solver.constants import HOST, PORT, WORKER_CHECK_INTERVAL, WORKER_MIN_UPTIME, WORKER_RESTART_DELAY, WORKER_STOP_TIMEOUT
+from turnstile_solver.metrics import Registry
+
+logger = logging.getLogger(__name__)
+
+WORKER_HOST = "127.0.0.1"
+NO_WORKER_ERROR = "No worker available"
+
+# Headers about the client connection, not the request itself
+_HOP_BY_HOP = {"connection", "keep-alive", "proxy-connection", "transfer-encoding", "te", "trailer", "upgrade", "host", "content-length"}
+# Set again by the dispatcher server
+_RESPONSE_DROPPED = _HOP_BY_HOP | {"date", "server"}
+_READ_SIZE = 65536
+
+
+class Worker:
+  def __init__(self, index: int, port: int):
+    self.index = index
+    self.port = port
+    self.process: BaseProcess | None = None
+    self.started_at = 0.
+    # time.monotonic() before which a crashed worker isn't restarted
+    self.restart_at = 0.
+    # Accepting requests
+    self.ready = False
+    # Requests and WebSocket connections being served
+    self.in_flight = 0
+    self.dispatched = 0
+    self.restarts = 0
+
+  @property
+  def alive(self) -> bool:
+    return self.process is not None and self.process.is_alive()
+
+  def __repr__(self) -> str:
+    return f"Worker({self.index}, port={self.port})"
+
+
+def job_worker(job_id: str) -> int | None:
+  """Index of the worker owning the job, from its id prefix"""
+  prefix, sep, _ = job_id.partition("-")
+  return int(prefix) if sep and prefix.isdigit() else None
+
+
+def merge_metrics(texts: dict[int, str]) -> str:
+  """Merge worker index -> Prometheus exposition into one, every sample labelled with its worker"""
+  comments: dict[str, list[str]] = {}
+  samples: dict[str, list[str]] = {}
+  for index, text in texts.items():
+    family = ""
+    for line in text.splitlines():
+      if not line.strip():
+        continue
+      if line.startswith("#"):
+        if len(parts := line.split(" ", 3)) > 2:
+          family = parts[2]
+        if line not in (familyComments := comments.setdefault(family, [])):
+          familyComments.append(line)
+        samples.setdefault(family, [])
+      else:
+        samples.setdefault(family, []).append(_add_label(line, "worker", str(index)))
+  return "\n".join(line for family in samples for line in (*comments.get(family, []), *samples[family])) + "\n"
+
+
+def _add_label(sample: str, name: str, value: str) -> str:
+  metric, brace, rest = sample.partition("{")
+  if brace:
+    return f'{metric}{{{name}="{value}",{rest}'
+  metric, _, number = sample.partition(" ")
+  return f'{metric}{{{name}="{value}"}} {number}'
+
+
+class _Exchange:
+  """One HTTP/1.1 request to a worker, on a connection of its own"""
+
+  def __init__(self, port: int):
+    self.port = port
+    self._conn = h11.Connection(h11.CLIENT)
+    self._reader: asyncio.StreamReader | None = None
+    self._writer: asyncio.StreamWriter | None = None
+
+  async def send(self, method: str, target: str, headers: list[tuple[str, str]], body: bytes = b"") -> h11.Response:
+    """Send the request and wait for the response head. Raises OSError or h11.ProtocolError if the worker can't be reached or goes away"""
+    self._reader, self._writer = await asyncio.open_connection(WORKER_HOST, self.port)
+    headers = [*headers, ("Host", f"{WORKER_HOST}:{self.port}"), ("Content-Length", str(len(body))), ("Connection", "close")]
+    data = self._conn.send(h11.Request(method=method, target=target, headers=headers))
+    if body:
+      data += self._conn.send(h11.Data(data=body))
+    self._writer.write(data + self._conn.send(h11.EndOfMessage()))
+    await self._writer.drain()
+    while not isinstance(event := await self._next_event(), h11.Response):
+      pass
+    return event
+
+  async def body(self) -> AsyncIterator[bytes]:
+    try:
+      while not isinstance(event := await self._next_event(), h11.EndOfMessage):
+        if isinstance(event, h11.Data):
+          yield bytes(event.data)
+    finally:
+      self.close()
+
+  async def read(self) -> bytes:
+    return b"".join([chunk async for chunk in self.body()])
+
+  def close(self):
+    if self._writer:
+      self._writer.close()
+
+  async def _next_event(self):
+    while (event := self._conn.next_event()) is h11.NEED_DATA:
+      self._conn.receive_data(await self._reader.read(_READ_SIZE))
+    return event
+
+
+class Dispatcher:
+  def __init__(self,
+               start_worker: Callable[[int, int], BaseProcess],
+               workers: int,
+               host: str = HOST,
+               port: int = PORT,
+               disable_access_logs: bool = True,
+               ):
+    """
+    Front server of the multi-process mode. Each worker process is a whole solver server, with its own browser pool and captcha callback port.
+    Requests go to the worker with the fewest requests in flight, job lookups to the worker that created the job. Workers that die are restarted
+    :param start_worker: Starts the worker with the given index listening on the given port, returning its process
+    :param workers: Worker processes. Worker i listens on 127.0.0.1, port + 1 + i
+    """
+    if disable_access_logs:
+      logging.getLogger('hypercorn.access').disabled = True
+    self.app = Quart(__name__)
+    self.host = host
+    self.port = port
+    self.workers = [Worker(i, port + 1 + i) for i in range(workers)]
+    self._start_worker = start_worker
+    self._supervisor: asyncio.Task | None = None
+
+    self.registry = Registry()
+    self._restarts = self.registry.counter("turnstile_dispatcher_worker_restarts_total", "Worker processes restarted after exiting", labels=("worker",))
+    self.registry.gauge("turnstile_dispatcher_in_flight", "Requests and WebSocket connections being served per worker", lambda: {(str(w.index),): w.in_flight for w in self.workers}, labels=("worker",))
+    self.registry.gauge("turnstile_dispatcher_workers", "Worker processes accepting requests (ready) or not (down)", lambda: {
+      ("ready",): sum(w.ready for w in self.workers),
+      ("down",): sum(not w.ready for w in self.workers),
+    }, labels=("state",))
+
+    self._setup_routes()
+
+  def _setup_routes(self) -> None:
+    methods = ["GET", "POST", "OPTIONS"]
+    self.app.get('/metrics')(self._metrics)
+    self.app.websocket('/ws')(self._websocket)
+    self.app.route('/', methods=methods)(self._proxy)
+    self.app.route('/<path:path>', methods=methods)(self._proxy)
+
+  async def run(self, debug: bool = False):
+
+    async def beforeServing():
+      self._supervisor = asyncio.create_task(self._supervise())
+      logger.info(f"Dispatcher up and running with {len(self.workers)} workers")
+
+    async def afterServing():
+      self._supervisor.cancel()
+      await self.stop_workers()
+      logger.info("Dispatcher is down")
+
+    self.app.before_serving(beforeServing)
+    self.app.after_serving(afterServing)
+    await self.app.run_task(
+      host=self.host,
+      port=self.port,
+      debug=debug,
+    )
+
+  def pick(self, path: str = "") -> Worker | None:
+    """Worker owning the job for /jobs/<id> paths, else the ready worker with the fewest requests in flight. None if it isn't ready"""
+    if path.startswith("jobs/") and (index := job_worker(path[5:])) is not None:
+      return worker if index < len(self.workers) and (worker := self.workers[index]).ready else None
+    if ready := [w for w in self.workers if w.ready]:
+      return min(ready, key=lambda w: (w.in_flight, w.dispatched))
+    return None
+
+  async def stop_workers(self):
+    """Interrupt workers so they close their browsers, killing the ones still running after WORKER_STOP_TIMEOUT seconds"""
+    processes = [w.process for w in self.workers if w.alive]
+    for process in processes:
+      try:
+        os.kill(process.pid, signal.SIGINT)
+      except OSError:
+        pass
+    await asyncio.gather(*[asyncio.to_thread(process.join, WORKER_STOP_TIMEOUT) for process in processes])
+    for process in processes:
+      if process.is_alive():
+        logger.warning(f"Worker process {process.pid} didn't stop in time, killing it")
+        process.kill()
+    for worker in self.workers:
+      worker.ready = False
+
+  async def _supervise(self):
+    while True:
+      for worker in self.workers:
+        if worker.alive:
+          if not worker.ready and await self._probe(worker):
+            worker.ready = True
+            logger.info(f"Worker {worker.index} ready on port {worker.port}")
+          continue
+        if worker.process is not None:
+          worker.ready = False
+          worker.restarts += 1
+          self._restarts.inc(str(worker.index))
+          crashLoop = time.monotonic() - worker.started_at < WORKER_MIN_UPTIME
+          worker.restart_at = time.monotonic() + (WORKER_RESTART_DELAY if crashLoop else 0)
+          logger.error(f"Worker {worker.index} (pid {worker.process.pid}) exited with code {worker.process.exitcode}, restarting it{f' in {WORKER_RESTART_DELAY} seconds' if crashLoop else ''}")
+          worker.process = None
+        if time.monotonic() >= worker.restart_at:
+          self._start(worker)
+      await asyncio.sleep(WORKER_CHECK_INTERVAL)
+
+  def _start(self, worker: Worker):
+    worker.started_at = time.monotonic()
+    try:
+      worker.process = self._start_worker(worker.index, worker.port)
+      logger.debug(f"Worker {worker.index} started, pid: {worker.process.pid}")
+    except Exception as ex:
+      worker.restart_at = time.monotonic() + WORKER_RESTART_DELAY
+      logger.error(f"Failed to start worker {worker.index}: {ex}")
+
+  async def _probe(self, worker: Worker) -> bool:
+    """Whether the worker server answers. Any response will do, it just has to be listening"""
+    exchange = _Exchange(worker.port)
+    try:
+      await asyncio.wait_for(exchange.send("GET", "/", []), WORKER_CHECK_INTERVAL)
+      return True
+    except (OSError, h11.ProtocolError, asyncio.TimeoutError):
+      return False
+    finally:
+      exchange.close()
+
+  async def _proxy(self, path: str = ""):
+    body = await request.get_data()
+    target = request.full_path if request.query_string else request.path
+    headers = _forwarded_headers(request.headers)
+    # A worker that can't be reached is given up on and the request goes to the next one, it can't have been served
+    while worker := self.pick(path):
+      exchange = _Exchange(worker.port)
+      worker.in_flight += 1
+      worker.dispatched += 1
+      try:
+        response = await exchange.send(request.method, target, headers, body)
+      except (OSError, h11.ProtocolError) as ex:
+        worker.in_flight -= 1
+        worker.ready = False
+        exchange.close()
+        logger.warning(f"Worker {worker.index} unreachable: {ex!r}")
+        continue
+      except BaseException:
+        # Cancelled before the response is handed to the stream below, e.g. the client went away
+        worker.in_flight -= 1
+        exchange.close()
+        raise
+
+      async def stream(worker: Worker = worker, exchange: _Exchange = exchange):
+        try:
+          async for chunk in exchange.body():
+            yield chunk
+        finally:
+          worker.in_flight -= 1
+
+      return Response(stream(), status=response.status_code, headers=[
+        (k.decode("latin-1"), v.decode("latin-1")) for k, v in response.headers if k.decode("latin-1") not in _RESPONSE_DROPPED
+      ])
+    logger.error(NO_WORKER_ERROR)
+    return {"status": "error", "message": NO_WORKER_ERROR}, 503
+
+  async def _metrics(self):
+    """Metrics of every ready worker, labelled with its index, and the dispatcher ones"""
+    headers = _forwarded_headers(request.headers)
+
+    async def scrape(worker: Worker) -> tuple[int, bytes]:
+      exchange = _Exchange(worker.port)
+      try:
+        response = await exchange.send("GET", "/metrics", headers)
+        return response.status_code, await exchange.read()
+      finally:
+        exchange.close()
+
+    workers = [w for w in self.workers if w.ready]
+    texts = {}
+    for worker, result in zip(workers, await asyncio.gather(*[scrape(w) for w in workers], return_exceptions=True)):
+      if isinstance(result, BaseException):
+        logger.warning(f"Failed to scrape worker {worker.index} metrics: {result!r}")
+        continue
+      status, body = result
+      if status != 200:
+        # Forbidden, the secret is checked by the workers
+        return Response(body, status=status, content_type="application/json")
+      texts[worker.index] = body.decode()
+    return Response(self.registry.render() + merge_metrics(texts), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+  async def _websocket(self):
+    """Bridge the connection to a worker /ws endpoint, message by message"""
+    target = websocket.full_path if websocket.query_string else websocket.path
+    headers = [(k.encode(), v.encode()) for k, v in _forwarded_headers(websocket.headers) if k.lower() not in ("sec-websocket-key", "sec-websocket-version", "sec-websocket-extensions")]
+    while worker := self.pick():
+      try:
+        reader, writer = await asyncio.open_connection(WORKER_HOST, worker.port)
+        break
+      except OSError as ex:
+        worker.ready = False
+        logger.warning(f"Worker {worker.index} unreachable: {ex!r}")
+    else:
+      await websocket.close(1011, NO_WORKER_ERROR)
+      return
+
+    worker.in_flight += 1
+    worker.dispatched += 1
+    conn = WSConnection(ConnectionType.CLIENT)
+    events = _ws_events(reader, conn)
+    try:
+      writer.write(conn.send(Request(host=f"{WORKER_HOST}:{worker.port}", target=target, extra_headers=headers)))
+      event = await anext(events, None)
+      if not isinstance(event, AcceptConnection):
+        await websocket.close(1008 if isinstance(event, RejectConnection) and event.status_code == 403 else 1011, "Rejected by worker")
+        return
+
+      async def upstream():
+        while True:
+          writer.write(conn.send(Message(data=await websocket.receive())))
+          await writer.drain()
+
+      async def downstream() -> tuple[int, str]:
+        parts = []
+        async for event in events:
+          if isinstance(event, (TextMessage, BytesMessage)):
+            parts.append(event.data)
+            if event.message_finished:
+              await websocket.send(parts[0][:0].join(parts))
+              parts = []
+          elif isinstance(event, Ping):
+            writer.write(conn.send(event.response()))
+          elif isinstance(event, CloseConnection):
+            writer.write(conn.send(event.response()))
+            return event.code, event.reason or ""
+        raise ConnectionResetError("Worker closed the connection")
+
+      tasks = [asyncio.create_task(upstream()), down := asyncio.create_task(downstream())]
+      try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+      finally:
+        for task in tasks:
+          task.cancel()
+      if down.done() and not down.cancelled():
+        code, reason = (1011, "Worker went away") if down.exception() else down.result()
+        await websocket.close(code, reason)
+    finally:
+      worker.in_flight -= 1
+      writer.close()
+
+
+def _forwarded_headers(headers) -> list[tuple[str, str]]:
+  return [(k, v) for k, v in headers.items() if k.lower() not in _HOP_BY_HOP]
+
+
+async def _ws_events(reader: asyncio.StreamReader, conn: WSConnection):
+  while data := await reader.read(_READ_SIZE):
+    conn.receive_data(data)
+    for event in conn.events():
+      yield event
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import os
+import socket
+import sys
+from asyncio.subprocess import Process
+
+from turnstile_solver.constants import VIRTUAL_DISPLAYS, XVFB_EXECUTABLE, VIRTUAL_DISPLAY_SCREEN, VIRTUAL_DISPLAY_START_TIMEOUT, VIRTUAL_DISPLAY_CHECK_INTERVAL, VIRTUAL_DISPLAY_CHECK_TIMEOUT
+from turnstile_solver.metrics import VIRTUAL_DISPLAY_RESTARTS
+
+logger = logging.getLogger(__name__)
+
+# Where X servers listen for local clients. On Linux, also on the same path in the abstract namespace
+_X11_SOCKET_TEMPLATE = "/tmp/.X11-unix/X{number}"
+
+
+class Display:
+  def __init__(self, index: int):
+    self.index = index
+    # X display number, picked by Xvfb on every start
+    self.number: int | None = None
+    self.process: Process | None = None
+    # Browsers launched on it and still running
+    self.browsers = 0
+    self.restarts = 0
+
+  @property
+  def name(self) -> str:
+    return f":{self.number}"
+
+  @property
+  def running(self) -> bool:
+    return self.process is not None and self.process.returncode is None
+
+  def __repr__(self) -> str:
+    return f"Display({self.name!r})"
+
+
+class DisplayPool:
+  def __init__(self,
+               displays: int = VIRTUAL_DISPLAYS,
+               screen: str = VIRTUAL_DISPLAY_SCREEN,
+               xvfb_executable: str = XVFB_EXECUTABLE,
+               ):
+    """
+    Xvfb virtual displays started and watched by the solver, so headful browsers run on a bare Linux host without a desktop.
+    Browsers are spread over displays, each X server rendering the windows of a fraction of them. Displays that exit or hang are restarted
+    :param screen: Screen of every display, as WIDTHxHEIGHTxDEPTH
+    """
+    if sys.platform != "linux":
+      raise RuntimeError("Virtual displays are only supported on Linux")
+    self.screen = screen
+    self.xvfb_executable = xvfb_executable
+    self.displays = [Display(i) for i in range(displays)]
+    self._start_lock = asyncio.Lock()
+    self._monitor_task: asyncio.Task | None = None
+
+  @property
+  def started(self) -> bool:
+    return self._monitor_task is not None
+
+  async def start(self):
+    """Start every display and their health checks, once"""
+    async with self._start_lock:
+      if self.started:
+        return
+      results = await asyncio.gather(*[self._start(d) for d in self.displays], return_exceptions=True)
+      for display, result in zip(self.displays, results):
+        if isinstance(result, BaseException):
+          logger.error(f"Failed to start virtual display {display.index}: {result}")
+      if not any(d.running for d in self.displays):
+        raise RuntimeError(f"No virtual display could be started. Make sure '{self.xvfb_executable}' is installed")
+      self._monitor_task = asyncio.create_task(self._monitor(), name="display_pool_monitor")
+
+  async def close(self):
+    if self._monitor_task:
+      self._monitor_task.cancel()
+      self._monitor_task = None
+    await asyncio.gather(*[self._stop(d) for d in self.displays])
+
+  async def acquire(self) -> Display:
+    """The running display with the fewest browsers, for a browser about to be launched. Every acquire() must be matched by a release() once the browser is gone"""
+    await self.start()
+    display = min((d for d in self.displays if d.running), key=lambda d: d.browsers, default=None)
+    if display is None:
+      raise RuntimeError("No virtual display running")
+    display.browsers += 1
+    return display
+
+  def release(self, display: Display):
+    display.browsers = max(0, display.browsers - 1)
+
+  async def _start(self, display: Display):
+    read, write = os.pipe()
+    try:
+      # Xvfb picks a free display number and writes it to the pipe once it accepts connections
+      display.process = await asyncio.create_subprocess_exec(
+        self.xvfb_executable, "-displayfd", str(write), "-screen", "0", self.screen, "-nolisten", "tcp",
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
+        pass_fds=(write,),
+      )
+    except BaseException:
+      os.close(read)
+      raise
+    finally:
+      os.close(write)
+    try:
+      number = await asyncio.wait_for(asyncio.to_thread(_read_line, read), VIRTUAL_DISPLAY_START_TIMEOUT)
+    except asyncio.TimeoutError:
+      # Killing it ends the read
+      await self._stop(display)
+      raise RuntimeError(f"Xvfb didn't start after {VIRTUAL_DISPLAY_START_TIMEOUT} seconds")
+    if not number:
+      await self._stop(display)
+      raise RuntimeError(f"Xvfb exited with code {display.process.returncode}")
+    display.number = int(number)
+    logger.info(f"Virtual display {display.index} started on '{display.name}'")
+
+  async def _stop(self, display: Display):
+    if not display.running:
+      return
+    display.process.terminate()
+    try:
+      await asyncio.wait_for(display.process.wait(), VIRTUAL_DISPLAY_START_TIMEOUT)
+    except asyncio.TimeoutError:
+      display.process.kill()
+      await display.process.wait()
+
+  async def _healthy(self, display: Display) -> bool:
+    if not display.running:
+      return False
+    try:
+      await asyncio.wait_for(asyncio.to_thread(_connect_x11, display.number), VIRTUAL_DISPLAY_CHECK_TIMEOUT)
+      return True
+    except (OSError, asyncio.TimeoutError):
+      return False
+
+  async def _restart(self, display: Display):
+    if display.running:
+      logger.error(f"Virtual display '{display.name}' doesn't accept connections, restarting it. Browsers on it: {display.browsers}")
+    else:
+      logger.error(f"Virtual display {display.index} is down, restarting it. Browsers on it: {display.browsers}")
+    await self._stop(display)
+    display.restarts += 1
+    VIRTUAL_DISPLAY_RESTARTS.inc()
+    # Browsers on it exit along with their X server, the browser pool replaces them on the displays left
+    await self._start(display)
+
+  async def _monitor(self):
+    while True:
+      await asyncio.sleep(VIRTUAL_DISPLAY_CHECK_INTERVAL)
+      for display in self.displays:
+        if await self._healthy(display):
+          continue
+        try:
+          await self._restart(display)
+        except Exception as ex:
+          logger.error(f"Failed to restart virtual display {display.index}: {ex}")
+
+
+def _read_line(fd: int) -> str:
+  """Up to a newline or EOF, closing the fd"""
+  data = b""
+  try:
+    while not data.endswith(b"\n") and (chunk := os.read(fd, 16)):
+      data += chunk
+  finally:
+    os.close(fd)
+  return data.decode().strip()
+
+
+def _connect_x11(number: int):
+  path = _X11_SOCKET_TEMPLATE.format(number=number)
+  with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+    s.settimeout(VIRTUAL_DISPLAY_CHECK_TIMEOUT)
+    try:
+      s.connect(path)
+    except FileNotFoundError:
+      # /tmp/.X11-unix not writable, Xvfb only listens on the abstract socket
+      s.connect("\0" + path)
@@ -23,3 +23,16 @@ class CaptchaApiMessageEvent(Enum):
   INTERACTIVE_END = "interactiveEnd"
   WIDGET_STALE = "widgetStale"
   REQUEST_EXTRA_PARAMS = "requestExtraParams"
+
+
+class CaptchaEventTransport(Enum):
+  # Page calls a Playwright binding, events are delivered in-process
+  BINDING = "binding"
+  # Page POSTs events to TurnstileSolverServer
+  HTTP = "http"
+
+
+class JobStatus(Enum):
+  PENDING = "pending"
+  DONE = "done"
+  FAILED = "failed"
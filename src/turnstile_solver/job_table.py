@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any
+
+from turnstile_solver.constants import MAX_JOBS, JOB_TTL
+from turnstile_solver.enums import JobStatus
+from turnstile_solver.utils import password
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+  def __init__(self,
+               site_url: str,
+               site_key: str,
+               webhook_url: str | None = None,
+               id_prefix: str = "",
+               ):
+    """
+    :param id_prefix: Prepended to the random job id, so a dispatcher can tell which worker owns the job
+    """
+    self.id = id_prefix + password(16)
+    self.site_url = site_url
+    self.site_key = site_key
+    self.webhook_url = webhook_url
+    self.status = JobStatus.PENDING
+    self.token: str | None = None
+    self.elapsed: float | None = None
+    self.error: str | None = None
+    self.created_at = time.time()
+    self.finished_at: float | None = None
+    self._done = asyncio.Event()
+
+  @property
+  def finished(self) -> bool:
+    return self.status in (JobStatus.DONE, JobStatus.FAILED)
+
+  def finish(self, token: str | None = None, elapsed: float | None = None, error: str | None = None):
+    self.status = JobStatus.DONE if token else JobStatus.FAILED
+    self.token = token
+    self.elapsed = elapsed
+    self.error = error
+    self.finished_at = time.time()
+    self._done.set()
+
+  async def wait(self, timeout: float):
+    """Wait up to `timeout` seconds for the job to finish"""
+    try:
+      await asyncio.wait_for(self._done.wait(), timeout)
+    except asyncio.TimeoutError:
+      pass
+
+  def dict(self) -> dict[str, Any]:
+    return {
+      "job_id": self.id,
+      "job_status": self.status.value,
+      "token": self.token,
+      "elapsed": None if self.elapsed is None else str(self.elapsed),
+      "error": self.error,
+    }
+
+
+class JobTable:
+  def __init__(self,
+               max_jobs: int = MAX_JOBS,
+               ttl: float = JOB_TTL,
+               ):
+    """
+    :param max_jobs: Max jobs kept in memory, finished or not
+    :param ttl: Seconds a finished job is kept before being evicted
+    """
+    self.max_jobs = max_jobs
+    self.ttl = ttl
+    # Insertion ordered, so oldest jobs come first
+    self._jobs: OrderedDict[str, Job] = OrderedDict()
+    self._last_eviction = 0.
+
+  def __len__(self) -> int:
+    return len(self._jobs)
+
+  def add(self, job: Job) -> bool:
+    """Add the job, evicting expired or oldest finished jobs if the table is full. Returns False if there's no room"""
+    # Full scans at most once per second, unless the table is full
+    if len(self._jobs) >= self.max_jobs or time.monotonic() - self._last_eviction >= 1:
+      self.evict_expired()
+    if len(self._jobs) >= self.max_jobs:
+      for id, j in self._jobs.items():
+        if j.finished:
+          del self._jobs[id]
+          break
+      else:
+        return False
+    self._jobs[job.id] = job
+    return True
+
+  def get(self, id: str) -> Job | None:
+    if (job := self._jobs.get(id)) and self._expired(job):
+      del self._jobs[id]
+      return None
+    return job
+
+  def evict_expired(self):
+    self._last_eviction = time.monotonic()
+    if expired := [id for id, job in self._jobs.items() if self._expired(job)]:
+      for id in expired:
+        del self._jobs[id]
+      logger.debug(f"{len(expired)} expired jobs evicted")
+
+  def _expired(self, job: Job) -> bool:
+    return job.finished and time.time() - job.finished_at >= self.ttl
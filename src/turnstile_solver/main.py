@@ -3,10 +3,12 @@ import logging
 
 import argparse
 import random
+import sys
 import time
 
 import dotenv
 from pathlib import Path
+from typing import Awaitable, Callable, Iterable
 from threading import Thread
 
 import requests
@@ -16,17 +18,25 @@ from rich import traceback
 from rich.align import Align
 from rich.console import Group
 from rich.text import Text
+import multiprocessing
 from multiprocessing import Process
 
 import turnstile_solver.constants as c
+from turnstile_solver.profile_store import ProfileStore
 from turnstile_solver.proxy import Proxy
 from turnstile_solver.proxy_provider import ProxyProvider
+from turnstile_solver.recycle_policy import RecyclePolicy
+from turnstile_solver.enums import CaptchaEventTransport, CaptchaApiMessageEvent
+from turnstile_solver.browser_endpoint import BrowserEndpoint
 from turnstile_solver.custom_rich_help_formatter import CustomRichHelpFormatter
+from turnstile_solver.dispatcher import Dispatcher, WORKER_HOST
 from turnstile_solver.solver_console import SolverConsole
 from turnstile_solver.solver_console_highlighter import SolverConsoleHighlighter
-from turnstile_solver.solver import TurnstileSolver
+from turnstile_solver.tenants import Tenant
+from turnstile_solver.solver import TurnstileSolver, REQUIRED_CAPTCHA_EVENTS
 from turnstile_solver.utils import init_logger, simulate_intensive_task, get_file_handler, load_proxy_param
 from turnstile_solver.turnstile_solver_server import TurnstileSolverServer
+from turnstile_solver.turnstile_site import TurnstileSite
 
 _console = SolverConsole()
 
@@ -73,6 +83,15 @@ def _parse_arguments():
       raise argparse.ArgumentTypeError(f'"{value}" is not an integer')
     return value
 
+  def non_negative_integer(value):
+    try:
+      value = int(value)
+      if value < 0:
+        raise argparse.ArgumentTypeError(f'{value} is a negative integer')
+    except ValueError:
+      raise argparse.ArgumentTypeError(f'"{value}" is not an integer')
+    return value
+
   def positive_float(value):
     try:
       value = float(value)
@@ -106,6 +125,16 @@ def _parse_arguments():
   parser.add_argument("-mbi", "--multiple-browser-instances", action='store_true', help=f"Whether to use a new browser instance for each context or not. This is not recommended since it can occupy a lot more memory. Also the initialization process for each instance can take a little more time so when running for production it's recommended to make some requests to initialize some instances. See '--max-contexts'.")
   parser.add_argument("-mc", "--max-contexts", type=int, metavar="N", default=c.MAX_CONTEXTS, help=f"Max browser contexts. Default: {c.MAX_CONTEXTS}. Memory consumption increases proportionally with the number of browser contexts, specially if a new browser instance is created for each browser context.")
   parser.add_argument("-mp", "--max-pages", type=int, metavar="N", default=c.MAX_PAGES_PER_CONTEXT, help=f"Max pages per browser. Default: {c.MAX_PAGES_PER_CONTEXT}. CAPTCHA-solving speed is impacted by the number of active pages (tabs) within a browser context.")
+  parser.add_argument("-wpp", "--widgets-per-page", type=positive_integer, metavar="N", default=c.WIDGETS_PER_PAGE, help=f"Turnstile widgets rendered at the same time on a page, each one serving its own solve. Default: {c.WIDGETS_PER_PAGE}. With more than one, solves for the same site share pages and a page is only navigated once for them, so fewer pages (and less memory) serve the same number of solves.")
+  parser.add_argument("-mni", "--min-idle", type=non_negative_integer, metavar="N", default=c.MIN_IDLE_CONTEXTS, help=f"Idle browser contexts, with their pages already created and network primed, kept ready in background. Default: {c.MIN_IDLE_CONTEXTS}. Use 0 to create contexts and pages only on demand.")
+  parser.add_argument("-mxi", "--max-idle", type=non_negative_integer, metavar="N", default=c.MAX_IDLE_CONTEXTS, help=f"Idle browser contexts kept once traffic drops. Idle contexts beyond this number are closed after '--idle-ttl'. Default: {c.MAX_IDLE_CONTEXTS}.")
+  parser.add_argument("-ittl", "--idle-ttl", type=positive_float, metavar="N.", default=c.CONTEXT_IDLE_TTL, help=f"Seconds a surplus browser context can stay idle before being closed. Default: {c.CONTEXT_IDLE_TTL} seconds.")
+  parser.add_argument("-pttl", "--park-ttl", type=float, metavar="N.", default=c.PAGE_PARK_TTL, help=f"Seconds an idle page stays on its last site, so the next solve of that site reuses it without loading it again, before being sent back to about:blank. Parked pages are sent back right away under memory pressure. Default: {c.PAGE_PARK_TTL} seconds.")
+  parser.add_argument("-nsb", "--no-standby-browser", action="store_true", help=f"Do not keep a spare browser launched in background. The standby browser replaces a crashed one right away, otherwise solves wait for a new browser to launch.")
+  parser.add_argument("-rb", "--remote-browser", nargs='+', action='append', metavar=("URL", "MAX_CONTEXTS"), help=f"Open browser contexts on a browser running elsewhere instead of launching one locally: a Playwright browser server WebSocket URL (ws://host:port/...), or a Chrome DevTools Protocol endpoint (http://host:port or ws://host:port/devtools/browser/...). Optionally followed by the max browser contexts to open on it. Can be used multiple times, contexts are spread across them by load.")
+  parser.add_argument("-vd", "--virtual-displays", type=positive_integer, metavar="N", default=c.VIRTUAL_DISPLAYS, help="Run headful browsers on N Xvfb virtual displays started by the server, so no desktop or VNC server is needed. Browsers are spread over the displays and displays that die are restarted. Linux only, needs Xvfb installed.")
+  parser.add_argument("-prd", "--profiles-dir", nargs='?', const=c.PROFILES_DIR, metavar="DIR", help=f"Launch a browser on a persistent profile for every browser context instead of opening incognito contexts, so first solves start with a warm HTTP cache and service workers. Profiles are kept in DIR (default: {c.PROFILES_DIR}) and reused across restarts. Takes more memory, like '--multiple-browser-instances'.")
+  parser.add_argument("-prms", "--profile-max-size", type=positive_integer, metavar="MB", default=c.PROFILE_MAX_SIZE // 2 ** 20, help=f"Size a persistent profile can take. Bigger profiles are compacted when their context closes, deleting caches. Profiles unused for {c.PROFILE_MAX_IDLE // (24 * 60 * 60)} days are deleted. Default: {c.PROFILE_MAX_SIZE // 2 ** 20} MB.")
   parser.add_argument("-ba", "--browser-args", nargs='+', help=f"Additional browser command line arguments.")
 
   parser.add_argument("-ps", "--proxy-server", help=f"Global browser proxy server in the format: 'scheme://server:port'. Ex: http://myproxy.com:3128")
@@ -122,15 +151,39 @@ def _parse_arguments():
   solver.add_argument("-cto", "--captcha-timeout", type=positive_float, metavar="N.", default=c.CAPTCHA_ATTEMPT_TIMEOUT, help=f"Max time to wait for captcha to solve before reloading page. Default: {c.CAPTCHA_ATTEMPT_TIMEOUT} seconds.")
   solver.add_argument("-plto", "--page-load-timeout", type=positive_float, metavar="N.", default=c.CAPTCHA_ATTEMPT_TIMEOUT, help=f"Page load timeout. Default: {c.PAGE_LOAD_TIMEOUT} seconds.")
   solver.add_argument("-roo", "--reload-on-overrun", action="store_true", help=f"Reload page on captcha overrun event.")
+  solver.add_argument("-nwr", "--no-widget-reset", action="store_true", help=f"Reload the page on every retry instead of resetting the captcha widget in place after a 'fail', 'reject' or 'reloadRequest' event.")
+  solver.add_argument("-cjs", "--cache-api-js", action="store_true", help=f"Serve the Turnstile api.js from an in-memory cache shared by all browser contexts, revalidated in background according to its Cache-Control header, instead of downloading it (through the context proxy if any) on every page load.")
+  solver.add_argument("-et", "--event-transport", default=c.CAPTCHA_EVENT_TRANSPORT, choices=[t.value for t in CaptchaEventTransport], help=f"How captcha events are sent from the page to the solver. 'binding' delivers them in-process through a Playwright binding, 'http' POSTs them to the server callback endpoint. Default: {c.CAPTCHA_EVENT_TRANSPORT}.")
+  solver.add_argument("-cbh", "--callback-host", default=c.CALLBACK_HOST, help=f"Host pages send captcha events to with the 'http' event transport, on the server port. Must be reachable from remote browsers. Default: {c.CALLBACK_HOST}.")
+  solver.add_argument("-fe", "--forward-events", nargs='+', metavar="EVENT", choices=['all'] + [e.value for e in CaptchaApiMessageEvent], help=f"Captcha events forwarded by the page besides the ones the solver needs ({', '.join(sorted(e.value for e in REQUIRED_CAPTCHA_EVENTS))}). Any other event is dropped in the browser. Use 'all' to forward every event.")
   solver.add_argument("-sll", "--solver-log-level", type=int, default=logging.INFO, metavar="N", help=f"TurnstileSolver log level. Default: {logging.INFO}. CRITICAL = 50, FATAL = CRITICAL, ERROR = 40, WARNING = 30, INFO = 20, DEBUG = 10, NOTSET = 0")
 
+  # Token bank
+  tokenBank = parser.add_argument_group("Token Bank")
+  tokenBank.add_argument("-tb", "--token-bank", nargs=2, action='append', metavar=("SITE_URL", "SITE_KEY"), help=f"Keep pre-solved tokens for this site, refilled in background while the browser pool is idle. /solve requests for it are served from the bank when a token is available. Can be used multiple times.")
+  tokenBank.add_argument("-tbs", "--token-bank-size", type=positive_integer, metavar="N", default=c.TOKEN_BANK_SIZE, help=f"Tokens kept per site. Default: {c.TOKEN_BANK_SIZE}.")
+  tokenBank.add_argument("-tttl", "--token-ttl", type=positive_float, metavar="N.", default=c.TOKEN_TTL, help=f"Seconds a pre-solved token is served for. Must be lower than Turnstile token validity (300 seconds). Default: {c.TOKEN_TTL} seconds.")
+
+  # Recycling
+  recycling = parser.add_argument_group("Recycling")
+  recycling.add_argument("-pms", "--page-max-solves", type=int, metavar="N", default=c.PAGE_MAX_SOLVES, help=f"Replace a page after serving N solves. Default: {c.PAGE_MAX_SOLVES}. Use 0 to disable.")
+  recycling.add_argument("-pma", "--page-max-age", type=float, metavar="N.", default=c.PAGE_MAX_AGE, help=f"Replace a page after N seconds. Default: {c.PAGE_MAX_AGE} seconds. Use 0 to disable.")
+  recycling.add_argument("-cms", "--context-max-solves", type=int, metavar="N", default=c.CONTEXT_MAX_SOLVES, help=f"Replace a browser context after serving N solves. Default: {c.CONTEXT_MAX_SOLVES}. Use 0 to disable.")
+  recycling.add_argument("-cma", "--context-max-age", type=float, metavar="N.", default=c.CONTEXT_MAX_AGE, help=f"Replace a browser context after N seconds. Default: {c.CONTEXT_MAX_AGE} seconds. Use 0 to disable.")
+  recycling.add_argument("-mcf", "--max-consecutive-failures", type=int, metavar="N", default=c.MAX_CONSECUTIVE_FAILURES, help=f"Replace a page or browser context after N solves failed in a row. Default: {c.MAX_CONSECUTIVE_FAILURES}. Use 0 to disable.")
+
   # Server
   server = parser.add_argument_group("Server")
   server.add_argument("--host", default=c.HOST, help=f"Local host address. Default: {c.HOST}.")
   server.add_argument("--port", type=positive_integer, metavar="N", default=c.PORT, help=f"Local port. Default: {c.PORT}.")
+  server.add_argument("-w", "--workers", type=positive_integer, metavar="N", default=c.WORKERS, help=f"Worker processes, each one with its own browser pool. With more than one, a dispatcher listening on '--host' and '--port' routes every request to the least loaded worker and restarts workers that crash. Workers listen on 127.0.0.1, on the N ports following '--port'. Default: {c.WORKERS}.")
   server.add_argument("-s", "--secret", default=c.SECRET, help=f"Server secret. Default: {c.SECRET}.")
   server.add_argument("-lal", "--log-access-logs", action="store_true", help=f"Log server access logs.")
   server.add_argument("-svll", "--server-log-level", type=int, default=logging.INFO, metavar="N", help=f"TurnstileSolverServer log level. Default: {logging.INFO}")
+  server.add_argument("-amq", "--admission-max-queue", type=positive_integer, metavar="N", default=c.ADMISSION_MAX_QUEUE, help=f"Max requests waiting for a browser page. Requests beyond it are rejected with 429 and a Retry-After header. Default: {c.ADMISSION_MAX_QUEUE}.")
+  server.add_argument("-sb", "--solve-budget", type=positive_float, metavar="N.", default=c.SOLVE_BUDGET, help=f"Seconds a request can take, waiting for a page included, when it doesn't set its own 'timeout'. Requests estimated to take longer from recent throughput are rejected with 429 right away. Default: {c.SOLVE_BUDGET} seconds.")
+  server.add_argument("-tn", "--tenants", metavar="TENANTS.json", help=f"Path to a JSON file with a list of API keys besides --secret, as objects with 'name', 'secret' and optional 'weight', 'max_concurrency', 'rate' (requests per second) and 'burst' keys. Under contention each tenant gets browser pages in proportion to its weight.")
+  server.add_argument("-tf", "--trace-file", metavar="FILE.jsonl", help=f"Append every solve timeline to this file as OpenTelemetry OTLP/JSON spans, one line per solve.")
   server.add_argument("-ife", "--ignore-food-events", action="store_true", help=f"Do not log CAPTCHA foot events when server log level is DEBUG or below.")
 
   parser.add_argument("-p", "--production", action="store_true", help=f"Whether the project is running in a production environment or on a resource-constrained server, such as one that spins down during periods of inactivity.")
@@ -205,15 +258,48 @@ def _keep_server_alive(
     logger.error(f"keep_it_breathing interrupted with exception: {e}")
 
 
+def _run_worker(log_level: int, log_files: list[str], kwargs: dict):
+  """Entry point of a worker process in multi-process mode"""
+  logging.getLogger("hypercorn.error")._log = logger._log
+  logging.getLogger("faker").setLevel(logging.WARNING)
+  init_logger(
+    console=_console,
+    level=log_level,
+    handler_level=logging.NOTSET,
+    force=True,
+  )
+  for path in log_files:
+    logging.root.addHandler(get_file_handler(path))
+  asyncio.run(run_server(console=_console, **kwargs))
+
+
 async def run_server(
+    workers: int = c.WORKERS,
+
     # Production
     production: bool = False,
     use_ngrok: bool = True,
     perform_computations: bool = True,
     max_contexts: int = c.MAX_CONTEXTS,
     max_pages_per_context: int = c.MAX_PAGES_PER_CONTEXT,
+    widgets_per_page: int = c.WIDGETS_PER_PAGE,
+    page_park_ttl: float = c.PAGE_PARK_TTL,
+    standby_browser: bool = c.STANDBY_BROWSER,
+    remote_browsers: list[BrowserEndpoint] | None = None,
+    profiles_dir: str | Path | None = None,
+    profile_max_size: int = c.PROFILE_MAX_SIZE,
     single_browser_instance: bool = False,
     proxy_provider: ProxyProvider | None = None,
+    min_idle_contexts: int = c.MIN_IDLE_CONTEXTS,
+    max_idle_contexts: int = c.MAX_IDLE_CONTEXTS,
+    context_idle_ttl: float = c.CONTEXT_IDLE_TTL,
+    context_recycle_policy: RecyclePolicy | None = None,
+    page_recycle_policy: RecyclePolicy | None = None,
+    token_bank_sites: list[TurnstileSite] | None = None,
+    token_bank_size: int = c.TOKEN_BANK_SIZE,
+    token_ttl: float = c.TOKEN_TTL,
+    admission_max_queue: int = c.ADMISSION_MAX_QUEUE,
+    solve_budget: float = c.SOLVE_BUDGET,
 
     console: SolverConsole | None = SolverConsole(),
 
@@ -224,6 +310,9 @@ async def run_server(
     ignore_food_events: bool = False,
     server_log_level: int | str = logging.INFO,
     secret: str = c.SECRET,
+    trace_file: str | Path | None = None,
+    tenants: list[Tenant] | None = None,
+    job_id_prefix: str = "",
 
     # TurnstileSolver
     page_load_timeout: float = c.PAGE_LOAD_TIMEOUT,
@@ -231,13 +320,45 @@ async def run_server(
     browser_executable_path: str | Path | None = None,
     browser: str = c.BROWSER,
     reload_page_on_captcha_overrun_event: bool = False,
+    reset_widget_on_retry: bool = c.RESET_WIDGET_ON_RETRY,
+    cache_api_js: bool = False,
+    callback_host: str = c.CALLBACK_HOST,
+    virtual_displays: int = c.VIRTUAL_DISPLAYS,
     max_attempts: int = c.MAX_ATTEMPTS_TO_SOLVE_CAPTCHA,
     attempt_timeout: int = c.CAPTCHA_ATTEMPT_TIMEOUT,
     headless: bool = False,
     solver_log_level: int | str = logging.INFO,
     proxy: Proxy | None = None,
     browser_args: list[str] | None = None,
+    event_transport: CaptchaEventTransport = CaptchaEventTransport(c.CAPTCHA_EVENT_TRANSPORT),
+    extra_forwarded_events: Iterable[CaptchaApiMessageEvent] | None = (),
 ):
+  if workers > 1:
+    # Every other parameter is passed on to the workers as is
+    workerKwargs = {k: v for k, v in locals().items() if k not in ("workers", "production", "use_ngrok", "perform_computations", "console", "host", "port", "job_id_prefix")}
+    logFiles = [h.baseFilename for h in logging.root.handlers if isinstance(h, logging.FileHandler)]
+
+    def startWorker(index: int, port: int) -> Process:
+      # Spawned, forking a running event loop isn't safe
+      process = multiprocessing.get_context("spawn").Process(
+        target=_run_worker,
+        args=(logging.root.level, logFiles, workerKwargs | {"host": WORKER_HOST, "port": port, "job_id_prefix": f"{index}-"}),
+        name=f"turnstile-solver-worker-{index}",
+        daemon=True,
+      )
+      process.start()
+      return process
+
+    dispatcher = Dispatcher(
+      start_worker=startWorker,
+      workers=workers,
+      host=host,
+      port=port,
+      disable_access_logs=disable_access_logs,
+    )
+    await _serve(dispatcher.run, production, use_ngrok, perform_computations, secret)
+    return
+
   server = TurnstileSolverServer(
     host=host,
     port=port,
@@ -248,6 +369,9 @@ async def run_server(
     console=console,
     log_level=server_log_level,
     ignore_food_events=ignore_food_events,
+    trace_file=trace_file,
+    tenants=tenants,
+    job_id_prefix=job_id_prefix,
   )
 
   solver = TurnstileSolver(
@@ -257,6 +381,10 @@ async def run_server(
     browser_executable_path=browser_executable_path,
     browser=browser,
     reload_page_on_captcha_overrun_event=reload_page_on_captcha_overrun_event,
+    reset_widget_on_retry=reset_widget_on_retry,
+    cache_api_js=cache_api_js,
+    callback_host=callback_host,
+    virtual_displays=virtual_displays,
     max_attempts=max_attempts,
     attempt_timeout=attempt_timeout,
     headless=headless,
@@ -264,15 +392,41 @@ async def run_server(
     log_level=solver_log_level,
     proxy=proxy,
     browser_args=browser_args,
+    event_transport=event_transport,
+    extra_forwarded_events=extra_forwarded_events,
   )
   server.solver = solver
   await solver.server.create_browser_context_pool(
     max_contexts=max_contexts,
     max_pages_per_context=max_pages_per_context,
+    widgets_per_page=widgets_per_page,
+    page_park_ttl=page_park_ttl,
+    standby_browser=standby_browser,
+    remote_browsers=remote_browsers,
+    profile_store=ProfileStore(profiles_dir, max_profiles=max_contexts, max_size=profile_max_size) if profiles_dir else None,
     single_instance=single_browser_instance,
     proxy_provider=proxy_provider,
+    min_idle_contexts=min_idle_contexts,
+    max_idle_contexts=max_idle_contexts,
+    context_idle_ttl=context_idle_ttl,
+    context_recycle_policy=context_recycle_policy,
+    page_recycle_policy=page_recycle_policy,
+  )
+  solver.server.create_admission_controller(
+    max_queue=admission_max_queue,
+    default_budget=solve_budget,
   )
+  if token_bank_sites:
+    solver.server.create_token_bank(
+      sites=token_bank_sites,
+      size=token_bank_size,
+      token_ttl=token_ttl,
+    )
 
+  await _serve(solver.server.run, production, use_ngrok, perform_computations, secret)
+
+
+async def _serve(run: Callable[..., Awaitable[None]], production: bool, use_ngrok: bool, perform_computations: bool, secret: str):
   try:
     # Keep it breathing
     if production:
@@ -285,7 +439,7 @@ async def run_server(
       t.start()
 
     # Start server
-    await solver.server.run(debug=True)
+    await run(debug=True)
   except (SystemExit, KeyboardInterrupt, asyncio.CancelledError):
     pass
 
@@ -336,6 +490,10 @@ async def main():
   else:
     proxy = None
 
+  if args.min_idle > args.max_idle:
+    logger.error(f"'--min-idle' ({args.min_idle}) can't be greater than '--max-idle' ({args.max_idle})")
+    return
+
   if args.proxies:
     if not Path(args.proxies).is_file():
       logger.error(f"File: '{args.proxies}', does not exist")
@@ -345,15 +503,64 @@ async def main():
   else:
     proxyProvider = None
 
+  remoteBrowsers = []
+  for url, *maxContexts in args.remote_browser or []:
+    if len(maxContexts) > 1 or maxContexts and not (maxContexts[0].isdigit() and int(maxContexts[0]) > 0):
+      logger.error(f"'--remote-browser' takes a URL optionally followed by a positive max contexts, got: {' '.join([url, *maxContexts])}")
+      return
+    remoteBrowsers.append(BrowserEndpoint(url, int(maxContexts[0]) if maxContexts else None))
+  if args.virtual_displays and sys.platform != "linux":
+    logger.error("'--virtual-displays' is only supported on Linux")
+    return
+  if args.virtual_displays and (args.headless or remoteBrowsers):
+    logger.warning("'--virtual-displays' ignored, browsers aren't launched headful on this host")
+  if remoteBrowsers and args.profiles_dir:
+    logger.error("'--profiles-dir' can't be used with '--remote-browser', profiles are on the remote hosts")
+    return
+
+  tenants = None
+  if args.tenants:
+    try:
+      tenants = Tenant.load(args.tenants)
+    except (OSError, ValueError, TypeError) as ex:
+      logger.error(f"Failed to load tenants from '{args.tenants}': {ex}")
+      return
+
   await run_server(
+    workers=args.workers,
+
     # Production
     production=args.production,
     use_ngrok=not args.no_ngrok,
     perform_computations=not args.no_computations,
     max_contexts=args.max_contexts,
     max_pages_per_context=args.max_pages,
+    widgets_per_page=args.widgets_per_page,
+    page_park_ttl=args.park_ttl,
+    standby_browser=not args.no_standby_browser,
+    remote_browsers=remoteBrowsers,
+    profiles_dir=args.profiles_dir,
+    profile_max_size=args.profile_max_size * 2 ** 20,
     single_browser_instance=not args.multiple_browser_instances,
     proxy_provider=proxyProvider,
+    min_idle_contexts=args.min_idle,
+    max_idle_contexts=args.max_idle,
+    context_idle_ttl=args.idle_ttl,
+    context_recycle_policy=RecyclePolicy(
+      max_solves=args.context_max_solves,
+      max_age=args.context_max_age,
+      max_consecutive_failures=args.max_consecutive_failures,
+    ),
+    page_recycle_policy=RecyclePolicy(
+      max_solves=args.page_max_solves,
+      max_age=args.page_max_age,
+      max_consecutive_failures=args.max_consecutive_failures,
+    ),
+    token_bank_sites=[TurnstileSite(site_key=key, site_url=url) for url, key in args.token_bank or []],
+    token_bank_size=args.token_bank_size,
+    token_ttl=args.token_ttl,
+    admission_max_queue=args.admission_max_queue,
+    solve_budget=args.solve_budget,
 
     # TurnstileSolverServer
     host=args.host,
@@ -363,6 +570,8 @@ async def main():
     console=_console,
     server_log_level=args.server_log_level,
     secret=args.secret,
+    trace_file=args.trace_file,
+    tenants=tenants,
 
     # TurnstileSolver
     page_load_timeout=args.page_load_timeout,
@@ -370,12 +579,18 @@ async def main():
     browser_executable_path=args.browser_executable_path,
     browser=args.browser,
     reload_page_on_captcha_overrun_event=args.reload_on_overrun,
+    reset_widget_on_retry=not args.no_widget_reset,
+    cache_api_js=args.cache_api_js,
+    callback_host=args.callback_host,
+    virtual_displays=args.virtual_displays,
     max_attempts=args.max_attempts,
     attempt_timeout=args.captcha_timeout,
     headless=args.headless,
     solver_log_level=args.solver_log_level,
     proxy=proxy,
     browser_args=args.browser_args,
+    event_transport=CaptchaEventTransport(args.event_transport),
+    extra_forwarded_events=None if 'all' in (args.forward_events or []) else [CaptchaApiMessageEvent(e) for e in args.forward_events or []],
   )
 
 
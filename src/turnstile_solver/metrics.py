@@ -0,0 +1,188 @@
+import math
+from bisect import bisect_left
+from typing import Callable, Iterable
+
+# Seconds. Solves take from a couple of seconds up to a few attempt timeouts
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+ATTEMPT_BUCKETS = (1, 2, 3, 4, 5, 10)
+# Site keys come from clients, the ones seen after this many are counted as "other"
+MAX_SITE_KEY_LABELS = 100
+
+Labels = tuple[str, ...]
+
+
+def _labels(names: tuple[str, ...], values: Labels) -> str:
+  if not names:
+    return ""
+  escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+  return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+def _number(value: float) -> str:
+  if math.isinf(value):
+    return "+Inf" if value > 0 else "-Inf"
+  return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+  type = ""
+
+  def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+    self.name = name
+    self.help = help
+    self.label_names = tuple(labels)
+
+  def render(self) -> list[str]:
+    return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}", *self._samples()]
+
+  def _samples(self) -> list[str]:
+    raise NotImplementedError
+
+
+class Counter(Metric):
+  type = "counter"
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self._values: dict[Labels, float] = {}
+
+  def inc(self, *labels: str, amount: float = 1):
+    self._values[labels] = self._values.get(labels, 0) + amount
+
+  def value(self, *labels: str) -> float:
+    return self._values.get(labels, 0)
+
+  def _samples(self) -> list[str]:
+    return [f"{self.name}{_labels(self.label_names, labels)} {_number(v)}" for labels, v in self._values.items()]
+
+
+class Gauge(Metric):
+  """Value read at scrape time, so it costs nothing on the hot path"""
+  type = "gauge"
+
+  def __init__(self, name: str, help: str, getter: Callable[[], dict[Labels, float] | float | None], labels: Iterable[str] = ()):
+    super().__init__(name, help, labels)
+    self._getter = getter
+
+  def _samples(self) -> list[str]:
+    if (values := self._getter()) is None:
+      return []
+    if not isinstance(values, dict):
+      values = {(): values}
+    return [f"{self.name}{_labels(self.label_names, labels)} {_number(v)}" for labels, v in values.items()]
+
+
+class Histogram(Metric):
+  """
+  Fixed buckets histogram. observe() is a bisect and two additions, buckets are only made cumulative at scrape time
+  """
+  type = "histogram"
+
+  def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+    super().__init__(name, help, labels)
+    self.buckets = tuple(sorted(buckets))
+    # labels -> [per bucket counts (last one is +Inf), sum]
+    self._values: dict[Labels, tuple[list[int], list[float]]] = {}
+
+  def observe(self, value: float, *labels: str):
+    if (entry := self._values.get(labels)) is None:
+      entry = self._values[labels] = ([0] * (len(self.buckets) + 1), [0.])
+    entry[0][bisect_left(self.buckets, value)] += 1
+    entry[1][0] += value
+
+  def count(self, *labels: str) -> int:
+    return sum(entry[0]) if (entry := self._values.get(labels)) else 0
+
+  def _samples(self) -> list[str]:
+    samples = []
+    for labels, (counts, total) in self._values.items():
+      cumulative = 0
+      for le, n in zip((*self.buckets, math.inf), counts):
+        cumulative += n
+        samples.append(f"{self.name}_bucket{_labels((*self.label_names, 'le'), (*labels, _number(le)))} {cumulative}")
+      samples.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_number(total[0])}")
+      samples.append(f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}")
+    return samples
+
+
+class BoundedLabel:
+  """
+  Caps the distinct values of a label taken from client input, so series can't grow without limit.
+  The first max_values distinct values are kept as is, any other one becomes `other`
+  """
+
+  def __init__(self, max_values: int, other: str = "other"):
+    self.max_values = max_values
+    self.other = other
+    self._values: set[str] = set()
+
+  def __call__(self, value: str) -> str:
+    if value in self._values:
+      return value
+    if len(self._values) < self.max_values:
+      self._values.add(value)
+      return value
+    return self.other
+
+
+class Registry:
+  def __init__(self):
+    self._metrics: dict[str, Metric] = {}
+
+  def register(self, metric: Metric) -> Metric:
+    self._metrics[metric.name] = metric
+    return metric
+
+  def unregister(self, name: str):
+    self._metrics.pop(name, None)
+
+  def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+    return self.register(Counter(name, help, labels))
+
+  def histogram(self, name: str, help: str, labels: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+    return self.register(Histogram(name, help, labels, buckets))
+
+  def gauge(self, name: str, help: str, getter: Callable[[], dict[Labels, float] | float | None], labels: Iterable[str] = ()) -> Gauge:
+    return self.register(Gauge(name, help, getter, labels))
+
+  def render(self) -> str:
+    """Prometheus text exposition format"""
+    return "\n".join(line for metric in self._metrics.values() for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+SOLVE_PHASE_SECONDS = REGISTRY.histogram(
+  "turnstile_solve_phase_seconds",
+  "Duration of each solve attempt phase: page setup, time to 'init' event, time from 'init' to 'complete' event",
+  labels=("phase",),
+)
+SOLVE_ATTEMPTS = REGISTRY.histogram(
+  "turnstile_solve_attempts",
+  "Attempts used per solve",
+  buckets=ATTEMPT_BUCKETS,
+)
+SOLVES = REGISTRY.counter(
+  "turnstile_solves_total",
+  f"Solve outcomes per site key, site keys beyond the first {MAX_SITE_KEY_LABELS} are counted as other",
+  labels=("site_key", "outcome"),
+)
+SOLVE_SITE_KEY = BoundedLabel(MAX_SITE_KEY_LABELS)
+CAPTCHA_EVENTS = REGISTRY.counter(
+  "turnstile_captcha_events_total",
+  "Captcha API message events received from pages",
+  labels=("event",),
+)
+API_JS_CACHE = REGISTRY.counter(
+  "turnstile_api_js_cache_total",
+  "Turnstile api.js cache lookups (hit, stale, miss) and background revalidations (revalidated, revalidation_failed)",
+  labels=("result",),
+)
+VIRTUAL_DISPLAY_RESTARTS = REGISTRY.counter(
+  "turnstile_virtual_display_restarts_total",
+  "Xvfb virtual displays restarted after exiting or hanging",
+)
+POOL_WAIT_SECONDS = REGISTRY.histogram(
+  "turnstile_pool_wait_seconds",
+  "Time a solve waits for a page, from the browser context lease until a page of the context is acquired",
+)
@@ -1,25 +1,173 @@
+import asyncio
+import itertools
 import logging
 
 from patchright.async_api import BrowserContext, Page, Route
 from turnstile_solver.pool import Pool
+from turnstile_solver.recycle_policy import RecyclePolicy
 
-from turnstile_solver.constants import MAX_PAGES_PER_CONTEXT
+from turnstile_solver.constants import MAX_PAGES_PER_CONTEXT, WIDGETS_PER_PAGE, TURNSTILE_API_JS_URL
 
 logger = logging.getLogger(__name__)
 
+_ids = itertools.count()
+
+# Weight of the latest solve in the recent latency moving average
+_LATENCY_EWMA_ALPHA = 0.3
+
+# Establish DNS/TCP/TLS with Cloudflare (through the context proxy if any) and fill the HTTP cache with api.js
+_PRIME_NETWORK_SCRIPT = f"""
+  fetch("{TURNSTILE_API_JS_URL}", {{mode: "no-cors"}}).then(() => true, () => false)
+"""
+
 
 class PagePool(Pool):
   def __init__(self,
                context: BrowserContext,
                max_pages: int = MAX_PAGES_PER_CONTEXT,
+               recycle_policy: RecyclePolicy | None = None,
+               widgets_per_page: int = WIDGETS_PER_PAGE,
                ):
+    """
+    :param widgets_per_page: Solves a page serves at the same time, each one on its own widget. Concurrent solves on a page are always for the same site URL
+    """
     self.context = context
+    self.id = next(_ids)
+    self.recycle_policy = recycle_policy
+    # Scheduling counters
+    self.placements = 0
+    self.solves = 0
+    self.failures = 0
+    self.consecutive_failures = 0
+    self.latency: float | None = None
+    # page -> [solves served, consecutive failures]
+    self._page_counters: dict[Page, list[int]] = {}
+    # page -> future resolved with the reason once the page is lost: crashed, closed, or gone with its browser
+    self._lost: dict[Page, asyncio.Future] = {}
+    self._closed = False
 
     super().__init__(
       size=max_pages,
       item_getter=self._page_getter,
+      item_capacity=widgets_per_page,
+    )
+    self._replacement_getter = self._warm_page_getter
+
+  async def warm_up(self):
+    """Create all the pages ahead of time, parked on about:blank with the network stack primed"""
+    await asyncio.gather(*[self.prefill(self._warm_page_getter) for _ in range(self.size)])
+
+  def record_solve(self, elapsed: float | None, page: Page | None = None):
+    """Record a solve outcome, `elapsed` seconds if solved or None if failed, and retire the page if the recycle policy says so"""
+    if elapsed is None:
+      self.failures += 1
+      self.consecutive_failures += 1
+    else:
+      self.solves += 1
+      self.consecutive_failures = 0
+      self.latency = elapsed if self.latency is None else _LATENCY_EWMA_ALPHA * elapsed + (1 - _LATENCY_EWMA_ALPHA) * self.latency
+
+    if page is None or not self.recycle_policy:
+      return
+    counters = self._page_counters.setdefault(page, [0, 0])
+    counters[0] += 1
+    counters[1] = counters[1] + 1 if elapsed is None else 0
+    if reason := self.recycle_policy.retire_reason(counters[0], self.age(page), counters[1]):
+      self.retire(page, reason)
+
+  def parked(self, key) -> bool:
+    """Whether a page parked on the site of the key can take a lease of it right away"""
+    return key is not None and any(self._keys.get(page) == key for page in self._available)
+
+  async def unpark(self, idle_for: float = 0) -> int:
+    """Send pages idle for `idle_for` seconds and still on their last site back to about:blank, freeing the memory of the site. Returns how many"""
+    pages = [page for page in self.idle if self._keys.get(page) is not None and self.idle_time(page) >= idle_for]
+    for page in pages:
+      # Held until blank, with no key
+      self._acquire(page)
+    await asyncio.gather(*map(self._blank, pages))
+    return len(pages)
+
+  def lost(self, page: Page) -> asyncio.Future:
+    """Future resolved with the reason once the page is lost, to stop waiting on it"""
+    if (future := self._lost.get(page)) is None:
+      future = self._lost[page] = asyncio.get_running_loop().create_future()
+    return future
+
+  def lose(self, reason: str, page: Page | None = None):
+    """Mark the page, or every page of the context if None, as lost and retire it"""
+    if self._closed:
+      return
+    for p in [page] if page else [*self.items, *self._retiring]:
+      # Already closed by the pool
+      if p not in self._leases and p not in self._retiring:
+        continue
+      if not (future := self.lost(p)).done():
+        future.set_result(reason)
+      self.retire(p, reason)
+
+  def recycle_expired(self):
+    """Retire pages older than the recycle policy max age"""
+    if not (self.recycle_policy and self.recycle_policy.max_age):
+      return
+    for page in self.items:
+      if self.age(page) >= self.recycle_policy.max_age:
+        self.retire(page, f"{int(self.age(page))} seconds old")
+
+  def stats(self) -> dict:
+    return {
+      "id": self.id,
+      "active_pages": len(self.in_use),
+      "pages": len(self.items),
+      "active_widgets": sum(map(self.leases, self.items)),
+      "placements": self.placements,
+      "solves": self.solves,
+      "failures": self.failures,
+      "latency": self.latency,
+    }
+
+  async def close(self):
+    self._closed = True
+    await self.context.close()
+
+  def _select(self, key=None) -> Page | None:
+    """A page already on the site first, then a blank one, then the one parked on another site for the longest"""
+    return min(
+      (page for page in self._available if self._compatible(page, key)),
+      key=lambda page: (self._keys.get(page) != key, self._keys.get(page) is not None, -self.idle_time(page)),
+      default=None,
     )
 
+  async def _blank(self, page: Page):
+    try:
+      await page.goto("about:blank")
+    except Exception as ex:
+      logger.debug(f"Failed to unpark page: {ex}")
+    finally:
+      self._release(page)
+
   async def _page_getter(self):
     page = await self.context.new_page()
+    page.on("crash", lambda p: self.lose("Page crashed", p))
+    page.on("close", lambda p: self.lose("Page closed", p))
     return page
+
+  async def _close_item(self, page: Page):
+    self._page_counters.pop(page, None)
+    self._lost.pop(page, None)
+    try:
+      await page.close()
+    except Exception as ex:
+      logger.debug(f"Failed to close retired page: {ex}")
+
+  async def _warm_page_getter(self):
+    page = await self._page_getter()
+    try:
+      if not await page.evaluate(_PRIME_NETWORK_SCRIPT):
+        logger.debug("Failed to prime page network stack")
+    except Exception as ex:
+      logger.debug(f"Failed to prime page network stack: {ex}")
+    return page
+
+  def __repr__(self) -> str:
+    return f"PagePool(id={self.id}, active_pages={len(self.in_use)}/{self.size})"
@@ -1,68 +1,282 @@
 import asyncio
 import logging
+import time
 from collections import deque
+from contextlib import asynccontextmanager
 from inspect import isawaitable
 
-from typing import Callable, Any, Awaitable
+from typing import Callable, Any, Awaitable, AsyncIterator, Coroutine
 
 logger = logging.getLogger(__name__)
 
+# Grant handed to a waiter meaning "a slot has been reserved for you, create the item yourself"
+_CREATE = object()
+
 
 class Pool:
   def __init__(self,
                size: int,
                item_getter: Callable[[], Any | Awaitable[Any]],
+               item_capacity: int = 1,
                ):
+    """
+    :param size: Max number of items the pool can hold
+    :param item_getter: Callable returning (or awaitable resolving to) a new item
+    :param item_capacity: How many leases a single item can serve at the same time
+    """
     self.size = size
+    self.item_capacity = item_capacity
 
     self._item_getter = item_getter
-    self.in_use = []
-    self._available: deque = deque()
-    self._lock = asyncio.Lock()
+    # item -> active leases. Every item owned by the pool is here, dict keeps creation order
+    self._leases: dict[Any, int] = {}
+    # Items with spare capacity, used as an ordered set (FIFO)
+    self._available: dict[Any, None] = {}
+    # item -> time.monotonic() at which its last lease was put back
+    self._idle_since: dict[Any, float] = {}
+    # item -> time.monotonic() at which it was created
+    self._created_at: dict[Any, float] = {}
+    # Retired items still leased: item -> remaining leases. They don't take up a slot
+    self._retiring: dict[Any, int] = {}
+    # item -> key of its current leases, or of its last one if idle. See get()
+    self._keys: dict[Any, Any] = {}
+    # Slots reserved for items being created
+    self._creating = 0
+    # (future, key) of callers waiting for an item
+    self._waiters: deque[tuple[asyncio.Future, Any]] = deque()
+    # Used to build replacements of retired items, defaults to item_getter
+    self._replacement_getter: Callable[[], Any | Awaitable[Any]] | None = None
+    self._tasks: set[asyncio.Task] = set()
+
+  @property
+  def in_use(self) -> list[Any]:
+    return [item for item, leases in self._leases.items() if leases]
+
+  @property
+  def items(self) -> list[Any]:
+    return list(self._leases)
+
+  @property
+  def idle(self) -> list[Any]:
+    return [item for item, leases in self._leases.items() if not leases]
+
+  @property
+  def waiting(self) -> int:
+    return len(self._waiters)
 
   @property
   def is_full(self) -> bool:
-    return len(self.in_use) == self.size
-
-  async def get(self) -> Any:
-    async with self._lock:
-      # Check possible runtime error
-      if len(self.in_use) > self.size:
-        raise RuntimeError("len(self._in_use) is supposed to be less than self.size")
-      # Wait for any item to be available
-      if self.is_full:
-        logger.debug("Waiting for a new item to be available")
-        while self.is_full:
-          await asyncio.sleep(0.1)
-      # Get an item from available ones if any and put it in self._in_use list
-      if len(self._available) > 0:
-        self.in_use.append(item := self._available.popleft())
-        return item
-      # Then len(self._in_use) is less than self.max_size, so safely create a item page and put it in self._in_use list
-      item = await self._get_item()
-      self.in_use.append(item)
-      logger.debug(f"New item '{item}' added to pool")
-      return item
+    return not self._available and len(self._leases) + self._creating >= self.size
 
-  async def put_back(self, item: Any):
-    # Do nothing if item is available
-    if item in self._available:
+  def can_grant(self, key: Any = None) -> bool:
+    """Whether get(key) would be served right away, by an available item or a free slot"""
+    return not self._waiters and (self._select(key) is not None or len(self._leases) + self._creating < self.size)
+
+  def leases(self, item: Any) -> int:
+    return self._leases.get(item, 0)
+
+  def idle_time(self, item: Any) -> float:
+    """Seconds elapsed since the item became idle, 0 if it is leased"""
+    if (since := self._idle_since.get(item)) is None:
+      return 0
+    return time.monotonic() - since
+
+  def age(self, item: Any) -> float:
+    """Seconds elapsed since the item was created"""
+    if (createdAt := self._created_at.get(item)) is None:
+      return 0
+    return time.monotonic() - createdAt
+
+  async def get(self, timeout: float | None = None, key: Any = None) -> Any:
+    """
+    Get an item, waiting in FIFO order for one to be available if the pool is full.
+    Raises TimeoutError if no item becomes available within `timeout` seconds
+    :param key: With item_capacity > 1, an item only serves concurrent leases of the same key. An idle item can take any key
+    """
+    # Do not jump the queue if someone is already waiting
+    if (grant := None if self._waiters else self._grant(key)) is None:
+      grant = await self._wait(timeout, key)
+    if grant is not _CREATE:
+      return grant
+    return await self._create(leases=1, key=key)
+
+  async def prefill(self, item_getter: Callable[[], Any | Awaitable[Any]] | None = None) -> Any | None:
+    """Create an item ahead of demand and make it available. Returns None if the pool is full"""
+    if len(self._leases) + self._creating >= self.size:
+      return None
+    self._creating += 1
+    return await self._create(leases=0, item_getter=item_getter)
+
+  def remove(self, item: Any):
+    """Remove an idle item from the pool freeing its slot. Closing the item is up to the caller"""
+    if self._leases.get(item):
+      raise RuntimeError("Only idle items can be removed from the pool")
+    self._leases.pop(item, None)
+    self._available.pop(item, None)
+    self._idle_since.pop(item, None)
+    self._created_at.pop(item, None)
+    self._keys.pop(item, None)
+    logger.debug(f"Item '{item}' removed from pool")
+    self._dispatch()
+
+  def retire(self, item: Any, reason: str | None = None):
+    """
+    Stop handing out the item and close it once its last lease is put back.
+    Its slot is freed right away, so a replacement is built in background while it finishes its current leases
+    """
+    if (leases := self._leases.pop(item, None)) is None:
       return
+    self._available.pop(item, None)
+    self._idle_since.pop(item, None)
+    self._created_at.pop(item, None)
+    self._keys.pop(item, None)
+    logger.debug(f"Retiring item '{item}'" + (f". Reason: {reason}" if reason else ''))
+    if leases:
+      self._retiring[item] = leases
+    else:
+      self._spawn(self._close_item(item))
+    # Waiters, if any, will take the freed slot
+    if not self._waiters:
+      self._spawn(self._replace())
+    self._dispatch()
 
-    # Check possible runtime error
-    if len(self._available) >= self.size:
-      raise RuntimeError("len(self._available) is supposed to be less than self.size. Make sure to always call put_back() method only if get() method have been called previously")
+  async def put_back(self, item: Any):
+    self._release(item)
 
-    # Check possible runtime error again in which provided page may not have been fetched via get() method
+  @asynccontextmanager
+  async def lease(self, timeout: float | None = None, key: Any = None) -> AsyncIterator[Any]:
+    """Get an item and always put it back on exit"""
+    item = await self.get(timeout, key)
     try:
-      index = self.in_use.index(item)
-    except ValueError:
+      yield item
+    finally:
+      self._release(item)
+
+  def _release(self, item: Any):
+    if (retiringLeases := self._retiring.get(item)) is not None:
+      if retiringLeases > 1:
+        self._retiring[item] = retiringLeases - 1
+      else:
+        del self._retiring[item]
+        self._spawn(self._close_item(item))
+      return
+    if (leases := self._leases.get(item)) is None:
       raise RuntimeError("The item provided seems not have been fetched via the get() method, and it is supposed to be this way. Make sure to always call put_back() method only if get() method have been called previously")
+    # Do nothing if item is already back
+    if leases == 0:
+      return
+    self._leases[item] = leases = leases - 1
+    self._available[item] = None
+    if not leases:
+      self._idle_since[item] = time.monotonic()
     logger.debug(f"Item '{item}' back on pool")
-    self._available.append(self.in_use.pop(index))
+    self._dispatch()
+
+  async def _create(self, leases: int, item_getter: Callable[[], Any | Awaitable[Any]] | None = None, key: Any = None) -> Any:
+    """Create an item on a slot already reserved in self._creating"""
+    try:
+      item = await self._get_item(item_getter)
+    except BaseException:
+      self._creating -= 1
+      self._dispatch()
+      raise
+    self._creating -= 1
+    self._leases[item] = leases
+    self._keys[item] = key
+    self._created_at[item] = time.monotonic()
+    if leases < self.item_capacity:
+      self._available[item] = None
+    if not leases:
+      self._idle_since[item] = time.monotonic()
+    logger.debug(f"New item '{item}' added to pool")
+    self._dispatch()
+    return item
+
+  async def _close_item(self, item: Any):
+    """Called once a retired item is no longer leased. Override to close it"""
+
+  async def _replace(self):
+    try:
+      await self.prefill(self._replacement_getter)
+    except Exception as ex:
+      logger.error(f"Failed to build replacement item: {ex}")
+
+  def _spawn(self, coro: Coroutine):
+    self._tasks.add(task := asyncio.create_task(coro))
+    task.add_done_callback(self._tasks.discard)
+
+  def _compatible(self, item: Any, key: Any) -> bool:
+    """Whether the available item can take a lease of the key"""
+    return not self._leases[item] or self._keys.get(item) == key
+
+  def _select(self, key: Any = None) -> Any | None:
+    """Choose which available item is handed out next, None if none can take the key. Override to change scheduling"""
+    return next((item for item in self._available if self._compatible(item, key)), None)
+
+  def _acquire(self, item: Any, key: Any = None):
+    self._leases[item] = leases = self._leases[item] + 1
+    self._keys[item] = key
+    self._idle_since.pop(item, None)
+    if leases >= self.item_capacity:
+      del self._available[item]
+
+  def _grant(self, key: Any = None) -> Any:
+    """Lease an available item, reserve a slot for a new one (_CREATE), or return None if the pool is full"""
+    if (item := self._select(key)) is not None:
+      self._acquire(item, key)
+      return item
+    if len(self._leases) + self._creating < self.size:
+      self._creating += 1
+      return _CREATE
+    return None
+
+  def _revoke(self, grant: Any):
+    """Give back a grant that was never delivered to its waiter"""
+    if grant is _CREATE:
+      self._creating -= 1
+      self._dispatch()
+    else:
+      self._release(grant)
+
+  def _dispatch(self):
+    """
+    Hand available items or free slots to waiters in arrival order.
+    Strictly FIFO even across keys: a waiter no item can take the key of yet lets items drain instead of getting starved by later waiters of another key
+    """
+    while self._waiters:
+      waiter, key = self._waiters[0]
+      if waiter.done():
+        self._waiters.popleft()
+        continue
+      if (grant := self._grant(key)) is None:
+        return
+      self._waiters.popleft()
+      waiter.set_result(grant)
+
+  async def _wait(self, timeout: float | None, key: Any = None) -> Any:
+    waiter = asyncio.get_running_loop().create_future()
+    self._waiters.append(entry := (waiter, key))
+    logger.debug(f"Waiting for a new item to be available ({len(self._waiters)} waiting)")
+    try:
+      return await asyncio.wait_for(waiter, timeout)
+    except BaseException as ex:
+      # Granted right before being cancelled or timed-out, don't leak it
+      if waiter.done() and not waiter.cancelled():
+        self._revoke(waiter.result())
+      else:
+        waiter.cancel()
+        try:
+          self._waiters.remove(entry)
+        except ValueError:
+          pass
+        # It may have been the head blocking waiters of other keys
+        self._dispatch()
+      if isinstance(ex, asyncio.TimeoutError):
+        raise TimeoutError(f"No item available within {timeout} seconds") from None
+      raise
 
-  async def _get_item(self):
-    item = self._item_getter()
+  async def _get_item(self, item_getter: Callable[[], Any | Awaitable[Any]] | None = None):
+    item = (item_getter or self._item_getter)()
     if isawaitable(item):
       item = await item
     return item
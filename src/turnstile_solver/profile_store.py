@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+
+from turnstile_solver.constants import PROFILES_DIR, PROFILE_MAX_SIZE, PROFILE_MAX_IDLE, MAX_CONTEXTS, PROFILE_COMPACTION_PATHS
+
+try:
+  import fcntl
+except ImportError:  # Windows, profiles are only locked within the process
+  fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_PREFIX = "profile-"
+# Left by Chrome in its user data dir, stale once the browser is gone
+_SINGLETON_FILES = ("SingletonLock", "SingletonSocket", "SingletonCookie")
+
+
+def dir_size(path: Path) -> int:
+  total = 0
+  for root, _, files in os.walk(path):
+    for name in files:
+      try:
+        total += os.lstat(os.path.join(root, name)).st_size
+      except OSError:
+        pass
+  return total
+
+
+class ProfileStore:
+  def __init__(self,
+               root: str | Path = PROFILES_DIR,
+               max_profiles: int = MAX_CONTEXTS,
+               max_size: int = PROFILE_MAX_SIZE,
+               max_idle: float = PROFILE_MAX_IDLE,
+               ):
+    """
+    On-disk browser profiles (user data dirs) reused by browser contexts across restarts, so they start with a warm HTTP cache and service worker state.
+    A profile is used by one context at a time, locked with a file lock so other processes sharing the root skip it
+    :param max_profiles: Profiles kept on disk. Unused profiles beyond it are deleted, least recently used first
+    :param max_size: Bytes a profile can take. Bigger profiles are compacted when released, dropping regenerable caches first
+    :param max_idle: Seconds a profile can stay unused before being deleted
+    """
+    self.root = Path(root)
+    self.max_profiles = max_profiles
+    self.max_size = max_size
+    self.max_idle = max_idle
+    # profile dir -> open lock file
+    self._locks: dict[Path, int] = {}
+
+  @property
+  def in_use(self) -> list[Path]:
+    return list(self._locks)
+
+  async def acquire(self) -> Path:
+    """The most recently used free profile, so the warmest one, or a new one if all of them are in use"""
+    return await asyncio.to_thread(self._acquire)
+
+  async def release(self, profile: Path):
+    """Unlock the profile once its browser is closed, compacting it first if it's too big"""
+    await asyncio.to_thread(self._release, profile)
+
+  async def cleanup(self):
+    """Delete profiles unused for longer than max_idle, then the least recently used ones beyond max_profiles"""
+    await asyncio.to_thread(self._cleanup)
+
+  def _profiles(self) -> list[Path]:
+    """Profiles on disk, most recently used first"""
+    if not self.root.is_dir():
+      return []
+    return sorted((p for p in self.root.iterdir() if p.is_dir() and p.name.startswith(_PREFIX)), key=self._last_used, reverse=True)
+
+  @staticmethod
+  def _last_used(profile: Path) -> float:
+    try:
+      return profile.with_suffix(".lock").stat().st_mtime
+    except OSError:
+      return 0
+
+  def _acquire(self) -> Path:
+    self.root.mkdir(parents=True, exist_ok=True)
+    for profile in self._profiles():
+      if self._lock(profile):
+        logger.debug(f"Using browser profile '{profile.name}'")
+        return profile
+    n = 0
+    while True:
+      profile = self.root / f"{_PREFIX}{n}"
+      if not profile.exists() and self._lock(profile):
+        profile.mkdir(exist_ok=True)
+        logger.debug(f"New browser profile '{profile.name}'")
+        return profile
+      n += 1
+
+  def _lock(self, profile: Path) -> bool:
+    if profile in self._locks:
+      return False
+    fd = os.open(profile.with_suffix(".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    if fcntl:
+      try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except OSError:
+        # Used by another process
+        os.close(fd)
+        return False
+    self._locks[profile] = fd
+    for name in _SINGLETON_FILES:
+      (profile / name).unlink(missing_ok=True)
+    return True
+
+  def _release(self, profile: Path):
+    if (fd := self._locks.get(profile)) is None:
+      return
+    try:
+      self._compact(profile)
+      os.utime(profile.with_suffix(".lock"))
+    finally:
+      del self._locks[profile]
+      os.close(fd)
+
+  def _compact(self, profile: Path):
+    if (size := dir_size(profile)) <= self.max_size:
+      return
+    for path in PROFILE_COMPACTION_PATHS:
+      if (target := profile / path).exists():
+        size -= dir_size(target)
+        shutil.rmtree(target, ignore_errors=True)
+        if size <= self.max_size:
+          logger.debug(f"Browser profile '{profile.name}' compacted to {size / 2 ** 20:.1f} MB")
+          return
+    # Still too big with every cache gone, start over
+    logger.info(f"Browser profile '{profile.name}' still {size / 2 ** 20:.1f} MB after compaction, resetting it")
+    shutil.rmtree(profile, ignore_errors=True)
+    profile.mkdir()
+
+  def _cleanup(self):
+    profiles = self._profiles()
+    free = [p for p in profiles if self._lock(p)]
+    # Profiles in use are kept no matter what
+    kept = len(profiles) - len(free)
+    now = time.time()
+    for profile in free:
+      if now - self._last_used(profile) < self.max_idle and kept < self.max_profiles:
+        kept += 1
+        self._unlock(profile)
+        continue
+      shutil.rmtree(profile, ignore_errors=True)
+      # The lock file stays, deleting it could let two processes lock different files for the same profile
+      self._unlock(profile)
+      logger.debug(f"Unused browser profile '{profile.name}' deleted")
+
+  def _unlock(self, profile: Path):
+    os.close(self._locks.pop(profile))
@@ -0,0 +1,31 @@
+class RecyclePolicy:
+  def __init__(self,
+               max_solves: int | None = None,
+               max_age: float | None = None,
+               max_consecutive_failures: int | None = None,
+               ):
+    """
+    :param max_solves: Retire after serving this many solves
+    :param max_age: Retire after this many seconds since creation
+    :param max_consecutive_failures: Retire after this many solves failed in a row
+    """
+    self.max_solves = max_solves
+    self.max_age = max_age
+    self.max_consecutive_failures = max_consecutive_failures
+
+  def retire_reason(self,
+                    solves: int,
+                    age: float,
+                    consecutive_failures: int,
+                    ) -> str | None:
+    """Reason to retire, or None if it can be kept"""
+    if self.max_solves and solves >= self.max_solves:
+      return f"{solves} solves served"
+    if self.max_age and age >= self.max_age:
+      return f"{int(age)} seconds old"
+    if self.max_consecutive_failures and consecutive_failures >= self.max_consecutive_failures:
+      return f"{consecutive_failures} consecutive failures"
+    return None
+
+  def __repr__(self) -> str:
+    return f"RecyclePolicy(max_solves={self.max_solves}, max_age={self.max_age}, max_consecutive_failures={self.max_consecutive_failures})"
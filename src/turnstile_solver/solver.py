@@ -1,19 +1,39 @@
+import asyncio
 import datetime
+import json
 import logging
+import os
 import time
+from contextlib import nullcontext
 from pathlib import Path
-from typing import Callable, Awaitable
+from typing import Callable, Awaitable, Iterable
+from weakref import WeakKeyDictionary
 from patchright.async_api import async_playwright, Page, BrowserContext, Browser, Playwright
 
 import turnstile_solver.constants as c
-from turnstile_solver.enums import CaptchaApiMessageEvent
+from turnstile_solver.api_js_cache import ApiJsCache
+from turnstile_solver.display_pool import DisplayPool, Display
+from turnstile_solver.captcha_event_dispatcher import CaptchaEventDispatcher
+from turnstile_solver.enums import CaptchaApiMessageEvent, CaptchaEventTransport
+from turnstile_solver.metrics import SOLVE_PHASE_SECONDS, SOLVE_ATTEMPTS
 from turnstile_solver.proxy import Proxy
 from turnstile_solver.solver_console import SolverConsole
+from turnstile_solver.timeline import Timeline
 from turnstile_solver.turnstile_result import TurnstileResult
 from turnstile_solver.turnstile_solver_server import TurnstileSolverServer, CAPTCHA_EVENT_CALLBACK_ENDPOINT
 
 logger = logging.getLogger(__name__)
 
+# Captcha events TurnstileSolver.solve() relies on, always forwarded by the page script
+REQUIRED_CAPTCHA_EVENTS = {
+  CaptchaApiMessageEvent.INIT,
+  CaptchaApiMessageEvent.COMPLETE,
+  CaptchaApiMessageEvent.INTERACTIVE_BEGIN,
+  CaptchaApiMessageEvent.REJECT,
+  CaptchaApiMessageEvent.FAIL,
+  CaptchaApiMessageEvent.RELOAD_REQUEST,
+}
+
 BROWSER_ARGS = {
 
   "--no-sandbox",
@@ -101,30 +121,64 @@ class TurnstileSolver:
                log_level: int | str = logging.INFO,
                proxy: Proxy | None = None,
                browser_args: list[str] | None = None,
+               event_transport: CaptchaEventTransport = CaptchaEventTransport(c.CAPTCHA_EVENT_TRANSPORT),
+               extra_forwarded_events: Iterable[CaptchaApiMessageEvent] | None = (),
+               reset_widget_on_retry: bool = c.RESET_WIDGET_ON_RETRY,
+               cache_api_js: bool = False,
+               callback_host: str = c.CALLBACK_HOST,
+               virtual_displays: int = c.VIRTUAL_DISPLAYS,
                ):
+    """
+    :param virtual_displays: Launch headful browsers on this many Xvfb virtual displays started and health-checked by the solver, spreading browsers over them, instead of the DISPLAY of the process. Linux only
+    :param callback_host: Host pages POST captcha events to with CaptchaEventTransport.HTTP, the server port is used. Set it to an address of this host reachable from remote browsers
+    :param cache_api_js: Serve the Turnstile api.js to every browser context from a shared in-memory cache instead of downloading it, through the context proxy if any, on every page load
+    :param reset_widget_on_retry: Retry after a 'fail', 'reject' or 'reloadRequest' event by resetting the widget in the already loaded page instead of reloading it. The page is still reloaded if the widget is broken or after a timeout
+    :param event_transport: How captcha events get from the page to the solver. With CaptchaEventTransport.BINDING events are delivered in-process through a Playwright binding and no server is required. CaptchaEventTransport.HTTP POSTs them to the server callback endpoint
+    :param extra_forwarded_events: Captcha events forwarded by the page script besides the ones the solver needs, any other event is dropped in the browser. None forwards every event
+    """
 
     logger.setLevel(log_level)
     self.console = console
     self.page_load_timeout = page_load_timeout
     self.reload_page_on_captcha_overrun_event = reload_page_on_captcha_overrun_event
+    self.reset_widget_on_retry = reset_widget_on_retry
     self.browser_executable_path = browser_executable_path
     self.browser = browser
     self.headless = headless
 
     self.server: TurnstileSolverServer | None = server
+    self.api_js_cache = ApiJsCache() if cache_api_js else None
+    self.display_pool = DisplayPool(virtual_displays) if virtual_displays and not headless else None
+    self.event_transport = event_transport
+    self.callback_host = callback_host
+    self._event_dispatcher = CaptchaEventDispatcher()
 
     self.browser_args = list(BROWSER_ARGS) + (browser_args or [])
     if browser_position:
       self.browser_args.append(f'--window-position={browser_position[0]},{browser_position[1]}')
     self._error: str | None = None
+    # Held while a shared page is loaded, so concurrent solves on it don't navigate it under each other
+    self._page_locks: WeakKeyDictionary[Page, asyncio.Lock] = WeakKeyDictionary()
     self.max_attempts = max_attempts
     self.attempt_timeout = attempt_timeout
 
     self.proxy = proxy
 
+    if extra_forwarded_events is None:
+      self._allowed_events_js = 'null'
+    else:
+      allowedEvents = REQUIRED_CAPTCHA_EVENTS | set(extra_forwarded_events)
+      if reload_page_on_captcha_overrun_event:
+        allowedEvents.add(CaptchaApiMessageEvent.OVERRUN_BEGIN)
+      self._allowed_events_js = json.dumps(sorted(e.value for e in allowedEvents))
+
+  @property
+  def event_dispatcher(self) -> CaptchaEventDispatcher:
+    return self.server.event_dispatcher if self.server else self._event_dispatcher
+
   @property
   def _server_down(self) -> bool:
-    if self.server.down:
+    if self.event_transport == CaptchaEventTransport.HTTP and self.server.down:
       self._error = "Server down"
       logger.warning("Captcha can't be solved because server is down")
       return True
@@ -141,16 +195,23 @@ class TurnstileSolver:
                   timeout: float | None = None,
                   page: Page | bool = False,
                   about_blank_on_finish: bool = False,
+                  timeline: Timeline | None = None,
+                  shared_page: bool = False,
                   ) -> TurnstileResult | None:
     """
     If page is a Page instance, this instance will be reused, else a new BrowserContext instance will be created and destroyed upon finish if browser_context is False, else the created instance will be returned along with the Browser instance
+    :param timeline: Timeline to record the solve spans on, a new one is used otherwise. Available as `result.timeline` either way
+    :param shared_page: Render a widget of the solve's own on `page`, next to the ones of other solves of the same site_url running on it. The page is only loaded if it's not on site_url already, and never reloaded while in use
     """
+    if shared_page and isinstance(page, bool):
+      raise ValueError("shared_page requires a Page instance")
 
-    if not self.server:
-      raise RuntimeError("self.server instance has not been assigned")
+    if self.event_transport == CaptchaEventTransport.HTTP:
+      if not self.server:
+        raise RuntimeError("self.server instance has not been assigned")
 
-    if self.server.down:
-      raise RuntimeError("Server is down. Make sure to run server and wait fot it to be up. Use method .wait_for_server_up()")
+      if self.server.down:
+        raise RuntimeError("Server is down. Make sure to run server and wait fot it to be up. Use method .wait_for_server_up()")
 
     if not attempts:
       attempts = self.max_attempts
@@ -161,8 +222,8 @@ class TurnstileSolver:
 
     startTime = time.time()
 
-    result = TurnstileResult()
-    self.server.subscribe_captcha_message_event_handler(result.id, result.captcha_api_message_event_handler)
+    result = TurnstileResult(timeline=timeline)
+    self.event_dispatcher.subscribe(result.id, result.captcha_api_message_event_handler)
 
     onFinishCallbacks: list[Callable[[], Awaitable[None]]] = []
 
@@ -182,64 +243,102 @@ class TurnstileSolver:
     else:  # elif isinstance(page, Page):
       pageOrContext = page
 
+    a = 0
+    # Whether the widget of the loaded page can be reset for the next attempt rather than reloading the page
+    resetWidget = False
     try:
       for a in range(1, attempts + 1):
         logger.info(f"Attempt: {a}/{attempts}")
 
-        result.reset_captcha_fields()
-
-        # 1. Route and load page, reset captcha fields
-        if not (page := await self._setup_page(
-            page_or_context=result.page or pageOrContext,
-            site_url=site_url,
-            site_key=site_key,
-            id=result.id,
-        )):
-          return
-
-        result.page = page
+        with result.timeline.span("attempt", attempt=a):
+          result.reset_captcha_fields()
+
+          # 1. Route and load page, or reset the widget of the loaded one
+          if resetWidget:
+            with result.timeline.span("reset") as span:
+              resetWidget = await self._reset_widget(result.page, result.widget_id)
+            if resetWidget:
+              SOLVE_PHASE_SECONDS.observe(span.duration / 1000, "reset")
+            else:
+              logger.debug("Widget could not be reset, reloading page")
+
+          if not resetWidget and shared_page:
+            with result.timeline.span("setup") as span:
+              if not await self._setup_widget(pageOrContext, site_url, site_key, result):
+                return
+            result.page = pageOrContext
+            SOLVE_PHASE_SECONDS.observe(span.duration / 1000, "setup")
+          elif not resetWidget:
+            if result.page:
+              await self._collect_event_stats(result)
+            with result.timeline.span("setup") as span:
+              if not result.page and await self._reuse_page(pageOrContext, site_url, site_key, result.id):
+                page = pageOrContext
+              elif not (page := await self._setup_page(
+                  page_or_context=result.page or pageOrContext,
+                  site_url=site_url,
+                  site_key=site_key,
+                  id=result.id,
+                  timeline=result.timeline,
+              )):
+                return
+
+            result.page = page
+            SOLVE_PHASE_SECONDS.observe(span.duration / 1000, "setup")
+          resetWidget = False
+
+          # 2. Wait for init event
+          logger.debug(f"Waiting for '{CaptchaApiMessageEvent.INIT.value}' event")
+          try:
+            with result.timeline.span("init") as span:
+              if await result.wait_for_captcha_event(evt=CaptchaApiMessageEvent.INIT, timeout=timeout) is False:
+                return
+          except TimeoutError as te:
+            self._error = te.args[0]
+            logger.warning(f"Captcha API message '{CaptchaApiMessageEvent.INIT.value}' event not received within {timeout} seconds")
+            continue
+          SOLVE_PHASE_SECONDS.observe(span.duration / 1000, "init")
 
-        # 2. Wait for init event
-        logger.debug(f"Waiting for '{CaptchaApiMessageEvent.INIT.value}' event")
-        try:
-          if await result.wait_for_captcha_event(evt=CaptchaApiMessageEvent.INIT, timeout=timeout) is False:
+          if self._server_down:
             return
-        except TimeoutError as te:
-          self._error = te.args[0]
-          logger.warning(f"Captcha API message '{CaptchaApiMessageEvent.INIT.value}' event not received within {timeout} seconds")
-          continue
-
-        if self._server_down:
-          return
-
-        # 3. Wait for 'complete' event
-        try:
-          cancellingEvents = [CaptchaApiMessageEvent.REJECT, CaptchaApiMessageEvent.FAIL, CaptchaApiMessageEvent.RELOAD_REQUEST]
-          if self.reload_page_on_captcha_overrun_event:
-            cancellingEvents.append(CaptchaApiMessageEvent.OVERRUN_BEGIN)
-          if (cancellingEvent := await result.wait_for_captcha_event(
-              *cancellingEvents,
-              evt=CaptchaApiMessageEvent.COMPLETE,
-              timeout=timeout,
-          )) is False:
-            return
-          elif isinstance(cancellingEvent, CaptchaApiMessageEvent):
-            logger.warning(f"'{cancellingEvent.value}' event received")
+
+          # 3. Wait for 'complete' event
+          try:
+            cancellingEvents = [CaptchaApiMessageEvent.REJECT, CaptchaApiMessageEvent.FAIL, CaptchaApiMessageEvent.RELOAD_REQUEST]
+            if self.reload_page_on_captcha_overrun_event:
+              cancellingEvents.append(CaptchaApiMessageEvent.OVERRUN_BEGIN)
+            with result.timeline.span("complete") as span:
+              if (cancellingEvent := await result.wait_for_captcha_event(
+                  *cancellingEvents,
+                  evt=CaptchaApiMessageEvent.COMPLETE,
+                  timeout=timeout,
+              )) is False:
+                return
+            if isinstance(cancellingEvent, CaptchaApiMessageEvent):
+              logger.warning(f"'{cancellingEvent.value}' event received")
+              # Widget is loaded and working, it just failed this challenge
+              resetWidget = self.reset_widget_on_retry and cancellingEvent != CaptchaApiMessageEvent.OVERRUN_BEGIN
+              continue
+          except TimeoutError as te:
+            self._error = te.args[0]
+            logger.warning(f"Captcha not solved within {timeout} seconds")
             continue
-        except TimeoutError as te:
-          self._error = te.args[0]
-          logger.warning(f"Captcha not solved within {timeout} seconds")
-          continue
 
-        if result.token is None:
-          raise RuntimeError("'result.token' is not supposed to be None at this point")
+          SOLVE_PHASE_SECONDS.observe(span.duration / 1000, "complete")
+
+          if result.token is None:
+            raise RuntimeError("'result.token' is not supposed to be None at this point")
 
-        elapsed = datetime.timedelta(seconds=time.time() - startTime)
-        logger.info(f"Captcha solved. Elapsed: {str(elapsed).split('.')[0]}")
-        logger.debug(f"TOKEN: {result.token}")
-        result.elapsed = elapsed
-        break
+          elapsed = datetime.timedelta(seconds=time.time() - startTime)
+          logger.info(f"Captcha solved. Elapsed: {str(elapsed).split('.')[0]}")
+          logger.debug(f"TOKEN: {result.token}")
+          result.elapsed = elapsed
+          break
 
+      # Page script counters of a shared page add up the events of every widget on it
+      if result.page and not shared_page:
+        await self._collect_event_stats(result)
+        logger.debug(f"Captcha events received by page: {result.event_stats['received']}. Forwarded: {result.event_stats['forwarded']}")
       if about_blank_on_finish:
         await page.goto("about:blank")
       if result.token:
@@ -251,7 +350,13 @@ class TurnstileSolver:
       raise
       # logger.error(ex)
     finally:
-      self.server.unsubscribe_captcha_message_event_handler(result.id)
+      if not timeline:
+        result.timeline.finish()
+      if a:
+        SOLVE_ATTEMPTS.observe(a)
+      if result.widget_id:
+        await self._remove_widget(result.page, result.widget_id)
+      self.event_dispatcher.unsubscribe(result.id)
       for callback in onFinishCallbacks:
         await callback()
 
@@ -260,35 +365,124 @@ class TurnstileSolver:
       page_or_context: BrowserContext | Page,
       site_url: str,
       site_key: str,
-      id: str,
+      id: str | None,
+      timeline: Timeline | None = None,
   ) -> Page | None:
+    """
+    Load site_url with the solver page script and a widget for solve `id`.
+    With no id the page is loaded without widget, widgets are rendered on it with _setup_widget()
+    """
 
     if self._server_down:
       return
 
     page = await page_or_context.new_page() if isinstance(page_or_context, BrowserContext) else page_or_context
-
-    pageContent = c.HTML_TEMPLATE.format(
-      local_server_port=self.server.port,
-      local_callback_endpoint=CAPTCHA_EVENT_CALLBACK_ENDPOINT.lstrip('/'),
-      site_key=site_key,
-      id=id,
-      secret=self.server.secret,
-    )
+    pageContent = self._page_content(site_key, id)
     await page.route(site_url, lambda r: r.fulfill(body=pageContent, status=200))
 
-    if page.url != site_url:
-      logger.debug(f"Navigating to URL: {site_url}")
-      await page.goto(site_url, timeout=self.page_load_timeout * 1000)
-    else:
-      logger.debug("Reloading page")
-      await page.reload(timeout=self.page_load_timeout * 1000)
+    with timeline.span("navigation", reload=page.url == site_url) if timeline else nullcontext():
+      if page.url != site_url:
+        logger.debug(f"Navigating to URL: {site_url}")
+        await page.goto(site_url, timeout=self.page_load_timeout * 1000)
+      else:
+        logger.debug("Reloading page")
+        await page.reload(timeout=self.page_load_timeout * 1000)
 
     page.window_width = await page.evaluate("window.innerWidth")
     page.window_height = await page.evaluate("window.innerHeight")
 
     return page
 
+  def _page_content(self, site_key: str, id: str | None) -> str:
+    """Page served for the site URL: the solver page script, and a widget for solve `id` if any"""
+    if self.event_transport == CaptchaEventTransport.BINDING:
+      forwardEvent = c.BINDING_EVENT_FORWARDER_TEMPLATE.format(
+        binding_name=c.CAPTCHA_EVENT_BINDING_NAME,
+      )
+    else:
+      forwardEvent = c.HTTP_EVENT_FORWARDER_TEMPLATE.format(
+        callback_host=self.callback_host,
+        local_server_port=self.server.port,
+        local_callback_endpoint=CAPTCHA_EVENT_CALLBACK_ENDPOINT.lstrip('/'),
+        secret=self.server.secret,
+      )
+    return c.HTML_TEMPLATE.format(
+      allowed_events=self._allowed_events_js,
+      event_stats_js=c.CAPTCHA_EVENT_STATS_JS,
+      forward_event=forwardEvent,
+      default_id='null' if id is None else json.dumps(id),
+      api_js_query="onload=__onTurnstileLoad" + ("&render=explicit" if id is None else ""),
+      body="" if id is None else c.WIDGET_HTML_TEMPLATE.format(site_key=site_key),
+    )
+
+  async def _setup_widget(self, page: Page, site_url: str, site_key: str, result: TurnstileResult) -> bool:
+    """
+    Render a new widget for the solve on a shared page, loading site_url first if the page isn't on it. Any previous widget of the solve is removed.
+    The page script helpers are only visible from the main world, not from Patchright's default isolated one
+    """
+    async with self._page_locks.setdefault(page, asyncio.Lock()):
+      if page.url != site_url or not await page.evaluate(c.WIDGET_PAGE_LOADED_JS, isolated_context=False):
+        if not await self._setup_page(page, site_url, site_key, id=None, timeline=result.timeline):
+          return False
+    if result.widget_id:
+      await self._remove_widget(page, result.widget_id)
+      result.widget_id = None
+    try:
+      result.widget_id = await asyncio.wait_for(page.evaluate(c.RENDER_WIDGET_JS, [result.id, site_key], isolated_context=False), self.page_load_timeout)
+    except (Exception, asyncio.TimeoutError) as ex:
+      # The next attempt renders a new one
+      logger.warning(f"Failed to render widget: {ex!r}")
+    return True
+
+  @staticmethod
+  async def _reuse_page(page_or_context: BrowserContext | Page, site_url: str, site_key: str, id: str) -> bool:
+    """Take over the widget of a page left on site_url by a previous solve, resetting it instead of loading the page again"""
+    if isinstance(page_or_context, BrowserContext) or page_or_context.url != site_url:
+      return False
+    try:
+      # Main world, the Turnstile API and the page script solve id aren't visible from the isolated one
+      if await page_or_context.evaluate(c.REUSE_PAGE_JS, [id, site_key], isolated_context=False):
+        logger.debug("Reusing page parked on site")
+        return True
+    except Exception as ex:
+      logger.debug(f"Failed to reuse parked page: {ex}")
+    return False
+
+  @staticmethod
+  async def _remove_widget(page: Page, widget_id: str):
+    try:
+      await page.evaluate(c.REMOVE_WIDGET_JS, widget_id, isolated_context=False)
+    except Exception as ex:
+      logger.debug(f"Failed to remove widget: {ex}")
+
+  @staticmethod
+  async def _reset_widget(page: Page, widget_id: str | None = None) -> bool:
+    """Reset the widget in place through the Turnstile API. False if it's broken and the page has to be reloaded"""
+    try:
+      # Main world, where the page loaded the Turnstile API
+      if await page.evaluate(c.RESET_WIDGET_JS, widget_id, isolated_context=False):
+        logger.debug("Widget reset")
+        return True
+    except Exception as ex:
+      logger.debug(f"Failed to reset widget: {ex}")
+    return False
+
+  @staticmethod
+  async def _collect_event_stats(result: TurnstileResult):
+    """Add up captcha event counters of the page script before it's reloaded or navigated away"""
+    try:
+      # Main world, the page script globals aren't visible from the isolated one
+      if stats := await result.page.evaluate(c.CAPTCHA_EVENT_STATS_JS, isolated_context=False):
+        result.add_event_stats(stats)
+    except Exception as ex:
+      logger.debug(f"Failed to collect captcha event stats: {ex}")
+
+  async def _captcha_event_binding(self, source: dict, id: str, data: dict):
+    try:
+      await self.event_dispatcher.dispatch(id, data)
+    except (ValueError, LookupError) as ex:
+      logger.warning(ex)
+
   async def get_browser(self,
                         playwright: Playwright | None = None,
                         proxy: Proxy | None = None,
@@ -299,15 +493,21 @@ class TurnstileSolver:
     if not playwright:
       playwright = await async_playwright().start()
 
-    # ?
-    # browser: Browser | None = await playwright.chromium.launch_persistent_context(no_viewport=True)
-    browser: Browser | None = await playwright.chromium.launch(
-      executable_path=self.browser_executable_path,
-      channel=self.browser,
-      args=self.browser_args,
-      headless=self.headless,
-      proxy=proxy.dict() if proxy else None,
-    )
+    display = await self.display_pool.acquire() if self.display_pool else None
+    try:
+      browser: Browser | None = await playwright.chromium.launch(
+        executable_path=self.browser_executable_path,
+        channel=self.browser,
+        args=self.browser_args,
+        headless=self.headless,
+        proxy=proxy.dict() if proxy else None,
+        env=self._display_env(display),
+      )
+    except BaseException:
+      display and self.display_pool.release(display)
+      raise
+    if display:
+      browser.on("disconnected", lambda _: self.display_pool.release(display))
     return browser, playwright
 
   async def get_browser_context(self,
@@ -320,11 +520,59 @@ class TurnstileSolver:
       browser, _ = await self.get_browser(playwright)
 
     context = await browser.new_context(
-      proxy=proxy.dict() if proxy else None,
+      proxy=self._context_proxy(proxy),
       no_viewport=True,
     )
+    await self._setup_context(context)
+    return context, playwright
 
-    # await context.route('**', lambda route: route.continue_())
-    # await context.set_extra_http_headers({'HTTP2-Settings': 'MAX_CONCURRENT_STREAMS=100'})
+  async def get_persistent_context(self,
+                                   user_data_dir: str | Path,
+                                   playwright: Playwright | None = None,
+                                   proxy: Proxy | None = None,
+                                   ) -> tuple[BrowserContext, Playwright]:
+    """Launch a browser on a persistent profile, keeping its HTTP cache, service workers and cookies across launches. Closing the context closes the browser"""
 
-    return context, playwright
\ No newline at end of file
+    if not playwright:
+      playwright = await async_playwright().start()
+
+    display = await self.display_pool.acquire() if self.display_pool else None
+    try:
+      context = await playwright.chromium.launch_persistent_context(
+        user_data_dir,
+        executable_path=self.browser_executable_path,
+        channel=self.browser,
+        args=self.browser_args,
+        headless=self.headless,
+        proxy=self._context_proxy(proxy or self.proxy),
+        no_viewport=True,
+        env=self._display_env(display),
+      )
+    except BaseException:
+      display and self.display_pool.release(display)
+      raise
+    if display:
+      context.on("close", lambda _: self.display_pool.release(display))
+    await self._setup_context(context)
+    return context, playwright
+
+  @staticmethod
+  def _display_env(display: Display | None) -> dict[str, str] | None:
+    """Environment of a browser launched on the display, the one of the process otherwise"""
+    return {**os.environ, "DISPLAY": display.name} if display else None
+
+  def _context_proxy(self, proxy: Proxy | None) -> dict | None:
+    proxyDict = proxy.dict() if proxy else None
+    if proxyDict and self.event_transport == CaptchaEventTransport.HTTP and self.callback_host not in proxyDict['bypass']:
+      # Captcha events go straight to the server
+      proxyDict['bypass'] += f", {self.callback_host}"
+    return proxyDict
+
+  async def _setup_context(self, context: BrowserContext):
+    if self.event_transport == CaptchaEventTransport.BINDING:
+      await context.expose_binding(c.CAPTCHA_EVENT_BINDING_NAME, self._captcha_event_binding)
+    if self.api_js_cache:
+      await self.api_js_cache.attach(context)
+
+    # await context.route('**', lambda route: route.continue_())
+    # await context.set_extra_http_headers({'HTTP2-Settings': 'MAX_CONCURRENT_STREAMS=100'})
\ No newline at end of file
@@ -0,0 +1,183 @@
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import logging
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+  def __init__(self, rate: float, burst: float | None = None):
+    """
+    :param rate: Tokens added per second
+    :param burst: Max tokens, defaults to one second worth of tokens
+    """
+    self.rate = rate
+    self.burst = burst or max(1., rate)
+    self._tokens = self.burst
+    self._updated_at = time.monotonic()
+
+  def take(self, n: int = 1) -> float:
+    """Take n tokens, returning 0, or the seconds until they're available without taking any. More than burst tokens are never available at once"""
+    now = time.monotonic()
+    self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+    self._updated_at = now
+    if self._tokens >= n:
+      self._tokens -= n
+      return 0
+    return (n - self._tokens) / self.rate
+
+  def refund(self, n: int = 1):
+    """Give back tokens taken for requests that were rejected before doing any work"""
+    self._tokens = min(self.burst, self._tokens + n)
+
+
+class Tenant:
+  def __init__(self,
+               name: str,
+               secret: str,
+               weight: float = 1,
+               max_concurrency: int | None = None,
+               rate: float | None = None,
+               burst: float | None = None,
+               ):
+    """
+    :param weight: Share of browser pages the tenant gets under contention, relative to other tenants
+    :param max_concurrency: Max solves running at the same time for the tenant
+    :param rate: Max solve requests per second, None for no limit
+    :param burst: Requests allowed at once above rate
+    """
+    if weight <= 0:
+      raise ValueError(f"Tenant '{name}' weight must be positive")
+    self.name = name
+    self.secret = secret
+    self.weight = weight
+    self.max_concurrency = max_concurrency
+    self.bucket = TokenBucket(rate, burst) if rate else None
+    self.active = 0
+    self.rate_limited = 0
+    # Finish tag of the tenant's last granted solve, in scheduler virtual time
+    self.finish_tag = 0.
+    # Heap of (deadline, arrival, future): earliest deadline first, FIFO among requests without one
+    self._waiters: list[tuple[float, int, asyncio.Future]] = []
+
+  @property
+  def queued(self) -> int:
+    return len(self._waiters)
+
+  def take(self, n: int = 1) -> float:
+    """0 if n solve requests are within the tenant rate limit, else the seconds until they are"""
+    if not self.bucket or not (retryAfter := self.bucket.take(n)):
+      return 0
+    self.rate_limited += n
+    return retryAfter
+
+  def refund(self, n: int = 1):
+    """Give back the rate limit of n solve requests rejected by admission control"""
+    if self.bucket:
+      self.bucket.refund(n)
+
+  @property
+  def max_batch(self) -> int | None:
+    """Largest batch the rate limit can ever let through, None for no limit"""
+    return int(self.bucket.burst) if self.bucket else None
+
+  def stats(self) -> dict:
+    return {
+      "weight": self.weight,
+      "max_concurrency": self.max_concurrency,
+      "active": self.active,
+      "queued": self.queued,
+      "rate_limited": self.rate_limited,
+    }
+
+  def __repr__(self) -> str:
+    return f"Tenant({self.name!r})"
+
+  @classmethod
+  def load(cls, path: str | Path) -> list["Tenant"]:
+    """Tenants from a JSON file: a list of objects with the __init__ parameters as keys"""
+    with open(path) as f:
+      return [cls(**entry) for entry in json.load(f)]
+
+
+class TenantScheduler:
+  def __init__(self, tenants: list[Tenant], capacity: Callable[[], int]):
+    """
+    Start-time fair queuing of solves across tenants. Under contention each tenant gets pages in proportion to its weight, up to its concurrency cap
+    :param capacity: Solves that can run at the same time, usually the browser pool capacity
+    """
+    self.tenants = tenants
+    self._capacity = capacity
+    self._active = 0
+    # Start tag of the last granted solve
+    self._virtual_time = 0.
+    self._arrivals = itertools.count()
+
+  @asynccontextmanager
+  async def slot(self, tenant: Tenant, deadline: float | None = None) -> AsyncIterator[None]:
+    await self.acquire(tenant, deadline)
+    try:
+      yield
+    finally:
+      self.release(tenant)
+
+  async def acquire(self, tenant: Tenant, deadline: float | None = None):
+    """
+    Wait for a slot. Within a tenant, queued requests are served earliest deadline first
+    :param deadline: time.monotonic() after which the request is useless
+    """
+    if not any(t._waiters for t in self.tenants) and self._can_run(tenant):
+      self._grant(tenant)
+      return
+    waiter = asyncio.get_running_loop().create_future()
+    heapq.heappush(tenant._waiters, entry := (math.inf if deadline is None else deadline, next(self._arrivals), waiter))
+    self._dispatch()
+    try:
+      await waiter
+    except asyncio.CancelledError:
+      if waiter.done() and not waiter.cancelled():
+        # Granted right before being cancelled
+        self.release(tenant)
+      elif entry in tenant._waiters:
+        tenant._waiters.remove(entry)
+        heapq.heapify(tenant._waiters)
+      raise
+
+  def release(self, tenant: Tenant):
+    tenant.active -= 1
+    self._active -= 1
+    self._dispatch()
+
+  def _can_run(self, tenant: Tenant) -> bool:
+    return self._active < self._capacity() and (tenant.max_concurrency is None or tenant.active < tenant.max_concurrency)
+
+  def _start_tag(self, tenant: Tenant) -> float:
+    return max(tenant.finish_tag, self._virtual_time)
+
+  def _grant(self, tenant: Tenant):
+    self._virtual_time = self._start_tag(tenant)
+    tenant.finish_tag = self._virtual_time + 1 / tenant.weight
+    tenant.active += 1
+    self._active += 1
+
+  def _dispatch(self):
+    while self._active < self._capacity():
+      if not (candidates := [t for t in self.tenants if t._waiters and self._can_run(t)]):
+        return
+      tenant = min(candidates, key=self._start_tag)
+      deadline, _, waiter = heapq.heappop(tenant._waiters)
+      if waiter.done():
+        continue
+      if deadline <= time.monotonic():
+        # Can't succeed anymore, give its slot to a request that still can
+        waiter.set_exception(TimeoutError("Deadline exceeded while queued"))
+        continue
+      self._grant(tenant)
+      waiter.set_result(None)
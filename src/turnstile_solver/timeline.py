@@ -0,0 +1,166 @@
+import asyncio
+import json
+import logging
+import secrets
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+
+from turnstile_solver.constants import TRACE_EXPORT_MAX_QUEUE
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+  def __init__(self, name: str, parent: "Span | None", attributes: dict[str, Any]):
+    self.name = name
+    self.id = secrets.token_hex(8)
+    self.parent = parent
+    self.attributes = attributes
+    self.start = time.time_ns()
+    self.end_time: int | None = None
+    # (name, time.time_ns(), attributes)
+    self.events: list[tuple[str, int, dict[str, Any]]] = []
+
+  @property
+  def duration(self) -> float:
+    """Milliseconds, up to now if the span is still open"""
+    return ((self.end_time or time.time_ns()) - self.start) / 1e6
+
+  def end(self):
+    if self.end_time is None:
+      self.end_time = time.time_ns()
+
+
+class Timeline:
+  """Timestamped spans and events of a single solve"""
+
+  def __init__(self, name: str = "solve", **attributes: Any):
+    self.trace_id = secrets.token_hex(16)
+    self.root = Span(name, None, attributes)
+    self.spans: list[Span] = [self.root]
+    # Open spans, innermost last
+    self._open: list[Span] = [self.root]
+
+  def start(self, name: str, **attributes: Any) -> Span:
+    """Open a span, child of the innermost open span"""
+    span = Span(name, self._open[-1] if self._open else self.root, attributes)
+    self.spans.append(span)
+    self._open.append(span)
+    return span
+
+  def end(self, span: Span):
+    span.end()
+    if span in self._open:
+      self._open.remove(span)
+
+  @contextmanager
+  def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+    span = self.start(name, **attributes)
+    try:
+      yield span
+    finally:
+      self.end(span)
+
+  def event(self, name: str, **attributes: Any):
+    """Point in time event, recorded on the innermost open span"""
+    (self._open[-1] if self._open else self.root).events.append((name, time.time_ns(), attributes))
+
+  def finish(self):
+    for span in reversed(self._open):
+      span.end()
+    self._open.clear()
+
+  def server_timing(self) -> str:
+    """Server-Timing header value: every span of the solve in start order, then the total"""
+    entries = [f"{span.name};dur={span.duration:.1f}" for span in self.spans[1:]]
+    entries.append(f"total;dur={self.root.duration:.1f}")
+    return ", ".join(entries)
+
+  def otlp(self) -> dict[str, Any]:
+    """OTLP/JSON ExportTraceServiceRequest, as written by the OpenTelemetry collector file exporter"""
+
+    def attributes(values: dict[str, Any]) -> list[dict[str, Any]]:
+      return [{"key": k, "value": {"intValue": str(v)} if isinstance(v, int) and not isinstance(v, bool) else {"stringValue": str(v)}} for k, v in values.items()]
+
+    return {"resourceSpans": [{
+      "resource": {"attributes": attributes({"service.name": "turnstile_solver"})},
+      "scopeSpans": [{
+        "scope": {"name": __name__},
+        "spans": [{
+          "traceId": self.trace_id,
+          "spanId": span.id,
+          **({"parentSpanId": span.parent.id} if span.parent else {}),
+          "name": span.name,
+          "kind": 1,
+          "startTimeUnixNano": str(span.start),
+          "endTimeUnixNano": str(span.end_time or span.start),
+          "attributes": attributes(span.attributes),
+          "events": [{"name": name, "timeUnixNano": str(at), "attributes": attributes(attrs)} for name, at, attrs in span.events],
+        } for span in self.spans],
+      }],
+    }]}
+
+  def dict(self) -> list[dict[str, Any]]:
+    """Spans with times in milliseconds relative to the start of the solve"""
+
+    def ms(ns: int) -> float:
+      return round((ns - self.root.start) / 1e6, 1)
+
+    return [{
+      "name": span.name,
+      "start": ms(span.start),
+      "duration": round(span.duration, 1),
+      **({"attributes": span.attributes} if span.attributes else {}),
+      **({"events": [{"name": name, "at": ms(at), **attributes} for name, at, attributes in span.events]} if span.events else {}),
+    } for span in self.spans]
+
+
+class FileSpanExporter:
+  """
+  Appends each finished Timeline as one OTLP/JSON line, readable by the OpenTelemetry collector 'otlpjsonfile' receiver.
+  Lines are written by a background task off the event loop, so a slow disk doesn't hold up solves
+  """
+
+  def __init__(self, path: str | Path, max_queue: int = TRACE_EXPORT_MAX_QUEUE):
+    self.path = Path(path)
+    self.path.parent.mkdir(parents=True, exist_ok=True)
+    self.dropped = 0
+    self._queue: asyncio.Queue[str] = asyncio.Queue(max_queue)
+    self._task: asyncio.Task | None = None
+
+  def export(self, timeline: Timeline):
+    """Queue the timeline to be written. Dropped if the writer is that far behind"""
+    try:
+      self._queue.put_nowait(json.dumps(timeline.otlp()) + "\n")
+    except asyncio.QueueFull:
+      self.dropped += 1
+      logger.warning(f"Solve timeline dropped, trace file writer is {self._queue.qsize()} timelines behind")
+      return
+    if not self._task:
+      self._task = asyncio.create_task(self._write_loop(), name="span_exporter")
+
+  async def close(self):
+    """Write the queued timelines and stop the writer"""
+    if self._task:
+      await self._queue.join()
+      self._task.cancel()
+      self._task = None
+
+  async def _write_loop(self):
+    while True:
+      lines = [await self._queue.get()]
+      while not self._queue.empty():
+        lines.append(self._queue.get_nowait())
+      try:
+        await asyncio.to_thread(self._write, lines)
+      except OSError as ex:
+        logger.warning(f"Failed to export {len(lines)} solve timelines: {ex}")
+      finally:
+        for _ in lines:
+          self._queue.task_done()
+
+  def _write(self, lines: list[str]):
+    with self.path.open('a') as f:
+      f.writelines(lines)
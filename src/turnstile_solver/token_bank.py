@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Callable, Awaitable
+
+from turnstile_solver.constants import TOKEN_BANK_SIZE, TOKEN_TTL, TOKEN_BANK_REFILL_INTERVAL, TOKEN_BANK_FAILURE_BACKOFF
+from turnstile_solver.turnstile_result import TurnstileResult
+from turnstile_solver.turnstile_site import TurnstileSite
+
+logger = logging.getLogger(__name__)
+
+SiteKey = tuple[str, str]
+
+
+class TokenBank:
+  def __init__(self,
+               sites: list[TurnstileSite],
+               solve: Callable[[str, str], Awaitable[tuple[TurnstileResult | None, str | None]]],
+               has_idle_capacity: Callable[[], bool],
+               size: int = TOKEN_BANK_SIZE,
+               token_ttl: float = TOKEN_TTL,
+               ):
+    """
+    Keeps fresh pre-solved tokens for the given sites, refilled in background only while there's idle capacity
+    :param solve: Solves captcha for (site_url, site_key)
+    :param has_idle_capacity: Whether a refill can be started without making requests wait
+    :param size: Tokens kept per site
+    :param token_ttl: Seconds a token is served for after being solved. Must be lower than Turnstile token validity (300 seconds)
+    """
+    self.size = size
+    self.token_ttl = token_ttl
+    self._solve = solve
+    self._has_idle_capacity = has_idle_capacity
+    # (site_url, site_key) -> (token, solved at), oldest first
+    self._tokens: dict[SiteKey, deque[tuple[str, float]]] = {self._key(s.site_url, s.site_key): deque() for s in sites}
+    self._refilling: dict[SiteKey, int] = dict.fromkeys(self._tokens, 0)
+    self._backoff_until: dict[SiteKey, float] = dict.fromkeys(self._tokens, 0.)
+    self._task: asyncio.Task | None = None
+    self._wakeup = asyncio.Event()
+    self._tasks: set[asyncio.Task] = set()
+
+    self.hits = 0
+    self.misses = 0
+    self.expired = 0
+    self.refills = 0
+    self.refill_failures = 0
+
+  @staticmethod
+  def _key(site_url: str, site_key: str) -> SiteKey:
+    # Same normalization as TurnstileSolver.solve()
+    return site_url.rstrip('/') + '/', site_key
+
+  def take(self, site_url: str, site_key: str) -> str | None:
+    """A fresh token for the site if any, else None"""
+    if (tokens := self._tokens.get(key := self._key(site_url, site_key))) is None:
+      return None
+    self._evict_expired(key)
+    if not tokens:
+      self.misses += 1
+      self._wakeup.set()
+      return None
+    self.hits += 1
+    token, _ = tokens.popleft()
+    self._wakeup.set()
+    return token
+
+  def stats(self) -> dict:
+    return {
+      "hits": self.hits,
+      "misses": self.misses,
+      "expired": self.expired,
+      "refills": self.refills,
+      "refill_failures": self.refill_failures,
+      "tokens": {f"{url} {key}": len(tokens) for (url, key), tokens in self._tokens.items()},
+    }
+
+  def start(self):
+    self._task = asyncio.create_task(self._refill_loop(), name="token_bank_refill")
+
+  async def close(self):
+    if self._task:
+      self._task.cancel()
+      self._task = None
+    for task in self._tasks:
+      task.cancel()
+
+  def _evict_expired(self, key: SiteKey):
+    tokens = self._tokens[key]
+    deadline = time.monotonic() - self.token_ttl
+    while tokens and tokens[0][1] <= deadline:
+      tokens.popleft()
+      self.expired += 1
+
+  async def _refill_loop(self):
+    while True:
+      for key in self._tokens:
+        self._evict_expired(key)
+        while (len(self._tokens[key]) + self._refilling[key] < self.size
+               and time.monotonic() >= self._backoff_until[key]
+               and self._has_idle_capacity()):
+          self._refilling[key] += 1
+          self._tasks.add(task := asyncio.create_task(self._refill(key)))
+          task.add_done_callback(self._tasks.discard)
+          # Let the refill take its page before checking capacity again
+          await asyncio.sleep(0)
+      try:
+        await asyncio.wait_for(self._wakeup.wait(), TOKEN_BANK_REFILL_INTERVAL)
+      except asyncio.TimeoutError:
+        pass
+      self._wakeup.clear()
+
+  async def _refill(self, key: SiteKey):
+    try:
+      try:
+        result, error = await self._solve(*key)
+      except Exception as ex:
+        result, error = None, str(ex)
+      if result:
+        self._tokens[key].append((result.token, time.monotonic()))
+        self.refills += 1
+      else:
+        logger.warning(f"Token bank refill failed for '{key[0]}': {error}")
+        self.refill_failures += 1
+        self._backoff_until[key] = time.monotonic() + TOKEN_BANK_FAILURE_BACKOFF
+    finally:
+      self._refilling[key] -= 1
+      self._wakeup.set()
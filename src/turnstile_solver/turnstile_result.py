@@ -1,6 +1,5 @@
 import datetime
 import logging
-import time
 from typing import Any
 
 import asyncio
@@ -8,14 +7,17 @@ import asyncio
 from patchright.async_api import BrowserContext, Page
 
 from turnstile_solver.enums import CaptchaApiMessageEvent
+from turnstile_solver.timeline import Timeline
 from turnstile_solver.utils import password
 
 logger = logging.getLogger(__name__)
 
 _CLICK_CHECKBOX_SCRIPT = """
-  let containerWidth = document.querySelector('.cf-turnstile').width;
-  let width = containerWidth * 0.2;
-  document.querySelector('.cf-turnstile').width = width;
+  selector => {
+    let containerWidth = document.querySelector(selector).width;
+    let width = containerWidth * 0.2;
+    document.querySelector(selector).width = width;
+  }
 """
 
 
@@ -25,19 +27,32 @@ class TurnstileResult:
                elapsed: datetime.timedelta | None = None,
                browser_context: BrowserContext | None = None,
                page: Page | None = None,
+               timeline: Timeline | None = None,
                ):
     self.token = token
     self.elapsed = elapsed
     self.browser_context = browser_context
     self.page = page
+    # Turnstile widget id when the solve has a widget of its own on a page shared with other solves
+    self.widget_id: str | None = None
+    self.timeline = timeline or Timeline()
     self._id = password(10)
     self._received_captcha_events: set[CaptchaApiMessageEvent] = set()
+    # Captcha events received by the page script and the ones it forwarded after filtering and coalescing, across all attempts
+    self.event_stats = {'received': 0, 'forwarded': 0}
+    # Pending wait_for_captcha_event() calls: events each one is interested in, and the future resolved with the first of them received
+    self._captcha_event_waiters: list[tuple[set[CaptchaApiMessageEvent], asyncio.Future]] = []
 
   @property
   def id(self) -> str:
     return self._id
 
+  @property
+  def widget_selector(self) -> str:
+    return f"#w-{self.id}" if self.widget_id else ".cf-turnstile"
+
   async def captcha_api_message_event_handler(self, evt: CaptchaApiMessageEvent, data: dict[str, Any]):
+    self.timeline.event(evt.value)
     if evt == CaptchaApiMessageEvent.COMPLETE:
       self.token = data['token']
     elif evt == CaptchaApiMessageEvent.INTERACTIVE_BEGIN:
@@ -46,6 +61,13 @@ class TurnstileResult:
       # await asyncio.sleep(random.uniform(0.1, 0.5))
       await self.click_checkbox()
     self._received_captcha_events.add(evt)
+    for evts, waiter in self._captcha_event_waiters:
+      if evt in evts and not waiter.done():
+        waiter.set_result(evt)
+
+  def add_event_stats(self, stats: dict[str, int]):
+    for key in self.event_stats:
+      self.event_stats[key] += stats.get(key, 0)
 
   def reset_captcha_fields(self):
     self._received_captcha_events.clear()
@@ -55,31 +77,36 @@ class TurnstileResult:
                                    *cancelling_evts: CaptchaApiMessageEvent,
                                    evt: CaptchaApiMessageEvent,
                                    timeout: float,
-                                   sleep_time: float = 0.05,
                                    ) -> CaptchaApiMessageEvent | bool:
-    endTime = time.time() + timeout
-    while True:
-      if evt in self._received_captcha_events:
-        return True
-      elif cancelling_evts:
-        for e in cancelling_evts:
-          if e in self._received_captcha_events:
-            return e
-      if time.time() >= endTime:
-        raise TimeoutError(f"Captcha event '{evt.value}' not received within {timeout} seconds")
-      await asyncio.sleep(sleep_time)
+    """Return True once `evt` is received, or the cancelling event if one of `cancelling_evts` is received first"""
+    if evt in self._received_captcha_events:
+      return True
+    for e in cancelling_evts:
+      if e in self._received_captcha_events:
+        return e
+
+    waiter = asyncio.get_running_loop().create_future()
+    self._captcha_event_waiters.append(entry := ({evt, *cancelling_evts}, waiter))
+    try:
+      received = await asyncio.wait_for(waiter, timeout)
+    except asyncio.TimeoutError:
+      raise TimeoutError(f"Captcha event '{evt.value}' not received within {timeout} seconds") from None
+    finally:
+      self._captcha_event_waiters.remove(entry)
+    return True if received == evt else received
 
   async def click_checkbox(self, page: Page | None = None):
     page = page or self.page
     # Uncomment these lines if you think CAPTCHA solving process is failing because of the absence of a delay
     # import random
     # await asyncio.sleep(random.uniform(2, 3))
-    await page.evaluate(_CLICK_CHECKBOX_SCRIPT)
+    await page.evaluate(_CLICK_CHECKBOX_SCRIPT, self.widget_selector)
     # TODO: For some sites this click approach seems to be detected by Cloudflare causing the CAPTCHA solving process to fail (Example site • https://chat.deepseek.com/ 0x4AAAAAAA1jQEh8YFk064tz)
     # await page.click(".cf-turnstile")
     # await page.locator("//div[@class='cf-turnstile']").click(timeout=1000)
     try:
-      await page.locator('.cf-turnstile').click(timeout=1000)
+      with self.timeline.span("click"):
+        await page.locator(self.widget_selector).click(timeout=1000)
       logger.debug("Attempt to click checkbox performed")
     except TimeoutError:
       logger.error("Captcha widget click timed-out")
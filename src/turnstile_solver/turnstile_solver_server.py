@@ -1,31 +1,48 @@
+import json
 import logging
+import math
 import time
-from inspect import isawaitable
-from types import NoneType
+from contextlib import nullcontext
+from pathlib import Path
 from typing import Callable, Any, Awaitable
 
 from typing import TYPE_CHECKING
 
 import asyncio
 
-from quart import Quart, Response, request
+import requests
+from quart import Quart, Response, request, websocket, g
 
-from turnstile_solver.enums import CaptchaApiMessageEvent
-from turnstile_solver.constants import PORT, HOST, CAPTCHA_EVENT_CALLBACK_ENDPOINT, MAX_CONTEXTS, MAX_PAGES_PER_CONTEXT
+from turnstile_solver.admission import AdmissionController
+from turnstile_solver.captcha_event_dispatcher import CaptchaEventDispatcher
+from turnstile_solver.constants import PORT, HOST, CAPTCHA_EVENT_CALLBACK_ENDPOINT, MAX_CONTEXTS, MAX_PAGES_PER_CONTEXT, WIDGETS_PER_PAGE, PAGE_PARK_TTL, STANDBY_BROWSER, PAGE_LOST_RETRIES, MIN_IDLE_CONTEXTS, MAX_IDLE_CONTEXTS, CONTEXT_IDLE_TTL
+from turnstile_solver.profile_store import ProfileStore
 from turnstile_solver.proxy_provider import ProxyProvider
+from turnstile_solver.recycle_policy import RecyclePolicy
 from turnstile_solver.solver_console import SolverConsole
-from turnstile_solver.constants import SECRET
+from turnstile_solver.constants import SECRET, JOB_MAX_WAIT, WEBHOOK_TIMEOUT, MAX_BATCH_SIZE, TOKEN_BANK_SIZE, TOKEN_TTL, WS_MAX_IN_FLIGHT, ADMISSION_MAX_QUEUE, SOLVE_BUDGET
+from turnstile_solver.job_table import Job, JobTable
+from turnstile_solver.metrics import REGISTRY, SOLVES, SOLVE_SITE_KEY, POOL_WAIT_SECONDS
 from turnstile_solver.browser_context_pool import BrowserContextPool
+from turnstile_solver.browser_endpoint import BrowserEndpoint
+from turnstile_solver.tenants import Tenant, TenantScheduler
+from turnstile_solver.timeline import Timeline, FileSpanExporter
+from turnstile_solver.token_bank import TokenBank
+from turnstile_solver.turnstile_result import TurnstileResult
+from turnstile_solver.turnstile_site import TurnstileSite
 
 if TYPE_CHECKING:
   from turnstile_solver.solver import TurnstileSolver
 
 logger = logging.getLogger(__name__)
 
+DEADLINE_ERROR = "deadline must be a Unix time in seconds, timeout a positive number of seconds"
+PAGE_LOST_ERROR = f"Browser page lost while solving, {PAGE_LOST_RETRIES} retries included"
+
 
 class TurnstileSolverServer:
 
-  MessageEventHandler = Callable[[CaptchaApiMessageEvent, dict[str, Any]], NoneType | Awaitable[None]]
+  MessageEventHandler = CaptchaEventDispatcher.MessageEventHandler
 
   def __init__(self,
                host: str = HOST,
@@ -37,7 +54,15 @@ class TurnstileSolverServer:
                console: SolverConsole = SolverConsole(),
                log_level: str | int = logging.INFO,
                secret: str = SECRET,
+               trace_file: str | Path | None = None,
+               tenants: list[Tenant] | None = None,
+               job_id_prefix: str = "",
                ):
+    """
+    :param trace_file: File every solve timeline is appended to, as OpenTelemetry OTLP/JSON spans
+    :param tenants: API keys besides `secret`, each one with its own share of the browser pool and limits. `secret` is the 'default' tenant
+    :param job_id_prefix: Prepended to the ids of the jobs created by this server
+    """
     logger.setLevel(log_level)
     if disable_access_logs:
       logging.getLogger('hypercorn.access').disabled = True
@@ -47,7 +72,7 @@ class TurnstileSolverServer:
     self.console = console
     self.solver: "TurnstileSolver" = turnstile_solver
     self.down: bool = True
-    self._captcha_message_event_handlers: dict[str, TurnstileSolverServer.MessageEventHandler] = {}
+    self.event_dispatcher = CaptchaEventDispatcher(ignore_food_events)
     self.on_shutting_down = on_shutting_down
     # /solve endpoint intended fields
     # self.browser_context: BrowserContext | None = None
@@ -55,10 +80,19 @@ class TurnstileSolverServer:
     # deprecated
     # self.page_pool: PagePool | None = None
     self.secret = secret
-    self.ignore_food_events = ignore_food_events
+    self.default_tenant = Tenant("default", secret)
+    # secret -> Tenant
+    self.tenants: dict[str, Tenant] = {t.secret: t for t in [self.default_tenant, *(tenants or [])]}
+    self.scheduler: TenantScheduler | None = None
+    self.jobs = JobTable()
+    self.job_id_prefix = job_id_prefix
+    self.token_bank: TokenBank | None = None
+    self.admission: AdmissionController | None = None
+    self.span_exporter = FileSpanExporter(trace_file) if trace_file else None
+    self._tasks: set[asyncio.Task] = set()
 
-    self._lock = asyncio.Lock()
     self._setup_routes()
+    self._setup_metrics()
 
   def _setup_routes(self) -> None:
     """Set up the application routes."""
@@ -66,21 +100,66 @@ class TurnstileSolverServer:
     self.app.after_request(self._after_request)
     self.app.post(CAPTCHA_EVENT_CALLBACK_ENDPOINT)(self._handle_captcha_message_event)
     self.app.get('/solve')(self._solve)
+    self.app.post('/solve/batch')(self._solve_batch)
+    self.app.post('/jobs')(self._create_job)
+    self.app.get('/jobs/<id>')(self._get_job)
+    self.app.get('/token_bank')(self._token_bank_stats)
+    self.app.get('/metrics')(self._metrics)
+    self.app.websocket('/ws')(self._websocket)
     self.app.get('/')(self._index)
 
+  def _setup_metrics(self) -> None:
+    """Pool gauges, read from the BrowserContextPool at scrape time"""
+
+    def contexts():
+      if p := self.browser_context_pool:
+        return {("in_use",): len(p.in_use), ("idle",): len(p.idle)}
+
+    def pages():
+      if p := self.browser_context_pool:
+        return {
+          ("in_use",): sum(len(pagePool.in_use) for pagePool in p.items),
+          ("idle",): sum(len(pagePool.idle) for pagePool in p.items),
+          ("reserved",): sum(p.leases(pagePool) for pagePool in p.items),
+        }
+
+    REGISTRY.gauge("turnstile_pool_contexts", "Browser contexts in the pool", contexts, labels=("state",))
+    REGISTRY.gauge("turnstile_pool_pages", "Pages across all browser contexts. Reserved pages are leased or about to be", pages, labels=("state",))
+    REGISTRY.gauge("turnstile_pool_waiting", "Solves waiting for a page", lambda: (p := self.browser_context_pool) and p.waiting)
+    REGISTRY.gauge("turnstile_admission_in_flight", "Admitted solves not finished yet", lambda: (a := self.admission) and a.in_flight)
+    REGISTRY.gauge("turnstile_admission_rejected", "Solves rejected by admission control since start", lambda: (a := self.admission) and a.rejected)
+    REGISTRY.gauge("turnstile_tenant_solves", "Solves per tenant, running or queued for a page", lambda: {
+      **{(t.name, "active"): t.active for t in self.tenants.values()},
+      **{(t.name, "queued"): t.queued for t in self.tenants.values()},
+    }, labels=("tenant", "state"))
+    REGISTRY.gauge("turnstile_remote_browser_contexts", "Browser contexts open on each remote browser, by connection state", lambda: (p := self.browser_context_pool) and {
+      (e.url, "connected" if e.connected else "disconnected"): e.contexts for e in p.remote_browsers
+    }, labels=("endpoint", "state"))
+    REGISTRY.gauge("turnstile_virtual_display_browsers", "Browsers running on each virtual display, by display state", lambda: (s := self.solver) and (d := s.display_pool) and {
+      (str(display.index), "up" if display.running else "down"): display.browsers for display in d.displays
+    }, labels=("display", "state"))
+
   def subscribe_captcha_message_event_handler(self, id: str, handler: MessageEventHandler):
-    logger.debug(f"Captcha message event handler with id '{id}' subscribed")
-    self._captcha_message_event_handlers[id] = handler
+    self.event_dispatcher.subscribe(id, handler)
 
   def unsubscribe_captcha_message_event_handler(self, id: str):
-    logger.debug(f"Captcha message event handler with id '{id}' unsubscribed")
-    self._captcha_message_event_handlers.pop(id, None)
+    self.event_dispatcher.unsubscribe(id)
 
   async def create_browser_context_pool(self,
                                         max_contexts: int = MAX_CONTEXTS,
                                         max_pages_per_context: int = MAX_PAGES_PER_CONTEXT,
                                         single_instance: bool = False,
                                         proxy_provider: ProxyProvider | None = None,
+                                        min_idle_contexts: int = MIN_IDLE_CONTEXTS,
+                                        max_idle_contexts: int = MAX_IDLE_CONTEXTS,
+                                        context_idle_ttl: float = CONTEXT_IDLE_TTL,
+                                        context_recycle_policy: RecyclePolicy | None = None,
+                                        page_recycle_policy: RecyclePolicy | None = None,
+                                        widgets_per_page: int = WIDGETS_PER_PAGE,
+                                        page_park_ttl: float = PAGE_PARK_TTL,
+                                        standby_browser: bool = STANDBY_BROWSER,
+                                        remote_browsers: list[BrowserEndpoint] | None = None,
+                                        profile_store: ProfileStore | None = None,
                                         ):
     assert self.solver is not None
     self.browser_context_pool = BrowserContextPool(
@@ -89,8 +168,48 @@ class TurnstileSolverServer:
       max_pages_per_context=max_pages_per_context,
       single_instance=single_instance,
       proxy_provider=proxy_provider,
+      min_idle=min_idle_contexts,
+      max_idle=max_idle_contexts,
+      idle_ttl=context_idle_ttl,
+      context_recycle_policy=context_recycle_policy,
+      page_recycle_policy=page_recycle_policy,
+      widgets_per_page=widgets_per_page,
+      page_park_ttl=page_park_ttl,
+      standby_browser=standby_browser,
+      remote_browsers=remote_browsers,
+      profile_store=profile_store,
     )
     await self.browser_context_pool.init()
+    pool = self.browser_context_pool
+    self.scheduler = TenantScheduler(list(self.tenants.values()), capacity=lambda: pool.size * pool.item_capacity)
+
+  def create_token_bank(self,
+                        sites: list[TurnstileSite],
+                        size: int = TOKEN_BANK_SIZE,
+                        token_ttl: float = TOKEN_TTL,
+                        ):
+    assert self.browser_context_pool is not None
+    pool = self.browser_context_pool
+    self.token_bank = TokenBank(
+      sites=sites,
+      solve=self.solve,
+      has_idle_capacity=lambda: not pool.waiting and not pool.is_full,
+      size=size,
+      token_ttl=token_ttl,
+    )
+    self.token_bank.start()
+
+  def create_admission_controller(self,
+                                  max_queue: int = ADMISSION_MAX_QUEUE,
+                                  default_budget: float = SOLVE_BUDGET,
+                                  ):
+    assert self.browser_context_pool is not None
+    pool = self.browser_context_pool
+    self.admission = AdmissionController(
+      capacity=lambda: pool.size * pool.item_capacity,
+      max_queue=max_queue,
+      default_budget=default_budget,
+    )
 
   # deprecated
   # async def create_page_pool(self):
@@ -114,6 +233,14 @@ class TurnstileSolverServer:
     async def afterServing():
       self.down = True
       logger.info("Server is down")
+      if self.token_bank:
+        await self.token_bank.close()
+      if self.span_exporter:
+        await self.span_exporter.close()
+      if self.browser_context_pool:
+        await self.browser_context_pool.close()
+      if self.solver and self.solver.display_pool:
+        await self.solver.display_pool.close()
       if callable(self.on_shutting_down):
         await self.on_shutting_down()
 
@@ -129,76 +256,398 @@ class TurnstileSolverServer:
     try:
       logger.debug('Handling captcha message event')
       data: dict[str, Any] = await request.get_json(force=True)
-      evt: CaptchaApiMessageEvent | str | None = data.pop('event', None)
-      if not evt:
-        return self._bad(f"message has no event entry. Data: {data}", log=True)
       try:
-        evt = CaptchaApiMessageEvent(evt)
-      except ValueError:
-        return self._bad(f"Unknown event: '{evt}'")
-
-      if not (id := request.args.get("id")):
-        return self._bad("id parameter not specified")
-
-      if not self._captcha_message_event_handlers:
-        return self._error("There's no handlers for handling captcha event", warning=True)
-      else:
-        handler = self._captcha_message_event_handlers.get(id)
-        if not handler:
-          return self._error(f"There's no handler for handling event with ID: {id}", warning=True)
-        if evt != CaptchaApiMessageEvent.FOOD or not self.ignore_food_events:
-          logger.debug(f"Dispatching '{evt.value}' event")
-        if isawaitable(a := handler(evt, data)):
-          await a
-
+        await self.event_dispatcher.dispatch(request.args.get("id"), data)
+      except ValueError as ve:
+        return self._bad(str(ve), log=True)
+      except LookupError as le:
+        return self._error(str(le), warning=True)
     except Exception:
       self.console.print_exception()
       return self._error(self.solver.error, log=False)
     return self._ok()
 
-  async def _solve(self):
+  async def solve(self,
+                  site_url: str,
+                  site_key: str,
+                  timeline: Timeline | None = None,
+                  tenant: Tenant | None = None,
+                  deadline: float | None = None,
+                  ) -> tuple[TurnstileResult | None, str | None]:
+    """Solve captcha on a page from the BrowserContextPool. Returns the result if solved, else None along with the error
+    :param tenant: Tenant the solve is scheduled for, default tenant if None
+    :param deadline: time.monotonic() the solve must be done by. Once it passes the solve is cancelled, its page put back and TimeoutError raised
+    """
+    tenant = tenant or self.default_tenant
+    timeline = timeline or Timeline(site_url=site_url, site_key=site_key, tenant=tenant.name)
+    if deadline is None:
+      return await self._solve_on_page(site_url, site_key, timeline, tenant, deadline)
     try:
-      if self.solver is None:
-        return self._error("No TurnstileSolver instance has been assigned")
+      return await asyncio.wait_for(self._solve_on_page(site_url, site_key, timeline, tenant, deadline), deadline - time.monotonic())
+    except asyncio.TimeoutError:
+      raise TimeoutError("Deadline exceeded") from None
 
-      if not self.browser_context_pool:
-        return self._error("No BrowserContextPool instance has been assigned")
+  async def _solve_on_page(self, site_url: str, site_key: str, timeline: Timeline, tenant: Tenant, deadline: float | None) -> tuple[TurnstileResult | None, str | None]:
+    try:
+      # A solve whose page is lost is moved to a healthy one
+      for retry in range(PAGE_LOST_RETRIES + 1):
+        if retry:
+          logger.warning(f"Page lost while solving, retrying on another page ({retry}/{PAGE_LOST_RETRIES})")
+        if (solved := await self._solve_once(site_url, site_key, timeline, tenant, deadline)) is not None:
+          return solved
+      return None, PAGE_LOST_ERROR
+    finally:
+      timeline.finish()
+      if self.span_exporter:
+        self.span_exporter.export(timeline)
+
+  async def _solve_once(self, site_url: str, site_key: str, timeline: Timeline, tenant: Tenant, deadline: float | None) -> tuple[TurnstileResult | None, str | None] | None:
+    """Solve on a page from the pool, None if the page crashed or its browser went away in the meantime"""
+    waitSpan = timeline.start("pool_wait")
+    # Page is put back on its PagePool before the PagePool itself is put back
+    sharedPage = self.browser_context_pool.widgets_per_page > 1
+    # Pages are left on their site for the next solve of it. Widgets sharing a page are all for the same site_url
+    siteUrl = site_url.rstrip('/') + '/'
+    async with self.scheduler.slot(tenant, deadline) if self.scheduler else nullcontext():
+      # From the context lease until the page is acquired, both levels of the pool
+      poolWaitStart = time.perf_counter()
+      async with self.browser_context_pool.lease(key=siteUrl) as pagePool, pagePool.lease(key=siteUrl) as page:
+        POOL_WAIT_SECONDS.observe(time.perf_counter() - poolWaitStart)
+        timeline.end(waitSpan)
+        startTime = time.perf_counter()
+        result = None
+        outcome = "error"
+        lost = pagePool.lost(page)
+        solve = asyncio.ensure_future(self.solver.solve(
+          site_url=site_url,
+          site_key=site_key,
+          page=page,
+          timeline=timeline,
+          shared_page=sharedPage,
+        ))
+        try:
+          await asyncio.wait((solve, lost), return_when=asyncio.FIRST_COMPLETED)
+          # Errors of a solve on a lost page come from the page being gone
+          if not solve.done() or (solve.exception() and lost.done()):
+            outcome = "lost"
+            timeline.event("page_lost", reason=lost.result())
+            return None
+          result = solve.result()
+          outcome = "success" if result else "failure"
+        except asyncio.CancelledError:
+          # Client gone or deadline passed, not the page's fault
+          outcome = "cancelled"
+          timeline.event("cancelled")
+          raise
+        finally:
+          if not solve.done():
+            solve.cancel()
+            await asyncio.wait((solve,))
+          SOLVES.inc(SOLVE_SITE_KEY(site_key), outcome)
+          if outcome not in ("cancelled", "lost"):
+            if self.admission:
+              self.admission.record_service_time(time.perf_counter() - startTime)
+            self.browser_context_pool.record_solve(pagePool, page, result.elapsed.total_seconds() if result else None)
+        return result, None if result else self.solver.error
+
+  async def _solve_response(self, site_url: str, site_key: str, timeline: Timeline | None = None, deadline: float | None = None, tenant: Tenant | None = None) -> tuple[dict[str, str], int]:
+    """Token from the token bank if any, else solve unless the admission controller rejects the request
+    :param deadline: time.monotonic() the client needs the token by
+    """
+    if self.token_bank and (token := self.token_bank.take(site_url, site_key)):
+      SOLVES.inc(SOLVE_SITE_KEY(site_key), "banked")
+      return self._ok({
+        "token": token,
+        "elapsed": "0",
+        "banked": True,
+      })
+
+    # Rejected without solving, it doesn't count against the tenant rate limit
+    if (budget := self._budget(deadline)) is not None and budget <= 0:
+      (tenant or self.default_tenant).refund()
+      return self._error("Deadline exceeded", 504, warning=True)
+    if self.admission and (retryAfter := self.admission.admit(budget)) is not None:
+      (tenant or self.default_tenant).refund()
+      return self._busy(retryAfter)
+    try:
+      result, error = await self.solve(site_url, site_key, timeline, tenant, deadline)
+    except TimeoutError as te:
+      return self._error(str(te), 504, warning=True)
+    finally:
+      if self.admission:
+        self.admission.release()
+    if not result:
+      return self._error(error)
+
+    return self._ok({
+      "token": result.token,
+      "elapsed": str(result.elapsed.total_seconds()),
+    })
+
+  def _solve_unavailable(self) -> str | None:
+    if self.solver is None:
+      return "No TurnstileSolver instance has been assigned"
+    if not self.browser_context_pool:
+      return "No BrowserContextPool instance has been assigned"
+    return None
+
+  @staticmethod
+  def _solve_deadline(data: dict[str, Any], headers: dict[str, str] | None = None) -> float | None:
+    """
+    Optional client deadline as time.monotonic(), from the 'deadline' request field or 'X-Deadline' header (Unix time in seconds), or from the 'timeout' field (seconds from now).
+    Raises ValueError if they're not finite numbers
+    """
+    if (deadline := data.get('deadline') or (headers or {}).get('X-Deadline')) is not None:
+      if not math.isfinite(deadline := float(deadline)):
+        raise ValueError
+      return time.monotonic() + deadline - time.time()
+    if (timeout := data.get('timeout')) is None:
+      return None
+    if not math.isfinite(timeout := float(timeout)) or timeout <= 0:
+      raise ValueError
+    return time.monotonic() + timeout
+
+  @staticmethod
+  def _budget(deadline: float | None) -> float | None:
+    """Seconds left until the deadline"""
+    return None if deadline is None else deadline - time.monotonic()
+
+  @staticmethod
+  def _solve_params(data: dict[str, Any]) -> tuple[str, str] | str:
+    """site_url and site_key from request data, or error message"""
+    if not (site_url := data.get('site_url')):
+      return "site_url required"
+    if not (site_key := data.get('site_key')):
+      return "site_key required"
+    return site_url, site_key
+
+  async def _solve(self):
+    try:
+      if error := self._solve_unavailable():
+        return self._error(error)
 
       data: dict[str, str] = await request.get_json(force=True)
-      if not (site_url := data.get('site_url')):
-        return self._bad("site_url required")
-      if not (site_key := data.get('site_key')):
-        return self._bad("site_key required")
+      if isinstance(params := self._solve_params(data), str):
+        return self._bad(params)
+      try:
+        deadline = self._solve_deadline(data, request.headers)
+      except (TypeError, ValueError):
+        return self._bad(DEADLINE_ERROR)
+      if retryAfter := g.tenant.take():
+        return self._busy_response(retryAfter, f"Rate limit exceeded for tenant '{g.tenant.name}'")
+
+      timeline = Timeline(site_url=params[0], site_key=params[1], tenant=g.tenant.name)
+      response, statusCode = await self._solve_response(*params, timeline, deadline, g.tenant)
+      timeline.finish()
+      if data.get('timeline'):
+        response["timeline"] = timeline.dict()
+      headers = {"Server-Timing": timeline.server_timing()}
+      if statusCode == 429:
+        headers["Retry-After"] = str(response["retry_after"])
+      return response, statusCode, headers
+    except Exception as ex:
+      self.console.print_exception()
+      return self._error(str(ex))
+
+  async def _solve_batch(self):
+    try:
+      if error := self._solve_unavailable():
+        return self._error(error)
 
-      async with self._lock:
-        pagePool = await self.browser_context_pool.get()
-        page = await pagePool.get()
+      data: dict[str, Any] = await request.get_json(force=True)
+      if isinstance(params := self._solve_params(data), str):
+        return self._bad(params)
+      try:
+        count = int(data.get('count', 1))
+      except (TypeError, ValueError):
+        return self._bad("count must be an integer")
+      if not 1 <= count <= MAX_BATCH_SIZE:
+        return self._bad(f"count must be between 1 and {MAX_BATCH_SIZE}")
+      if (maxBatch := g.tenant.max_batch) is not None and count > maxBatch:
+        return self._bad(f"count can't exceed {maxBatch}, the rate limit burst of tenant '{g.tenant.name}'")
+      try:
+        deadline = self._solve_deadline(data, request.headers)
+      except (TypeError, ValueError):
+        return self._bad(DEADLINE_ERROR)
+      # Shed the whole batch up front rather than streaming back a run of rejections
+      if self.admission and (retryAfter := self.admission.check(self._budget(deadline), count)) is not None:
+        return self._busy_response(retryAfter)
+      if retryAfter := g.tenant.take(count):
+        return self._busy_response(retryAfter, f"Rate limit exceeded for tenant '{g.tenant.name}'")
+    except Exception as ex:
+      self.console.print_exception()
+      return self._error(str(ex))
 
+    logger.debug(f"Solving batch of {count} captchas")
+    # Request context is gone once the response starts streaming
+    tenant = g.tenant
+
+    async def results():
+      tasks = [asyncio.create_task(self._solve_response(*params, deadline=deadline, tenant=tenant)) for _ in range(count)]
       try:
-        if not (result := await self.solver.solve(
-            site_url=site_url,
-            site_key=site_key,
-            page=page,
-            about_blank_on_finish=True,
-        )):
-          return self._error(self.solver.error)
+        # Stream each token as soon as it's solved
+        for task in asyncio.as_completed(tasks):
+          try:
+            data, _ = await task
+          except Exception as ex:
+            data, _ = self._error(str(ex))
+          yield json.dumps(data) + "\n"
       finally:
-        await self.browser_context_pool.put_back(pagePool)
-        await pagePool.put_back(page)
+        # Client disconnected or batch done, don't keep solving for nobody
+        for task in tasks:
+          task.cancel()
+
+    return results(), 200, {"Content-Type": "application/x-ndjson"}
+
+  def _saturated(self) -> bool:
+    return self.browser_context_pool.waiting > 0 or self.browser_context_pool.is_full
+
+  async def _websocket(self):
+    """
+    Multiplexed solve protocol. Client sends {"id": ..., "site_url": ..., "site_key": ...} messages, results come back as soon as they're solved
+    as {"type": "result", "id": ..., <same fields as /solve>}. {"type": "backpressure", "pause": true|false} messages are sent when the browser pool becomes saturated or available again
+    """
+    if not (tenant := self.tenants.get(websocket.headers.get('secret') or websocket.args.get('secret'))):
+      logger.error("Forbidden")
+      await websocket.close(1008, "Forbidden")
+      return
+    if error := self._solve_unavailable():
+      await websocket.close(1011, error)
+      return
+
+    inFlight: set[asyncio.Task] = set()
+    paused = False
+
+    async def send(type: str, id: Any, data: dict):
+      await websocket.send(json.dumps({"type": type, "id": id} | data))
+
+    async def updateBackpressure():
+      nonlocal paused
+      if (saturated := self._saturated()) != paused:
+        paused = saturated
+        await send("backpressure", None, {"pause": paused, "waiting": self.browser_context_pool.waiting})
+
+    async def solveOne(id: Any, params: tuple[str, str], deadline: float | None):
+      try:
+        data, _ = await self._solve_response(*params, deadline=deadline, tenant=tenant)
+      except Exception as ex:
+        data, _ = self._error(str(ex))
+      await send("result", id, data)
+      await updateBackpressure()
 
-      self._page = result.page
-      return self._ok({
-        "token": result.token,
-        "elapsed": str(result.elapsed.total_seconds()),
-      })
+    try:
+      while True:
+        try:
+          data = json.loads(await websocket.receive())
+          id = data['id']
+        except (ValueError, TypeError, KeyError):
+          await send("result", None, self._bad("Message must be a JSON object with an id")[0])
+          continue
+        if isinstance(params := self._solve_params(data), str):
+          await send("result", id, self._bad(params)[0])
+          continue
+        try:
+          deadline = self._solve_deadline(data)
+        except (TypeError, ValueError):
+          await send("result", id, self._bad(DEADLINE_ERROR)[0])
+          continue
+        if retryAfter := tenant.take():
+          await send("result", id, self._busy(retryAfter, f"Rate limit exceeded for tenant '{tenant.name}'")[0])
+          continue
+        if len(inFlight) >= WS_MAX_IN_FLIGHT:
+          await send("result", id, self._error(f"Too many requests in flight, max: {WS_MAX_IN_FLIGHT}", 429, warning=True)[0])
+          continue
+        inFlight.add(task := asyncio.create_task(solveOne(id, params, deadline)))
+        task.add_done_callback(inFlight.discard)
+        await updateBackpressure()
+    finally:
+      # Connection closed, nobody will collect these results
+      for task in inFlight:
+        task.cancel()
+
+  async def _create_job(self):
+    try:
+      if error := self._solve_unavailable():
+        return self._error(error)
+
+      data: dict[str, str] = await request.get_json(force=True)
+      if isinstance(params := self._solve_params(data), str):
+        return self._bad(params)
+      if (webhookUrl := data.get('webhook_url')) and not webhookUrl.startswith(('http://', 'https://')):
+        return self._bad("webhook_url must be an http(s) URL")
+
+      job = Job(*params, webhook_url=webhookUrl, id_prefix=self.job_id_prefix)
+      if retryAfter := g.tenant.take():
+        return self._busy_response(retryAfter, f"Rate limit exceeded for tenant '{g.tenant.name}'")
+      if self.admission and (retryAfter := self.admission.admit()) is not None:
+        g.tenant.refund()
+        return self._busy_response(retryAfter)
+      if not self.jobs.add(job):
+        if self.admission:
+          self.admission.release()
+        return self._error("Too many pending jobs", 503, warning=True)
+      self._tasks.add(task := asyncio.create_task(self._run_job(job, g.tenant)))
+      task.add_done_callback(self._tasks.discard)
+      logger.debug(f"Job '{job.id}' created")
+      return self._json("OK", None, 202, job.dict())
     except Exception as ex:
       self.console.print_exception()
       return self._error(str(ex))
 
+  async def _get_job(self, id: str):
+    if not (job := self.jobs.get(id)):
+      return self._error(f"Job '{id}' not found", 404, log=False)
+    # Long-poll
+    try:
+      wait = min(float(request.args.get('wait', 0)), JOB_MAX_WAIT)
+    except ValueError:
+      return self._bad("wait must be a number of seconds")
+    if wait > 0 and not job.finished:
+      await job.wait(wait)
+    return self._ok(job.dict())
+
+  async def _token_bank_stats(self):
+    if not self.token_bank:
+      return self._error("Token bank is disabled", 404, log=False)
+    return self._ok(self.token_bank.stats())
+
+  async def _metrics(self):
+    return Response(REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+  async def _run_job(self, job: Job, tenant: Tenant | None = None):
+    try:
+      result, error = await self.solve(job.site_url, job.site_key, tenant=tenant)
+      if result:
+        job.finish(token=result.token, elapsed=result.elapsed.total_seconds())
+      else:
+        job.finish(error=error)
+    except Exception as ex:
+      logger.error(f"Job '{job.id}' failed: {ex}")
+      job.finish(error=str(ex))
+    finally:
+      if self.admission:
+        self.admission.release()
+    if job.webhook_url:
+      await self._deliver_webhook(job)
+
+  async def _deliver_webhook(self, job: Job):
+    try:
+      response = await asyncio.to_thread(
+        requests.post,
+        job.webhook_url,
+        json=job.dict(),
+        timeout=WEBHOOK_TIMEOUT,
+      )
+      response.raise_for_status()
+      logger.debug(f"Job '{job.id}' delivered to webhook")
+    except Exception as ex:
+      logger.warning(f"Failed to deliver job '{job.id}' to webhook '{job.webhook_url}': {ex}")
+
   async def _before_request(self):
-    if request.headers.get('secret') != self.secret:
+    if not (tenant := self.tenants.get(request.headers.get('secret'))):
       logging.error("Forbidden")
       return self._error("Who are you?", 403, "Forbidden")
+    g.tenant = tenant
 
   async def _after_request(self, res: Response):
     res.headers.update({"Access-Control-Allow-Origin": "*"})
@@ -218,6 +667,14 @@ class TurnstileSolverServer:
     </body>
     </html>"""
 
+  def _busy(self, retry_after: float, message: str = "Server busy") -> tuple[dict[str, str], int]:
+    retryAfter = max(1, math.ceil(retry_after))
+    return self._json("error", f"{message}, retry after {retryAfter} seconds", 429, {"retry_after": retryAfter})
+
+  def _busy_response(self, retry_after: float, message: str = "Server busy") -> tuple[dict[str, str], int, dict[str, str]]:
+    response, statusCode = self._busy(retry_after, message)
+    return response, statusCode, {"Retry-After": str(response["retry_after"])}
+
   def _bad(self, message: str, log: bool = False, warning: bool = False) -> tuple[dict[str, str], int]:
     return self._error(message, 400, log=log, warning=warning)
 
@@ -75,3 +75,21 @@ def load_proxy_param(param) -> str | None:
     else:
       logger.warning("Proxy parameter intended to be loaded from environment variables was not found")
   return param
+
+
+def available_memory() -> float | None:
+  """Fraction of memory still available, within the cgroup memory limit if any. None where it can't be read (non-Linux)"""
+  try:
+    with open("/sys/fs/cgroup/memory.max") as f:
+      limit = f.read().strip()
+    if limit != "max":
+      with open("/sys/fs/cgroup/memory.current") as f:
+        return 1 - int(f.read()) / int(limit)
+  except (OSError, ValueError):
+    pass
+  try:
+    with open("/proc/meminfo") as f:
+      info = {name: int(value.split()[0]) for name, value in (line.split(":", 1) for line in f)}
+    return info["MemAvailable"] / info["MemTotal"]
+  except (OSError, KeyError, ValueError):
+    return None
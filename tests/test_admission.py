@@ -0,0 +1,23 @@
+from turnstile_solver.admission import AdmissionController
+
+
+def test_admits_until_queue_is_full():
+  admission = AdmissionController(capacity=lambda: 2, max_queue=1)
+  assert [admission.admit() for _ in range(3)] == [None, None, None]
+  assert admission.queued == 1
+  assert admission.admit() == 0.5
+  assert admission.rejected == 1
+  admission.release()
+  assert admission.admit() is None
+
+
+def test_rejects_requests_that_would_exceed_their_budget():
+  admission = AdmissionController(capacity=lambda: 2, max_queue=100, default_budget=30)
+  admission.record_service_time(10)
+  for _ in range(4):
+    assert admission.admit() is None
+  # 3 requests ahead of a pool serving 2 at a time: 15s wait + 10s solve
+  assert admission.estimated_wait() == 15
+  assert admission.admit(budget=20) == 5
+  assert admission.admit() is None
+  assert admission.check(budget=30, n=10) is not None
@@ -0,0 +1,103 @@
+import asyncio
+
+from turnstile_solver.api_js_cache import ApiJsCache, _max_age
+from turnstile_solver.constants import TURNSTILE_API_JS_URL
+
+
+class _Response:
+  def __init__(self, status: int = 200, headers: dict[str, str] | None = None, body: bytes = b"api.js"):
+    self.status = status
+    self.headers = {"cache-control": "max-age=300, public", "etag": '"v1"', "content-encoding": "br"} if headers is None else headers
+    self._body = body
+
+  async def body(self) -> bytes:
+    return self._body
+
+
+class _Request:
+  def __init__(self, responses: list[_Response]):
+    self.url = TURNSTILE_API_JS_URL + "?onload=__onTurnstileLoad"
+    self.method = "GET"
+    # Shared by the routes of a test, also used by the context request API for revalidations
+    self.responses = responses
+    self.sent_headers: list[dict] = []
+
+  async def get(self, url: str, headers: dict) -> _Response:
+    self.sent_headers.append(headers)
+    return self.responses.pop(0)
+
+
+class _Route:
+  def __init__(self, request: _Request):
+    self.request = request
+    self.fulfilled: dict | None = None
+    self.continued = False
+
+  async def fetch(self) -> _Response:
+    await asyncio.sleep(0.01)
+    return self.request.responses.pop(0)
+
+  async def fulfill(self, **kwargs):
+    self.fulfilled = kwargs
+
+  async def continue_(self):
+    self.continued = True
+
+
+class _Context:
+  def __init__(self, request: _Request):
+    self.request = request
+
+
+def test_max_age():
+  assert _max_age({"cache-control": "public, max-age=300"}) == 300
+  assert _max_age({"cache-control": "max-age=300, s-maxage=60"}) == 60
+  assert _max_age({"cache-control": "no-cache"}) == 0
+  assert _max_age({"cache-control": "no-store, max-age=300"}) is None
+  assert _max_age({}) == 0
+
+
+async def test_concurrent_misses_fetch_once_then_hit():
+  cache = ApiJsCache()
+  request = _Request([_Response()])
+  context = _Context(request)
+  routes = [_Route(request) for _ in range(3)]
+  await asyncio.gather(*[cache._handle(route, context) for route in routes])
+  assert (cache.misses, cache.hits) == (3, 0)
+  assert all(route.fulfilled["body"] == b"api.js" for route in routes)
+  # Body was decoded by the fetch
+  assert "content-encoding" not in routes[0].fulfilled["headers"]
+
+  await cache._handle(route := _Route(request), context)
+  assert cache.hits == 1
+  assert route.fulfilled["body"] == b"api.js"
+
+
+async def test_stale_entry_is_served_while_revalidated():
+  cache = ApiJsCache()
+  request = _Request([_Response(), _Response(304, {"cache-control": "max-age=600"})])
+  context = _Context(request)
+  await cache._handle(_Route(request), context)
+  entry = next(iter(cache._entries.values()))
+  entry.fetched_at -= 301
+
+  await cache._handle(route := _Route(request), context)
+  assert cache.stale_hits == 1
+  assert route.fulfilled["body"] == b"api.js"
+  await asyncio.gather(*cache._tasks)
+  assert request.sent_headers == [{"If-None-Match": '"v1"'}]
+  assert cache.revalidations == 1
+  assert entry.max_age == 600 and entry.age < 1
+
+
+async def test_uncacheable_responses_are_not_stored():
+  cache = ApiJsCache()
+  request = _Request([_Response(headers={"cache-control": "no-store"}), _Response(503, {})])
+  context = _Context(request)
+  await cache._handle(route := _Route(request), context)
+  assert route.fulfilled["body"] == b"api.js"
+  assert not cache._entries
+  await cache._handle(route := _Route(request), context)
+  # Error responses go to the page as they are
+  assert route.fulfilled["response"].status == 503
+  assert cache.misses == 2
@@ -0,0 +1,286 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from turnstile_solver.browser_context_pool import BrowserContextPool
+from turnstile_solver.browser_endpoint import BrowserEndpoint
+from turnstile_solver.page_pool import PagePool
+from turnstile_solver.profile_store import ProfileStore
+from turnstile_solver.recycle_policy import RecyclePolicy
+
+
+@pytest.fixture
+def pool() -> BrowserContextPool:
+  pool = BrowserContextPool(
+    solver=None,
+    max_contexts=3,
+    max_pages_per_context=2,
+    min_idle=0,
+    max_idle=0,
+  )
+  # No browser needed, contexts are never touched
+  pool._browser = object()
+  pool._item_getter = lambda: PagePool(context=None, max_pages=2)
+  return pool
+
+
+async def test_least_loaded_placement(pool: BrowserContextPool):
+  a, b, c = [await pool.prefill() for _ in range(3)]
+  placed = [await pool.get() for _ in range(3)]
+  assert set(placed) == {a, b, c}
+  await pool.put_back(b)
+  assert await pool.get() is b
+  assert [p.placements for p in (a, b, c)] == [1, 2, 1]
+
+
+async def test_tie_goes_to_best_latency(pool: BrowserContextPool):
+  a, b = await pool.prefill(), await pool.prefill()
+  a.record_solve(5)
+  b.record_solve(1)
+  b.record_solve(None)
+  assert await pool.get() is b
+  assert await pool.get() is a
+  assert pool.stats()[1] | {"id": None} == {
+    "id": None,
+    "active_pages": 0,
+    "pages": 0,
+    "active_widgets": 0,
+    "placements": 1,
+    "solves": 1,
+    "failures": 1,
+    "latency": 1,
+  }
+
+
+async def test_page_retired_after_consecutive_failures():
+  pagePool = PagePool(context=None, max_pages=2, recycle_policy=RecyclePolicy(max_consecutive_failures=2))
+  pagePool._item_getter = pagePool._replacement_getter = object
+  page = await pagePool.get()
+  pagePool.record_solve(None, page)
+  assert page in pagePool.items
+  pagePool.record_solve(None, page)
+  assert page not in pagePool.items
+  assert pagePool.consecutive_failures == 2
+
+
+class _Page:
+  def __init__(self):
+    self.url = "about:blank"
+
+  async def goto(self, url: str):
+    self.url = url
+
+  async def close(self):
+    pass
+
+
+async def test_page_parked_on_site_is_preferred():
+  pagePool = PagePool(context=None, max_pages=3)
+  pagePool._item_getter = _Page
+  a, b = await pagePool.get(key="https://a.com/"), await pagePool.get(key="https://b.com/")
+  await pagePool.put_back(a)
+  await pagePool.put_back(b)
+  assert pagePool.parked("https://b.com/") and not pagePool.parked("https://c.com/")
+  assert await pagePool.get(key="https://b.com/") is b
+  # No page on the site: the one parked for the longest goes first
+  assert await pagePool.get(key="https://c.com/") is a
+
+
+async def test_context_with_parked_page_is_preferred(pool: BrowserContextPool):
+  a, b = await pool.prefill(), await pool.prefill()
+  b._item_getter = _Page
+  page = await b.get(key="https://b.com/")
+  await b.put_back(page)
+  assert await pool.get(key="https://b.com/") is b
+  assert await b.get(key="https://b.com/") is page
+  # Least loaded once the parked page is taken
+  assert await pool.get(key="https://b.com/") is a
+
+
+async def test_solve_placed_on_context_able_to_serve_its_site():
+  pool = BrowserContextPool(solver=None, max_contexts=2, max_pages_per_context=2, widgets_per_page=2, min_idle=0, max_idle=0)
+  pool._browser = object()
+
+  def pagePoolGetter():
+    pagePool = PagePool(context=None, max_pages=2, widgets_per_page=2)
+    pagePool._item_getter = _Page
+    return pagePool
+
+  pool._item_getter = pagePoolGetter
+  a, b = await pool.prefill(), await pool.prefill()
+
+  async def solve(site: str) -> tuple[PagePool, _Page]:
+    pagePool = await pool.get(timeout=0.1, key=site)
+    return pagePool, await pagePool.get(timeout=0.1, key=site)
+
+  # a: pages on A and C. b: two widgets on a page on B, and a free page slot
+  assert [(await solve(site))[0] for site in ("A", "B", "C", "B")] == [a, b, a, b]
+  # Both equally loaded, only b can open a page for E
+  assert (await solve("E"))[0] is b
+  # None of them can serve F until a page is back
+  placed = asyncio.create_task(solve("F"))
+  await asyncio.sleep(0.01)
+  assert not placed.done()
+  page = next(page for page in a.in_use if a._keys[page] == "C")
+  await a.put_back(page)
+  await pool.put_back(a)
+  assert await placed == (a, page)
+
+
+async def test_unpark_idle_pages():
+  pagePool = PagePool(context=None, max_pages=2)
+  pagePool._item_getter = _Page
+  parked, leased = await pagePool.get(key="https://a.com/"), await pagePool.get(key="https://a.com/")
+  parked.url = leased.url = "https://a.com/"
+  await pagePool.put_back(parked)
+  assert await pagePool.unpark(idle_for=60) == 0
+  assert await pagePool.unpark() == 1
+  assert (parked.url, leased.url) == ("about:blank", "https://a.com/")
+  assert pagePool.leases(parked) == 0 and not pagePool.parked("https://a.com/")
+
+
+async def test_lost_page_is_retired_and_its_solve_notified():
+  pagePool = PagePool(context=None, max_pages=2)
+  pagePool._item_getter = pagePool._replacement_getter = _Page
+  page = await pagePool.get()
+  lost = pagePool.lost(page)
+  pagePool.lose("Page crashed", page)
+  assert lost.result() == "Page crashed"
+  assert page not in pagePool.items
+  await pagePool.put_back(page)
+  await asyncio.sleep(0)
+  # Close events of pages the pool closed itself are ignored
+  pagePool.lose("Page closed", page)
+  assert page not in pagePool._lost
+
+
+class _Browser:
+  def __init__(self):
+    self.connected = True
+    self.handlers = []
+
+  def is_connected(self) -> bool:
+    return self.connected
+
+  def on(self, event: str, handler):
+    self.handlers.append(handler)
+
+  def crash(self):
+    self.connected = False
+    for handler in self.handlers:
+      handler(self)
+
+
+async def test_crashed_browser_fails_over_to_standby():
+  browsers = []
+
+  async def getBrowser(playwright):
+    browsers.append(browser := _Browser())
+    return browser, playwright
+
+  pool = BrowserContextPool(solver=SimpleNamespace(get_browser=getBrowser), max_contexts=2, min_idle=0, max_idle=0)
+  await pool.init()
+  await asyncio.sleep(0)
+  primary, standby = browsers
+  pagePool = PagePool(context=SimpleNamespace(browser=primary), max_pages=2)
+  pool._item_getter = pool._replacement_getter = lambda: PagePool(context=SimpleNamespace(browser=pool.browser), max_pages=2)
+  pagePool._item_getter = _Page
+  pool._leases[pagePool] = 1
+  lost = pagePool.lost(await pagePool.get())
+
+  primary.crash()
+  assert lost.result() == "Browser disconnected"
+  assert pagePool not in pool.items
+  await asyncio.sleep(0.01)
+  assert pool.browser is standby
+  # A new standby is launched in place of the one taken
+  assert len(browsers) == 3
+  await pool.close()
+
+
+class _Context:
+  def __init__(self, browser: _Browser):
+    self.browser = browser
+
+  def on(self, event: str, handler):
+    pass
+
+  async def close(self):
+    pass
+
+
+def _remote_pool(*endpoints: BrowserEndpoint, unreachable: tuple[str, ...] = ()) -> BrowserContextPool:
+  async def connect(url: str) -> _Browser:
+    if url in unreachable:
+      raise ConnectionRefusedError(url)
+    return _Browser()
+
+  async def getBrowserContext(browser, playwright, proxy):
+    return _Context(browser), playwright
+
+  pool = BrowserContextPool(solver=SimpleNamespace(get_browser_context=getBrowserContext), max_contexts=10, min_idle=0, max_idle=0, remote_browsers=list(endpoints))
+  pool._playwright = SimpleNamespace(chromium=SimpleNamespace(connect=connect, connect_over_cdp=connect))
+  # Replacements without pages, the fake contexts can't create them
+  pool._replacement_getter = pool._page_pool_getter
+  return pool
+
+
+async def test_contexts_spread_over_remote_browsers_by_capacity():
+  small, large = BrowserEndpoint("ws://a:3000/", max_contexts=1), BrowserEndpoint("http://b:9222", max_contexts=3)
+  pool = _remote_pool(small, large)
+  await pool.init()
+  # Capped by the endpoints
+  assert pool.size == 4
+  pools = [await pool.prefill() for _ in range(4)]
+  assert [pool._endpoints[p] for p in pools] == [small, large, large, large]
+  assert await pool.prefill() is None
+
+  pool.remove(pools[0])
+  await pool._close_page_pool(pools[0])
+  assert small.contexts == 0
+  await pool.close()
+
+
+async def test_unreachable_remote_browser_backs_off():
+  down, up = BrowserEndpoint("ws://down:3000/"), BrowserEndpoint("ws://up:3000/")
+  pool = _remote_pool(down, up, unreachable=(down.url,))
+  await pool.init()
+  assert (down.failures, up.failures) == (1, 0)
+  assert not down.available
+  assert pool._endpoints[await pool.prefill()] is up
+  assert down.contexts == 0
+
+  # Contexts of a remote browser that goes away are lost and replaced once connected again
+  pagePool, browser = next(iter(pool._endpoints)), up.browser
+  browser.crash()
+  assert pagePool not in pool.items
+  await asyncio.sleep(0.01)
+  assert list(pool._endpoints) == pool.items != [pagePool]
+  assert up.contexts == 1
+  assert up.connected and up.browser is not browser
+  await pool.close()
+
+
+async def test_contexts_on_persistent_profiles(tmp_path):
+  launched = []
+
+  async def getPersistentContext(user_data_dir, playwright, proxy):
+    launched.append(user_data_dir)
+    return _Context(_Browser()), playwright
+
+  pool = BrowserContextPool(solver=SimpleNamespace(get_persistent_context=getPersistentContext), max_contexts=2, min_idle=0, max_idle=0, profile_store=ProfileStore(tmp_path))
+  pool._playwright = object()
+  pool._replacement_getter = pool._page_pool_getter
+  await pool.init()
+  a, b = [await pool.prefill() for _ in range(2)]
+  assert launched[0] != launched[1]
+  assert pool.profile_store.in_use == launched
+
+  pool.remove(a)
+  await pool._close_page_pool(a)
+  assert pool.profile_store.in_use == [launched[1]]
+  # Its profile goes to the next context
+  await pool.prefill()
+  assert launched[2] == launched[0]
+  await pool.close()
@@ -0,0 +1,32 @@
+import pytest
+
+from turnstile_solver.captcha_event_dispatcher import CaptchaEventDispatcher
+from turnstile_solver.enums import CaptchaApiMessageEvent
+
+
+async def test_dispatch():
+  dispatcher = CaptchaEventDispatcher()
+  received = []
+
+  async def handler(evt: CaptchaApiMessageEvent, data: dict):
+    received.append((evt, data))
+
+  dispatcher.subscribe("id", handler)
+  await dispatcher.dispatch("id", {"event": "complete", "token": "T"})
+  assert received == [(CaptchaApiMessageEvent.COMPLETE, {"token": "T"})]
+
+  dispatcher.unsubscribe("id")
+  with pytest.raises(LookupError):
+    await dispatcher.dispatch("id", {"event": "complete"})
+
+
+@pytest.mark.parametrize("id, data", [
+  ("id", {}),
+  ("id", {"event": "unknown"}),
+  (None, {"event": "init"}),
+])
+async def test_dispatch_malformed(id: str | None, data: dict):
+  dispatcher = CaptchaEventDispatcher()
+  dispatcher.subscribe("id", lambda evt, data: None)
+  with pytest.raises(ValueError):
+    await dispatcher.dispatch(id, data)
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import socket
+
+from turnstile_solver import dispatcher as d
+from turnstile_solver.dispatcher import Dispatcher, merge_metrics
+
+
+async def _worker_server(name: str, received: list):
+  """HTTP server answering every request with its worker name"""
+
+  async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    head = (await reader.readuntil(b"\r\n\r\n")).decode().split("\r\n")
+    method, target, _ = head[0].split(" ")
+    headers = {k.lower(): v for k, v in (line.split(": ", 1) for line in head[1:] if line)}
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    received.append((method, target, headers, body))
+    payload = json.dumps({"worker": name}).encode()
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s" % (len(payload), payload))
+    await writer.drain()
+    writer.close()
+
+  server = await asyncio.start_server(handle, d.WORKER_HOST, 0)
+  return server, server.sockets[0].getsockname()[1]
+
+
+def _free_port() -> int:
+  with socket.socket() as s:
+    s.bind((d.WORKER_HOST, 0))
+    return s.getsockname()[1]
+
+
+async def _dispatcher(*ports: int) -> Dispatcher:
+  dispatcher = Dispatcher(start_worker=None, workers=len(ports))
+  for worker, port in zip(dispatcher.workers, ports):
+    worker.port = port
+    worker.ready = True
+  return dispatcher
+
+
+class _Process:
+  _pids = iter(range(1000, 2000))
+
+  def __init__(self):
+    self.pid = next(self._pids)
+    self.exitcode = None
+
+  def is_alive(self) -> bool:
+    return self.exitcode is None
+
+
+def test_merge_metrics():
+  text = "# HELP a_total A\n# TYPE a_total counter\na_total{x=\"1\"} 2\n# HELP b B\n# TYPE b gauge\nb 3\n"
+  assert merge_metrics({0: text, 1: text}) == "\n".join([
+    "# HELP a_total A",
+    "# TYPE a_total counter",
+    'a_total{worker="0",x="1"} 2',
+    'a_total{worker="1",x="1"} 2',
+    "# HELP b B",
+    "# TYPE b gauge",
+    'b{worker="0"} 3',
+    'b{worker="1"} 3',
+  ]) + "\n"
+
+
+async def test_requests_go_to_the_least_loaded_worker():
+  received = []
+  server0, port0 = await _worker_server("0", received)
+  server1, port1 = await _worker_server("1", received)
+  dispatcher = await _dispatcher(port0, port1)
+  dispatcher.workers[0].in_flight = 1
+  client = dispatcher.app.test_client()
+
+  response = await client.get("/solve", query_string={"site_url": "https://example.com"}, headers={"secret": "s3cr3t"})
+  assert await response.get_json() == {"worker": "1"}
+  method, target, headers, _ = received[-1]
+  assert (method, target, headers["secret"]) == ("GET", "/solve?site_url=https%3A%2F%2Fexample.com", "s3cr3t")
+  assert dispatcher.workers[1].in_flight == 0
+
+  response = await client.post("/jobs", json={"site_url": "https://example.com", "site_key": "KEY"})
+  assert await response.get_json() == {"worker": "1"}
+  assert json.loads(received[-1][3]) == {"site_url": "https://example.com", "site_key": "KEY"}
+  server0.close()
+  server1.close()
+
+
+async def test_jobs_are_looked_up_on_their_worker():
+  received = []
+  server, port = await _worker_server("0", received)
+  dispatcher = await _dispatcher(port, _free_port())
+  dispatcher.workers[0].in_flight = 5
+  client = dispatcher.app.test_client()
+
+  response = await client.get("/jobs/0-abc")
+  assert await response.get_json() == {"worker": "0"}
+  # Not routed anywhere else while its worker is down
+  dispatcher.workers[1].ready = False
+  response = await client.get("/jobs/1-abc")
+  assert response.status_code == 503
+  server.close()
+
+
+async def test_unreachable_worker_is_skipped():
+  received = []
+  server, port = await _worker_server("1", received)
+  dispatcher = await _dispatcher(_free_port(), port)
+  dispatcher.workers[1].in_flight = 1
+  client = dispatcher.app.test_client()
+
+  response = await client.get("/solve")
+  assert await response.get_json() == {"worker": "1"}
+  assert not dispatcher.workers[0].ready
+  assert dispatcher.workers[0].in_flight == 0
+  server.close()
+
+  dispatcher.workers[1].ready = False
+  assert (await client.get("/solve")).status_code == 503
+
+
+async def test_cancelled_request_is_closed_on_its_worker():
+  closed = asyncio.Event()
+
+  async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    # Never answers, until the dispatcher closes the connection
+    await reader.read()
+    closed.set()
+    writer.close()
+
+  server = await asyncio.start_server(handle, d.WORKER_HOST, 0)
+  dispatcher = await _dispatcher(server.sockets[0].getsockname()[1])
+
+  async with dispatcher.app.test_request_context("/solve"):
+    request = asyncio.create_task(dispatcher._proxy("solve"))
+  while not dispatcher.workers[0].in_flight:
+    await asyncio.sleep(0.01)
+  request.cancel()
+  await asyncio.wait_for(closed.wait(), 1)
+  assert dispatcher.workers[0].in_flight == 0
+  server.close()
+
+
+async def test_dead_workers_are_restarted(monkeypatch):
+  monkeypatch.setattr(d, "WORKER_CHECK_INTERVAL", 0.01)
+  monkeypatch.setattr(d, "WORKER_RESTART_DELAY", 0.05)
+  started: list[tuple[int, _Process]] = []
+
+  def startWorker(index: int, port: int) -> _Process:
+    started.append((index, process := _Process()))
+    return process
+
+  dispatcher = Dispatcher(start_worker=startWorker, workers=2, port=_free_port())
+  supervisor = asyncio.create_task(dispatcher._supervise())
+  await asyncio.sleep(0.05)
+  assert [index for index, _ in started] == [0, 1]
+
+  started[0][1].exitcode = -9
+  await asyncio.sleep(0.02)
+  # Died right after starting, it waits before being restarted
+  assert len(started) == 2
+  await asyncio.sleep(0.1)
+  assert [index for index, _ in started] == [0, 1, 0]
+  assert dispatcher.workers[0].restarts == 1
+  assert dispatcher.workers[0].process is started[2][1]
+  supervisor.cancel()
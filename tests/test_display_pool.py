@@ -0,0 +1,93 @@
+import asyncio
+import sys
+
+import pytest
+
+from turnstile_solver import display_pool as dp
+from turnstile_solver.display_pool import DisplayPool
+
+pytestmark = pytest.mark.skipif(sys.platform != "linux", reason="Virtual displays are Linux only")
+
+# Stands in for Xvfb: listens on the abstract X socket of a random display and reports it on -displayfd
+FAKE_XVFB = '''#!{python}
+import os, random, socket, sys, time
+fd = int(sys.argv[sys.argv.index("-displayfd") + 1])
+s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+while True:
+  number = random.randint(1000, 30000)
+  try:
+    s.bind("\\0/tmp/.X11-unix/X%d" % number)
+    break
+  except OSError:
+    pass
+s.listen()
+os.write(fd, b"%d\\n" % number)
+os.close(fd)
+time.sleep(3600)
+'''
+
+
+@pytest.fixture
+def xvfb(tmp_path) -> str:
+  path = tmp_path / "Xvfb"
+  path.write_text(FAKE_XVFB.format(python=sys.executable))
+  path.chmod(0o755)
+  return str(path)
+
+
+async def test_browsers_are_spread_over_displays(xvfb):
+  pool = DisplayPool(2, xvfb_executable=xvfb)
+  try:
+    a, b, c = [await pool.acquire() for _ in range(3)]
+    assert a is not b and c is a
+    assert a.name != b.name and a.name.startswith(":")
+    assert await pool._healthy(a)
+    pool.release(a)
+    pool.release(a)
+    assert await pool.acquire() is a
+  finally:
+    await pool.close()
+  assert not any(d.running for d in pool.displays)
+
+
+async def test_dead_display_is_restarted(xvfb, monkeypatch):
+  monkeypatch.setattr(dp, "VIRTUAL_DISPLAY_CHECK_INTERVAL", 3600)
+  pool = DisplayPool(2, xvfb_executable=xvfb)
+  try:
+    await pool.start()
+    dead, alive = pool.displays
+    dead.process.kill()
+    await dead.process.wait()
+    # Skipped until restarted
+    assert await pool.acquire() is alive
+    assert not await pool._healthy(dead)
+
+    await pool._restart(dead)
+    assert dead.running and dead.restarts == 1
+    assert await pool._healthy(dead)
+    assert await pool.acquire() is dead
+  finally:
+    await pool.close()
+
+
+async def test_monitor_restarts_displays(xvfb, monkeypatch):
+  monkeypatch.setattr(dp, "VIRTUAL_DISPLAY_CHECK_INTERVAL", 0.01)
+  pool = DisplayPool(1, xvfb_executable=xvfb)
+  try:
+    await pool.start()
+    display = pool.displays[0]
+    process = display.process
+    process.kill()
+    for _ in range(200):
+      await asyncio.sleep(0.01)
+      if display.running and display.process is not process:
+        break
+    assert display.restarts == 1 and display.running
+  finally:
+    await pool.close()
+
+
+async def test_missing_xvfb(tmp_path):
+  pool = DisplayPool(1, xvfb_executable=str(tmp_path / "missing"))
+  with pytest.raises(RuntimeError):
+    await pool.acquire()
@@ -0,0 +1,25 @@
+from turnstile_solver.enums import JobStatus
+from turnstile_solver.job_table import Job, JobTable
+
+
+def test_finished_jobs_evicted_when_full():
+  table = JobTable(max_jobs=2)
+  a, b, c = [Job("https://example.com/", "key") for _ in range(3)]
+  assert table.add(a) and table.add(b)
+  assert not table.add(c)
+  a.finish(token="T", elapsed=1)
+  assert a.status == JobStatus.DONE
+  assert table.add(c)
+  assert table.get(a.id) is None
+  assert table.get(c.id) is c
+
+
+def test_expired_jobs_evicted():
+  table = JobTable(ttl=0)
+  job = Job("https://example.com/", "key")
+  table.add(job)
+  assert table.get(job.id) is job
+  job.finish(error="error")
+  assert job.status == JobStatus.FAILED
+  assert table.get(job.id) is None
+  assert len(table) == 0
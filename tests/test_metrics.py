@@ -0,0 +1,36 @@
+from turnstile_solver.metrics import BoundedLabel, Registry
+
+
+def test_histogram_render():
+  registry = Registry()
+  histogram = registry.histogram("solve_seconds", "Solve time", labels=("phase",), buckets=(1, 5))
+  for value in (0.5, 1, 3, 10):
+    histogram.observe(value, "init")
+  assert histogram.count("init") == 4
+  assert registry.render().splitlines() == [
+    "# HELP solve_seconds Solve time",
+    "# TYPE solve_seconds histogram",
+    'solve_seconds_bucket{phase="init",le="1"} 2',
+    'solve_seconds_bucket{phase="init",le="5"} 3',
+    'solve_seconds_bucket{phase="init",le="+Inf"} 4',
+    'solve_seconds_sum{phase="init"} 14.5',
+    'solve_seconds_count{phase="init"} 4',
+  ]
+
+
+def test_counter_and_gauge_render():
+  registry = Registry()
+  counter = registry.counter("events_total", "Events", labels=("event",))
+  counter.inc('say "hi"')
+  counter.inc('say "hi"', amount=2)
+  registry.gauge("waiting", "Waiting", lambda: None)
+  registry.gauge("contexts", "Contexts", lambda: {("idle",): 2}, labels=("state",))
+  lines = registry.render().splitlines()
+  assert 'events_total{event="say \\"hi\\""} 3' in lines
+  assert not [line for line in lines if line.startswith("waiting ")]
+  assert 'contexts{state="idle"} 2' in lines
+
+
+def test_bounded_label():
+  label = BoundedLabel(2)
+  assert [label(v) for v in ("a", "b", "c", "a", "d", "b")] == ["a", "b", "other", "a", "other", "b"]
@@ -0,0 +1,71 @@
+import json
+import re
+import shutil
+import subprocess
+
+import pytest
+
+from turnstile_solver import constants as c
+from turnstile_solver.solver import TurnstileSolver
+from turnstile_solver.turnstile_result import TurnstileResult
+
+NODE = shutil.which("node")
+
+# Runs the solver page script with a stub window, posts the given messages to it within one tick and prints what it forwarded
+_HARNESS = '''
+globalThis.window = globalThis;
+const listeners = [];
+window.addEventListener = (type, listener) => type === "message" && listeners.push(listener);
+const forwarded = [];
+window.{binding_name} = async (id, data) => forwarded.push([id, data]);
+{script}
+for (const [origin, data] of {messages}) listeners.forEach(listener => listener({{origin, data}}));
+setTimeout(() => console.log(JSON.stringify({{forwarded, stats: {event_stats_js}}})), 10);
+'''
+
+
+def _run_page_script(solver: TurnstileSolver, id: str, messages: list[tuple[str, dict]]) -> dict:
+  script = re.search(r"<script>(.*?)</script>", solver._page_content("KEY", id), re.S).group(1)
+  harness = _HARNESS.format(binding_name=c.CAPTCHA_EVENT_BINDING_NAME, script=script, messages=json.dumps(messages), event_stats_js=c.CAPTCHA_EVENT_STATS_JS)
+  return json.loads(subprocess.run([NODE, "-e", harness], capture_output=True, text=True, check=True, timeout=10).stdout)
+
+
+@pytest.mark.skipif(not NODE, reason="Needs Node.js to run the page script")
+def test_events_are_filtered_and_coalesced_in_page():
+  solver = TurnstileSolver(server=None, browser_position=None)
+  origin = "https://challenges.cloudflare.com"
+  output = _run_page_script(solver, "SOLVE", [
+    (origin, {"event": "init", "widgetId": "a", "n": 1}),
+    # Not in the allowlist
+    (origin, {"event": "food", "widgetId": "a"}),
+    (origin, {"event": "init", "widgetId": "a", "n": 2}),
+    (origin, {"event": "complete", "widgetId": "a", "token": "TOKEN"}),
+    (origin, {"event": "init", "widgetId": "b", "n": 3}),
+    # Not from Turnstile, not even counted
+    ("https://example.com", {"event": "init", "widgetId": "a"}),
+  ])
+  assert output["forwarded"] == [
+    # Latest of the redundant events wins, in the order they were first received
+    ["SOLVE", {"event": "init", "widgetId": "a", "n": 2}],
+    ["SOLVE", {"event": "complete", "widgetId": "a", "token": "TOKEN"}],
+    ["SOLVE", {"event": "init", "widgetId": "b", "n": 3}],
+  ]
+  assert output["stats"] == {"received": 5, "forwarded": 3}
+
+
+@pytest.mark.skipif(not NODE, reason="Needs Node.js to run the page script")
+def test_every_event_forwarded_without_allowlist():
+  solver = TurnstileSolver(server=None, browser_position=None, extra_forwarded_events=None)
+  output = _run_page_script(solver, "SOLVE", [("https://challenges.cloudflare.com", {"event": "food", "widgetId": "a"})])
+  assert output["forwarded"] == [["SOLVE", {"event": "food", "widgetId": "a"}]]
+
+
+async def test_event_stats_are_read_from_the_page_script_world():
+  class Page:
+    async def evaluate(self, script: str, arg=None, isolated_context: bool = True):
+      # Page script globals don't exist in the isolated world
+      return None if isolated_context else {"received": 5, "forwarded": 3}
+
+  result = TurnstileResult(page=Page())
+  await TurnstileSolver._collect_event_stats(result)
+  assert result.event_stats == {"received": 5, "forwarded": 3}
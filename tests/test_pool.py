@@ -0,0 +1,209 @@
+import asyncio
+
+import pytest
+
+from turnstile_solver.pool import Pool
+
+
+class _Item:
+  _count = 0
+
+  def __init__(self):
+    _Item._count += 1
+    self.n = _Item._count
+
+  def __repr__(self) -> str:
+    return f"Item({self.n})"
+
+
+@pytest.fixture
+def pool() -> Pool:
+  return Pool(size=2, item_getter=_Item)
+
+
+async def test_reuse(pool: Pool):
+  a = await pool.get()
+  await pool.put_back(a)
+  assert await pool.get() is a
+  assert len(pool.items) == 1
+
+
+async def test_fifo_waiters(pool: Pool):
+  a = await pool.get()
+  await pool.get()
+  order = []
+
+  async def waiter(n: int):
+    item = await pool.get()
+    order.append(n)
+    return item
+
+  tasks = [asyncio.create_task(waiter(n)) for n in range(3)]
+  await asyncio.sleep(0)
+  assert pool.waiting == 3
+  await pool.put_back(a)
+  assert await tasks[0] is a
+  await pool.put_back(a)
+  await pool.put_back(a)
+  await asyncio.gather(*tasks[1:])
+  assert order == [0, 1, 2]
+
+
+async def test_timeout_leaves_no_waiter(pool: Pool):
+  await pool.get()
+  await pool.get()
+  with pytest.raises(TimeoutError):
+    await pool.get(timeout=0.01)
+  assert pool.waiting == 0
+
+
+async def test_cancelled_waiter_does_not_leak_item(pool: Pool):
+  a = await pool.get()
+  await pool.get()
+  task = asyncio.create_task(pool.get())
+  await asyncio.sleep(0)
+  # Item is granted to the waiter, which is cancelled before it resumes
+  await pool.put_back(a)
+  task.cancel()
+  with pytest.raises(asyncio.CancelledError):
+    await task
+  assert await pool.get(timeout=0.01) is a
+
+
+async def test_lease_puts_back_on_error(pool: Pool):
+  with pytest.raises(ValueError):
+    async with pool.lease() as item:
+      raise ValueError
+  assert pool.leases(item) == 0
+  assert not pool.in_use
+
+
+async def test_item_capacity():
+  pool = Pool(size=2, item_getter=_Item, item_capacity=2)
+  a, b, c = [await pool.get() for _ in range(3)]
+  assert a is b and c is not a
+  assert pool.leases(a) == 2
+
+
+async def test_failed_creation_frees_slot():
+  calls = 0
+
+  async def getter():
+    nonlocal calls
+    calls += 1
+    if calls == 1:
+      raise RuntimeError
+    return _Item()
+
+  pool = Pool(size=1, item_getter=getter)
+  with pytest.raises(RuntimeError):
+    await pool.get()
+  assert await pool.get(timeout=0.01)
+
+
+async def test_put_back_unknown_item(pool: Pool):
+  with pytest.raises(RuntimeError):
+    await pool.put_back(_Item())
+
+
+async def test_prefill_and_remove(pool: Pool):
+  a = await pool.prefill()
+  b = await pool.prefill()
+  assert await pool.prefill() is None
+  assert pool.idle == [a, b]
+  assert await pool.get() is a
+  assert pool.idle == [b]
+  pool.remove(b)
+  with pytest.raises(RuntimeError):
+    pool.remove(a)
+  assert len(pool.items) == 1
+  assert await pool.get(timeout=0.01) not in (a, b)
+
+
+async def test_remove_frees_slot():
+  pool = Pool(size=1, item_getter=_Item)
+  a = await pool.prefill()
+  await pool.get()
+  task = asyncio.create_task(pool.get())
+  await asyncio.sleep(0)
+  await pool.put_back(a)
+  assert await task is a
+  await pool.put_back(a)
+  assert pool.idle_time(a) >= 0
+  pool.remove(a)
+  assert await pool.get(timeout=0.01) is not a
+
+
+class _ClosingPool(Pool):
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.closed = []
+
+  async def _close_item(self, item):
+    self.closed.append(item)
+
+
+async def test_retire_leased_item_is_replaced_and_closed_on_put_back():
+  pool = _ClosingPool(size=1, item_getter=_Item)
+  a = await pool.get()
+  pool.retire(a, "test")
+  await asyncio.sleep(0)
+  # Replacement built while `a` is still leased
+  assert len(pool.idle) == 1 and a not in pool.items
+  assert not pool.closed
+  await pool.put_back(a)
+  await asyncio.sleep(0)
+  assert pool.closed == [a]
+  assert await pool.get(timeout=0.01) is not a
+
+
+async def test_retire_hands_slot_to_waiter():
+  pool = _ClosingPool(size=1, item_getter=_Item)
+  a = await pool.get()
+  task = asyncio.create_task(pool.get())
+  await asyncio.sleep(0)
+  pool.retire(a)
+  assert await task is not a
+  await pool.put_back(a)
+
+
+async def test_keyed_leases_share_an_item_only_for_the_same_key():
+  pool = Pool(size=2, item_getter=_Item, item_capacity=2)
+  a = await pool.get(key="a")
+  assert await pool.get(key="a") is a
+  b = await pool.get(key="b")
+  assert b is not a
+  await pool.put_back(b)
+  # Idle items take any key
+  assert await pool.get(key="c") is b
+
+
+async def test_keyed_waiter_is_not_starved_by_later_keys():
+  pool = Pool(size=1, item_getter=_Item, item_capacity=2)
+  a = await pool.get(key="a")
+  waiterB = asyncio.create_task(pool.get(key="b"))
+  await asyncio.sleep(0)
+  # The item has room for another "a" lease, but "b" came first
+  waiterA = asyncio.create_task(pool.get(key="a"))
+  await asyncio.sleep(0)
+  assert pool.waiting == 2
+  await pool.put_back(a)
+  assert await waiterB is a
+  await asyncio.sleep(0)
+  assert not waiterA.done()
+  await pool.put_back(a)
+  assert await waiterA is a
+
+
+async def test_timed_out_head_waiter_unblocks_other_keys():
+  pool = Pool(size=1, item_getter=_Item, item_capacity=2)
+  a = await pool.get(key="a")
+  waiterB = asyncio.create_task(pool.get(timeout=0.05, key="b"))
+  await asyncio.sleep(0)
+  # Queued behind "b" even though the item has room for another "a" lease
+  waiterA = asyncio.create_task(pool.get(timeout=1, key="a"))
+  await asyncio.sleep(0)
+  with pytest.raises(TimeoutError):
+    await waiterB
+  assert await waiterA is a
+  assert pool.waiting == 0
@@ -0,0 +1,76 @@
+import os
+import time
+
+from turnstile_solver.profile_store import ProfileStore, dir_size
+
+
+def _write(path, size: int):
+  path.parent.mkdir(parents=True, exist_ok=True)
+  path.write_bytes(b"\0" * size)
+
+
+async def test_most_recently_used_profile_is_reused(tmp_path):
+  store = ProfileStore(tmp_path)
+  a = await store.acquire()
+  b = await store.acquire()
+  assert a != b
+  await store.release(b)
+  await store.release(a)
+  # a was released last, so it's the warmest
+  assert await store.acquire() == a
+  assert await store.acquire() == b
+  assert store.in_use == [a, b]
+
+
+async def test_profile_locked_by_another_store_is_skipped(tmp_path):
+  # Another worker process sharing the profiles dir
+  other = ProfileStore(tmp_path)
+  store = ProfileStore(tmp_path)
+  a = await other.acquire()
+  assert await store.acquire() != a
+  await other.release(a)
+  assert await store.acquire() == a
+
+
+async def test_stale_singleton_files_are_removed(tmp_path):
+  store = ProfileStore(tmp_path)
+  profile = await store.acquire()
+  _write(profile / "SingletonLock", 0)
+  await store.release(profile)
+  assert await store.acquire() == profile
+  assert not (profile / "SingletonLock").exists()
+
+
+async def test_big_profile_is_compacted_on_release(tmp_path):
+  store = ProfileStore(tmp_path, max_size=1000)
+  profile = await store.acquire()
+  _write(profile / "Default" / "Cookies", 100)
+  _write(profile / "Default" / "Cache" / "data", 500)
+  _write(profile / "GrShaderCache" / "data", 500)
+  await store.release(profile)
+  # Just enough caches are dropped
+  assert not (profile / "GrShaderCache").exists()
+  assert (profile / "Default" / "Cache" / "data").exists()
+  assert dir_size(profile) == 600
+
+  profile = await store.acquire()
+  _write(profile / "Default" / "Cookies", 2000)
+  await store.release(profile)
+  # Still too big without caches, reset
+  assert profile.is_dir() and dir_size(profile) == 0
+
+
+async def test_cleanup_deletes_idle_and_extra_profiles(tmp_path):
+  store = ProfileStore(tmp_path, max_profiles=2, max_idle=60)
+  profiles = [await store.acquire() for _ in range(4)]
+  now = time.time()
+  for age, profile in zip([120, 30, 20, 10], profiles):
+    await store.release(profile)
+    os.utime(profile.with_suffix(".lock"), (now - age, now - age))
+  inUse = await store.acquire()
+  assert inUse == profiles[3]
+
+  await store.cleanup()
+  # profiles[0] idle for too long, then profiles[1] over the limit counting the one in use
+  assert [p.exists() for p in profiles] == [False, False, True, True]
+  assert store.in_use == [inUse]
@@ -0,0 +1,13 @@
+from turnstile_solver.recycle_policy import RecyclePolicy
+
+
+def test_retire_reason():
+  policy = RecyclePolicy(max_solves=10, max_age=60, max_consecutive_failures=3)
+  assert policy.retire_reason(solves=9, age=59, consecutive_failures=2) is None
+  assert policy.retire_reason(solves=10, age=0, consecutive_failures=0)
+  assert policy.retire_reason(solves=0, age=60, consecutive_failures=0)
+  assert policy.retire_reason(solves=0, age=0, consecutive_failures=3)
+
+
+def test_disabled_limits():
+  assert RecyclePolicy(max_solves=0, max_age=0, max_consecutive_failures=0).retire_reason(1000, 1000, 1000) is None
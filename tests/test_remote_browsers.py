@@ -0,0 +1,57 @@
+import asyncio
+import json
+import os
+import subprocess
+import tempfile
+
+import pytest
+from patchright._impl._driver import compute_driver_executable, get_driver_env
+
+from turnstile_solver.browser_context_pool import BrowserContextPool
+from turnstile_solver.browser_endpoint import BrowserEndpoint
+from turnstile_solver.solver import TurnstileSolver
+
+# Live test, needs the Patchright chromium browser: TURNSTILE_REMOTE_BROWSERS=1 pytest tests/test_remote_browsers.py
+LIVE = bool(os.environ.get('TURNSTILE_REMOTE_BROWSERS'))
+SERVERS = 2
+CONTEXTS_PER_SERVER = 2
+
+
+async def _browser_server() -> tuple[subprocess.Popen, str]:
+  """Playwright browser server process standing in for a remote host, and its WebSocket URL"""
+  with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as config:
+    json.dump({"headless": True}, config)
+  process = subprocess.Popen([*compute_driver_executable(), "launch-server", "--browser", "chromium", "--config", config.name], stdout=subprocess.PIPE, env=get_driver_env(), text=True)
+  url = await asyncio.to_thread(process.stdout.readline)
+  os.unlink(config.name)
+  return process, url.strip()
+
+
+@pytest.mark.skipif(not LIVE, reason="Set TURNSTILE_REMOTE_BROWSERS=1 to run against local browser servers")
+async def test_contexts_spread_over_browser_servers():
+  servers = [await _browser_server() for _ in range(SERVERS)]
+  endpoints = [BrowserEndpoint(url, max_contexts=CONTEXTS_PER_SERVER) for _, url in servers]
+  pool = BrowserContextPool(
+    solver=TurnstileSolver(server=None, browser_position=None),
+    max_contexts=SERVERS * CONTEXTS_PER_SERVER,
+    max_pages_per_context=1,
+    min_idle=0,
+    remote_browsers=endpoints,
+  )
+  try:
+    await pool.init()
+    pagePools = [await pool.prefill() for _ in range(SERVERS * CONTEXTS_PER_SERVER)]
+    assert [e.contexts for e in endpoints] == [CONTEXTS_PER_SERVER] * SERVERS
+    for pagePool in pagePools:
+      page = await pagePool.get()
+      assert await page.evaluate("1 + 1") == 2
+
+    # A remote host going away takes its contexts with it
+    servers[0][0].kill()
+    await asyncio.sleep(1)
+    assert not endpoints[0].connected
+    assert all(pool._endpoints[p] is endpoints[1] for p in pool.items)
+  finally:
+    await pool.close()
+    for process, _ in servers:
+      process.kill()
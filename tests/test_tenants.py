@@ -0,0 +1,84 @@
+import asyncio
+import time
+
+import pytest
+
+from turnstile_solver.tenants import Tenant, TenantScheduler, TokenBucket
+
+
+async def test_weighted_share_under_contention():
+  holder, heavy, light = Tenant("holder", "h"), Tenant("heavy", "a", weight=2), Tenant("light", "b")
+  scheduler = TenantScheduler([holder, heavy, light], capacity=lambda: 1)
+  await scheduler.acquire(holder)
+  order = []
+
+  async def solve(tenant: Tenant):
+    async with scheduler.slot(tenant):
+      order.append(tenant.name)
+
+  # Heavy client floods the queue first
+  tasks = [asyncio.create_task(solve(t)) for t in [heavy] * 8 + [light] * 4]
+  await asyncio.sleep(0)
+  assert (heavy.queued, light.queued) == (8, 4)
+  scheduler.release(holder)
+  await asyncio.gather(*tasks)
+  assert order[:6].count("heavy") == 4
+  assert order[:6].count("light") == 2
+
+
+async def test_concurrency_cap_lets_others_through():
+  capped, other = Tenant("capped", "a", max_concurrency=1), Tenant("other", "b")
+  scheduler = TenantScheduler([capped, other], capacity=lambda: 3)
+  await scheduler.acquire(capped)
+  task = asyncio.create_task(scheduler.acquire(capped))
+  await asyncio.sleep(0)
+  assert capped.queued == 1
+  await asyncio.wait_for(scheduler.acquire(other), 0.1)
+  scheduler.release(capped)
+  await asyncio.wait_for(task, 0.1)
+  assert (capped.active, other.active) == (1, 1)
+
+
+async def test_cancelled_waiter_frees_its_place():
+  tenant = Tenant("a", "a")
+  scheduler = TenantScheduler([tenant], capacity=lambda: 1)
+  await scheduler.acquire(tenant)
+  task = asyncio.create_task(scheduler.acquire(tenant))
+  await asyncio.sleep(0)
+  task.cancel()
+  with pytest.raises(asyncio.CancelledError):
+    await task
+  assert tenant.queued == 0
+  scheduler.release(tenant)
+  await asyncio.wait_for(scheduler.acquire(tenant), 0.1)
+
+
+def test_token_bucket():
+  bucket = TokenBucket(rate=10, burst=2)
+  assert bucket.take() == 0
+  assert bucket.take() == 0
+  assert 0 < bucket.take() <= 0.1
+  assert bucket.take(5) > 0.2
+  bucket.refund(5)
+  # Back to burst at most
+  assert bucket.take(2) == 0
+  assert bucket.take() > 0
+
+
+async def test_earliest_deadline_first():
+  tenant = Tenant("a", "a")
+  scheduler = TenantScheduler([tenant], capacity=lambda: 1)
+  await scheduler.acquire(tenant)
+  now = time.monotonic()
+  order = []
+
+  async def solve(name: str, deadline: float | None):
+    async with scheduler.slot(tenant, deadline):
+      order.append(name)
+
+  tasks = [asyncio.create_task(solve(*args)) for args in [("none", None), ("late", now + 30), ("expired", now - 1), ("soon", now + 10)]]
+  await asyncio.sleep(0)
+  scheduler.release(tenant)
+  results = await asyncio.gather(*tasks, return_exceptions=True)
+  assert order == ["soon", "late", "none"]
+  assert isinstance(results[2], TimeoutError)
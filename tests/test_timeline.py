@@ -0,0 +1,36 @@
+import json
+
+from turnstile_solver.timeline import Timeline, FileSpanExporter
+
+
+def test_nested_spans_and_events():
+  timeline = Timeline(site_key="KEY")
+  with timeline.span("attempt", attempt=1):
+    with timeline.span("init"):
+      timeline.event("init")
+    timeline.start("complete")
+  timeline.finish()
+
+  root, attempt, init, complete = timeline.spans
+  assert (attempt.parent, init.parent, complete.parent) == (root, attempt, attempt)
+  assert all(span.end_time for span in timeline.spans)
+  assert [e[0] for e in init.events] == ["init"]
+  assert [entry.split(';')[0] for entry in timeline.server_timing().split(', ')] == ["attempt", "init", "complete", "total"]
+  assert timeline.dict()[2]["events"][0]["name"] == "init"
+
+
+async def test_file_exporter(tmp_path):
+  timeline = Timeline(site_key="KEY")
+  with timeline.span("attempt", attempt=1):
+    pass
+  timeline.finish()
+  exporter = FileSpanExporter(tmp_path / "traces.jsonl")
+  exporter.export(timeline)
+  exporter.export(timeline)
+  # Written in background
+  await exporter.close()
+  lines = (tmp_path / "traces.jsonl").read_text().splitlines()
+  assert len(lines) == 2
+  spans = json.loads(lines[0])["resourceSpans"][0]["scopeSpans"][0]["spans"]
+  assert spans[1]["parentSpanId"] == spans[0]["spanId"]
+  assert spans[1]["attributes"] == [{"key": "attempt", "value": {"intValue": "1"}}]
@@ -0,0 +1,44 @@
+import asyncio
+import datetime
+
+from turnstile_solver.token_bank import TokenBank
+from turnstile_solver.turnstile_result import TurnstileResult
+from turnstile_solver.turnstile_site import TurnstileSite
+
+SITE = TurnstileSite(site_key="0x4AAAAAAAByvC31sFG0MSlp", site_url="https://example.com")
+
+
+async def _solve(site_url: str, site_key: str):
+  await asyncio.sleep(0.01)
+  return TurnstileResult(token=f"TOKEN-{site_key}", elapsed=datetime.timedelta(seconds=0.01)), None
+
+
+async def test_refill_and_take():
+  bank = TokenBank([SITE], solve=_solve, has_idle_capacity=lambda: True, size=2)
+  assert bank.take(SITE.site_url, SITE.site_key) is None
+  bank.start()
+  await asyncio.sleep(0.05)
+  assert bank.take(SITE.site_url + "/", SITE.site_key) == f"TOKEN-{SITE.site_key}"
+  assert bank.take("https://other.com", SITE.site_key) is None
+  await bank.close()
+  assert bank.stats()['hits'] == 1
+  assert bank.stats()['misses'] == 1
+
+
+async def test_no_refill_without_idle_capacity():
+  bank = TokenBank([SITE], solve=_solve, has_idle_capacity=lambda: False)
+  bank.start()
+  await asyncio.sleep(0.05)
+  await bank.close()
+  assert bank.refills == 0
+
+
+async def test_expired_tokens_evicted():
+  bank = TokenBank([SITE], solve=_solve, has_idle_capacity=lambda: True, size=1, token_ttl=0.1)
+  bank.start()
+  await asyncio.sleep(0.05)
+  await bank.close()
+  assert bank.refills == 1
+  await asyncio.sleep(0.1)
+  assert bank.take(SITE.site_url, SITE.site_key) is None
+  assert bank.expired == 1
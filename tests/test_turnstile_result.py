@@ -0,0 +1,115 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from turnstile_solver.enums import CaptchaApiMessageEvent
+from turnstile_solver.turnstile_result import TurnstileResult
+
+# Latency is wall-clock and flaky on a loaded machine, only asserted with TURNSTILE_BENCHMARK=1
+BENCHMARK = bool(os.environ.get('TURNSTILE_BENCHMARK'))
+CONCURRENCY = 500
+EVENT_DELAY = 0.5
+POLL_INTERVAL = 0.05
+
+
+async def test_wait_for_captcha_event():
+  result = TurnstileResult()
+  task = asyncio.create_task(result.wait_for_captcha_event(evt=CaptchaApiMessageEvent.INIT, timeout=1))
+  await asyncio.sleep(0)
+  await result.captcha_api_message_event_handler(CaptchaApiMessageEvent.INIT, {})
+  assert await task is True
+
+
+async def test_wait_for_captcha_event_cancelling():
+  result = TurnstileResult()
+  task = asyncio.create_task(result.wait_for_captcha_event(
+    CaptchaApiMessageEvent.FAIL,
+    CaptchaApiMessageEvent.REJECT,
+    evt=CaptchaApiMessageEvent.COMPLETE,
+    timeout=1,
+  ))
+  await asyncio.sleep(0)
+  await result.captcha_api_message_event_handler(CaptchaApiMessageEvent.FOOD, {})
+  await result.captcha_api_message_event_handler(CaptchaApiMessageEvent.REJECT, {})
+  assert await task is CaptchaApiMessageEvent.REJECT
+
+
+async def test_wait_for_captcha_event_already_received():
+  result = TurnstileResult()
+  await result.captcha_api_message_event_handler(CaptchaApiMessageEvent.COMPLETE, {'token': 'T'})
+  assert await result.wait_for_captcha_event(evt=CaptchaApiMessageEvent.COMPLETE, timeout=0) is True
+  assert result.token == 'T'
+
+
+async def test_wait_for_captcha_event_timeout():
+  result = TurnstileResult()
+  with pytest.raises(TimeoutError):
+    await result.wait_for_captcha_event(evt=CaptchaApiMessageEvent.INIT, timeout=0.01)
+  assert not result._captcha_event_waiters
+
+
+async def _polling_wait(result: TurnstileResult, evt: CaptchaApiMessageEvent, sleep_time: float = POLL_INTERVAL):
+  """Previous wait_for_captcha_event() implementation, kept as benchmark baseline"""
+  while True:
+    if evt in result._received_captcha_events:
+      return True
+    await asyncio.sleep(sleep_time)
+
+
+class _Wakeups:
+  """Awaits a coroutine, counting how many times the event loop resumes it after it suspended"""
+
+  def __init__(self, coro, wakeups: list[int]):
+    self._coro = coro
+    self._wakeups = wakeups
+
+  def __await__(self):
+    gen = self._coro.__await__()
+    try:
+      yielded = gen.send(None)
+      while True:
+        try:
+          value = yield yielded
+        except BaseException as ex:
+          self._wakeups[0] += 1
+          yielded = gen.throw(ex)
+        else:
+          self._wakeups[0] += 1
+          yielded = gen.send(value)
+    except StopIteration as ex:
+      return ex.value
+
+
+async def _benchmark(wait) -> tuple[int, float]:
+  """Wakeups of all waiters and their average latency after the event is delivered"""
+  results = [TurnstileResult() for _ in range(CONCURRENCY)]
+  deliveredAt: dict[str, float] = {}
+  latencies: list[float] = []
+  wakeups = [0]
+
+  async def waitOne(r: TurnstileResult):
+    await _Wakeups(wait(r), wakeups)
+    latencies.append(time.perf_counter() - deliveredAt[r.id])
+
+  async def deliver(i: int, r: TurnstileResult):
+    # Spread over a poll interval, so events don't all land right on a poll
+    await asyncio.sleep(EVENT_DELAY + i / CONCURRENCY * POLL_INTERVAL)
+    deliveredAt[r.id] = time.perf_counter()
+    await r.captcha_api_message_event_handler(CaptchaApiMessageEvent.INIT, {})
+
+  await asyncio.gather(*[waitOne(r) for r in results], *[deliver(i, r) for i, r in enumerate(results)])
+  return wakeups[0], sum(latencies) / len(latencies)
+
+
+async def test_wait_for_captcha_event_benchmark():
+  pollingWakeups, pollingLatency = await _benchmark(lambda r: _polling_wait(r, CaptchaApiMessageEvent.INIT))
+  pushWakeups, pushLatency = await _benchmark(lambda r: r.wait_for_captcha_event(evt=CaptchaApiMessageEvent.INIT, timeout=5))
+
+  # Polling wakes every waiter up on every poll until the event, push only once when it's delivered
+  assert pollingWakeups > CONCURRENCY * 5
+  assert pushWakeups == CONCURRENCY
+  if BENCHMARK:
+    # Half a poll interval on average for polling
+    assert pushLatency < POLL_INTERVAL / 4 < pollingLatency
@@ -0,0 +1,216 @@
+import asyncio
+import datetime
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from turnstile_solver.admission import AdmissionController
+from turnstile_solver.browser_context_pool import BrowserContextPool
+from turnstile_solver.constants import SECRET, MAX_BATCH_SIZE
+from turnstile_solver.metrics import POOL_WAIT_SECONDS
+from turnstile_solver.page_pool import PagePool
+from turnstile_solver.tenants import Tenant
+from turnstile_solver.turnstile_result import TurnstileResult
+from turnstile_solver.turnstile_solver_server import TurnstileSolverServer
+
+HEADERS = {'secret': SECRET}
+SOLVE_DATA = {"site_url": "https://example.com", "site_key": "0x4AAAAAAAByvC31sFG0MSlp"}
+
+
+@pytest.fixture
+def server() -> TurnstileSolverServer:
+  server = TurnstileSolverServer()
+  # Browsers are not needed, TurnstileSolverServer.solve() is replaced
+  server.solver = server.browser_context_pool = object()
+  solved = asyncio.Event()
+
+  async def solve(site_url: str, site_key: str, timeline=None, tenant=None, deadline=None):
+    await solved.wait()
+    return TurnstileResult(token="TOKEN", elapsed=datetime.timedelta(seconds=1)), None
+
+  server.solve = solve
+  server.solved = solved
+  return server
+
+
+async def test_job(server: TurnstileSolverServer):
+  client = server.app.test_client()
+  response = await client.post('/jobs', json=SOLVE_DATA, headers=HEADERS)
+  assert response.status_code == 202
+  jobId = (await response.get_json())['job_id']
+
+  response = await client.get(f'/jobs/{jobId}', headers=HEADERS)
+  assert (await response.get_json())['job_status'] == 'pending'
+
+  asyncio.get_running_loop().call_later(0.05, server.solved.set)
+  response = await client.get(f'/jobs/{jobId}?wait=5', headers=HEADERS)
+  data = await response.get_json()
+  assert data['job_status'] == 'done'
+  assert data['token'] == 'TOKEN'
+
+
+async def test_job_not_found(server: TurnstileSolverServer):
+  response = await server.app.test_client().get('/jobs/unknown', headers=HEADERS)
+  assert response.status_code == 404
+
+
+async def test_solve_batch(server: TurnstileSolverServer):
+  server.solved.set()
+  response = await server.app.test_client().post('/solve/batch', json=SOLVE_DATA | {"count": 3}, headers=HEADERS)
+  assert response.status_code == 200
+  lines = (await response.get_data(as_text=True)).splitlines()
+  assert len(lines) == 3
+  assert all(json.loads(line)['token'] == 'TOKEN' for line in lines)
+
+
+async def test_solve_batch_count_limit(server: TurnstileSolverServer):
+  response = await server.app.test_client().post('/solve/batch', json=SOLVE_DATA | {"count": MAX_BATCH_SIZE + 1}, headers=HEADERS)
+  assert response.status_code == 400
+
+
+async def test_websocket_results_out_of_order(server: TurnstileSolverServer):
+  pool = server.browser_context_pool = SimpleNamespace(waiting=0, is_full=False)
+  gates = {1: asyncio.Event(), 2: asyncio.Event()}
+
+  async def solve(site_url: str, site_key: str, timeline=None, tenant=None, deadline=None):
+    await gates[int(site_key)].wait()
+    return TurnstileResult(token=f"TOKEN{site_key}", elapsed=datetime.timedelta(seconds=1)), None
+
+  server.solve = solve
+  async with server.app.test_client().websocket('/ws', headers=HEADERS) as ws:
+    await ws.send(json.dumps(SOLVE_DATA | {"id": "a", "site_key": "1"}))
+    pool.is_full = True
+    await ws.send(json.dumps(SOLVE_DATA | {"id": "b", "site_key": "2"}))
+    assert json.loads(await ws.receive()) | {"waiting": None} == {"type": "backpressure", "id": None, "pause": True, "waiting": None}
+    pool.is_full = False
+    gates[2].set()
+    result = json.loads(await ws.receive())
+    assert (result['id'], result['token']) == ("b", "TOKEN2")
+    assert json.loads(await ws.receive())['pause'] is False
+    gates[1].set()
+    result = json.loads(await ws.receive())
+    assert (result['id'], result['token']) == ("a", "TOKEN1")
+    await ws.send("not json")
+    assert json.loads(await ws.receive())['status'] == "error"
+
+
+async def test_metrics(server: TurnstileSolverServer):
+  server.browser_context_pool = SimpleNamespace(in_use=[], idle=[], items=[], waiting=2, remote_browsers=[])
+  server.solver = SimpleNamespace(display_pool=None)
+  response = await server.app.test_client().get('/metrics', headers=HEADERS)
+  assert response.status_code == 200
+  text = await response.get_data(as_text=True)
+  assert "turnstile_pool_waiting 2" in text.splitlines()
+  assert "# TYPE turnstile_solve_phase_seconds histogram" in text
+
+
+async def test_solve_server_timing(server: TurnstileSolverServer):
+  server.solved.set()
+  response = await server.app.test_client().get('/solve', json=SOLVE_DATA | {"timeline": True}, headers=HEADERS)
+  assert response.status_code == 200
+  assert response.headers['Server-Timing'].startswith("total;dur=")
+  assert (await response.get_json())['timeline'][0]['name'] == "solve"
+
+
+async def test_solve_rejected_when_busy(server: TurnstileSolverServer):
+  server.admission = AdmissionController(capacity=lambda: 1, max_queue=0)
+  server.admission.record_service_time(3)
+  server.admission.in_flight = 1
+  response = await server.app.test_client().get('/solve', json=SOLVE_DATA, headers=HEADERS)
+  assert response.status_code == 429
+  assert response.headers['Retry-After'] == "3"
+
+
+async def test_tenant_secrets_and_rate_limit(server: TurnstileSolverServer):
+  tenant = Tenant("acme", "ACME", rate=0.01, burst=1)
+  server.tenants[tenant.secret] = tenant
+  server.solved.set()
+  client = server.app.test_client()
+  assert (await client.get('/solve', json=SOLVE_DATA, headers={'secret': 'unknown'})).status_code == 403
+  assert (await client.get('/solve', json=SOLVE_DATA, headers={'secret': 'ACME'})).status_code == 200
+  response = await client.get('/solve', json=SOLVE_DATA, headers={'secret': 'ACME'})
+  assert response.status_code == 429
+  assert int(response.headers['Retry-After']) > 1
+
+
+async def test_batch_above_tenant_burst_is_rejected(server: TurnstileSolverServer):
+  server.tenants["ACME"] = Tenant("acme", "ACME", rate=5, burst=10)
+  server.solved.set()
+  client = server.app.test_client()
+  response = await client.post('/solve/batch', json=SOLVE_DATA | {"count": 11}, headers={'secret': 'ACME'})
+  assert response.status_code == 400
+  response = await client.post('/solve/batch', json=SOLVE_DATA | {"count": 10}, headers={'secret': 'ACME'})
+  assert response.status_code == 200
+  assert len((await response.get_data(as_text=True)).splitlines()) == 10
+
+
+async def test_rejected_by_admission_keeps_rate_limit(server: TurnstileSolverServer):
+  tenant = server.tenants["ACME"] = Tenant("acme", "ACME", rate=0.01, burst=1)
+  server.admission = AdmissionController(capacity=lambda: 1, max_queue=0)
+  server.admission.record_service_time(3)
+  server.admission.in_flight = 1
+  client = server.app.test_client()
+  assert (await client.get('/solve', json=SOLVE_DATA, headers={'secret': 'ACME'})).status_code == 429
+  assert tenant.rate_limited == 0
+
+  # Deadline already passed
+  response = await client.get('/solve', json=SOLVE_DATA | {"deadline": time.time() - 1}, headers={'secret': 'ACME'})
+  assert response.status_code == 504
+  assert tenant.rate_limited == 0
+
+  server.admission.in_flight = 0
+  server.solved.set()
+  assert (await client.get('/solve', json=SOLVE_DATA, headers={'secret': 'ACME'})).status_code == 200
+
+
+async def test_non_finite_deadline_rejected(server: TurnstileSolverServer):
+  client = server.app.test_client()
+  for data, headers in [({"deadline": "nan"}, {}), ({"timeout": "inf"}, {}), ({}, {"X-Deadline": "NaN"})]:
+    response = await client.get('/solve', json=SOLVE_DATA | data, headers=HEADERS | headers)
+    assert response.status_code == 400
+
+
+async def test_solve_cancelled_at_deadline(server: TurnstileSolverServer):
+  server.solve = TurnstileSolverServer.solve.__get__(server)
+  cancelled = asyncio.Event()
+
+  async def solveOnPage(*args):
+    try:
+      await asyncio.sleep(60)
+    except asyncio.CancelledError:
+      cancelled.set()
+      raise
+
+  server._solve_on_page = solveOnPage
+  response = await server.app.test_client().get('/solve', json=SOLVE_DATA | {"timeout": 0.05}, headers=HEADERS)
+  assert response.status_code == 504
+  assert cancelled.is_set()
+
+
+async def test_solve_moved_to_another_page_when_page_is_lost():
+  server = TurnstileSolverServer()
+  pool = server.browser_context_pool = BrowserContextPool(solver=None, max_contexts=1, max_pages_per_context=2, min_idle=0)
+  pool._browser = object()
+  pool._item_getter = lambda: PagePool(context=None, max_pages=2)
+  pages = []
+
+  async def solve(page, **kwargs):
+    pages.append(page)
+    if len(pages) == 1:
+      # Renderer crash: the page never answers again
+      pagePool.lose("Page crashed", page)
+      await asyncio.sleep(60)
+    return TurnstileResult(token="TOKEN", elapsed=datetime.timedelta(seconds=1))
+
+  server.solver = SimpleNamespace(solve=solve)
+  pagePool = await pool.prefill()
+  pagePool._item_getter = pagePool._replacement_getter = object
+  waits = POOL_WAIT_SECONDS.count()
+  result, error = await server.solve("https://example.com", "KEY")
+  assert result.token == "TOKEN"
+  assert len(pages) == 2 and pages[0] not in pagePool.items
+  assert pages[1] in pagePool.items
+  # Once per page acquired
+  assert POOL_WAIT_SECONDS.count() == waits + 2
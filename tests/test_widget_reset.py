@@ -0,0 +1,99 @@
+import asyncio
+
+from turnstile_solver import constants as c
+from turnstile_solver.solver import TurnstileSolver
+
+
+class _Page:
+  """Loaded page whose widget emits the given events after each reset"""
+
+  def __init__(self, emit, events: list[list[str]]):
+    self.url = "about:blank"
+    self.resets = 0
+    self._emit = emit
+    self._events = events
+
+  async def evaluate(self, script: str, arg=None, isolated_context: bool = True):
+    if isolated_context:
+      # Like Patchright's default utility world, the page script and Turnstile API globals aren't there
+      return False
+    if script == c.RESET_WIDGET_JS:
+      self.resets += 1
+      self._emit(self._events.pop(0))
+      return True
+
+
+async def test_retry_resets_widget_instead_of_reloading():
+  solver = TurnstileSolver(server=None, browser_position=None)
+  setups = 0
+  ids = []
+
+  def emit(events: list[str]):
+    async def dispatch():
+      for evt in events:
+        data = {"event": evt, "token": "TOKEN"} if evt == "complete" else {"event": evt}
+        await solver.event_dispatcher.dispatch(ids[0], data)
+    asyncio.get_running_loop().create_task(dispatch())
+
+  page = _Page(emit, [["init", "complete"]])
+
+  async def setupPage(page_or_context, site_url: str, site_key: str, id: str, timeline=None):
+    nonlocal setups
+    setups += 1
+    ids.append(id)
+    emit(["init", "fail"])
+    return page
+
+  solver._setup_page = setupPage
+  result = await solver.solve("https://example.com", "KEY", page=page, timeout=1)
+  assert result.token == "TOKEN"
+  assert (setups, page.resets) == (1, 1)
+  assert [span.name for span in result.timeline.spans if span.name in ("setup", "reset")] == ["setup", "reset"]
+
+
+class _ParkedPage(_Page):
+  def __init__(self, emit, events: list[list[str]], site_key: str, ids: list[str]):
+    super().__init__(emit, events)
+    self.url = "https://example.com/"
+    self.site_key = site_key
+    self.reused_by: str | None = None
+    self._ids = ids
+
+  async def evaluate(self, script: str, arg=None, isolated_context: bool = True):
+    if script == c.REUSE_PAGE_JS and not isolated_context:
+      if arg[1] != self.site_key:
+        return False
+      self.reused_by = arg[0]
+      self._ids.append(arg[0])
+      self._emit(self._events.pop(0))
+      return True
+    return await super().evaluate(script, arg, isolated_context)
+
+
+async def test_page_parked_on_site_is_reused_without_loading():
+  solver = TurnstileSolver(server=None, browser_position=None)
+  ids = []
+
+  def emit(events: list[str]):
+    async def dispatch():
+      for evt in events:
+        data = {"event": evt, "token": "TOKEN"} if evt == "complete" else {"event": evt}
+        await solver.event_dispatcher.dispatch(ids[-1], data)
+    asyncio.get_running_loop().create_task(dispatch())
+
+  async def setupPage(page_or_context, site_url: str, site_key: str, id: str, timeline=None):
+    ids.append(id)
+    emit(["init", "complete"])
+    return page_or_context
+
+  solver._setup_page = setupPage
+  page = _ParkedPage(emit, [["init", "complete"]], site_key="KEY", ids=ids)
+  result = await solver.solve("https://example.com", "KEY", page=page, timeout=1)
+  assert result.token == "TOKEN"
+  assert page.reused_by == result.id
+  assert "navigation" not in [span.name for span in result.timeline.spans]
+
+  # Widget of another site key: loaded again
+  result = await solver.solve("https://example.com", "OTHER", page=page, timeout=1)
+  assert result.token == "TOKEN"
+  assert ids[-1] == result.id and page.reused_by != result.id
@@ -0,0 +1,145 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from turnstile_solver import constants as c
+from turnstile_solver.browser_context_pool import BrowserContextPool
+from turnstile_solver.solver import TurnstileSolver
+
+# Live benchmark, needs a browser and network access: TURNSTILE_BENCHMARK=1 pytest -s tests/test_widgets_per_page.py
+BENCHMARK = bool(os.environ.get('TURNSTILE_BENCHMARK'))
+BENCHMARK_SITE = "https://spotifydown.com/", "0x4AAAAAAAByvC31sFG0MSlp"
+BENCHMARK_DURATION = 300
+BENCHMARK_PAGES = 4
+
+
+class _SharedPage:
+  """Loaded page whose widgets pass their challenge right after being rendered"""
+
+  def __init__(self, emit):
+    self.url = "about:blank"
+    self.loaded = False
+    # Turnstile widget id -> solve id
+    self.widgets: dict[str, str] = {}
+    self._widgetIds = itertools.count()
+    self._emit = emit
+
+  async def evaluate(self, script: str, arg=None, isolated_context: bool = True):
+    if isolated_context:
+      # Patchright's default utility world doesn't see the page script helpers
+      if script == c.WIDGET_PAGE_LOADED_JS:
+        return False
+      raise RuntimeError("window.__renderWidget is not a function")
+    if script == c.WIDGET_PAGE_LOADED_JS:
+      return self.loaded
+    if script == c.RENDER_WIDGET_JS:
+      widgetId = f"widget{next(self._widgetIds)}"
+      self.widgets[widgetId] = arg[0]
+      self._emit(arg[0])
+      return widgetId
+    if script == c.REMOVE_WIDGET_JS:
+      del self.widgets[arg]
+
+
+async def test_solves_share_a_page_loaded_once():
+  solver = TurnstileSolver(server=None, browser_position=None)
+  setups = 0
+
+  def emit(id: str):
+    async def dispatch():
+      await solver.event_dispatcher.dispatch(id, {"event": "init"})
+      await solver.event_dispatcher.dispatch(id, {"event": "complete", "token": f"TOKEN-{id}"})
+    asyncio.get_running_loop().create_task(dispatch())
+
+  page = _SharedPage(emit)
+
+  async def setupPage(page_or_context, site_url: str, site_key: str, id: str | None, timeline=None):
+    nonlocal setups
+    assert id is None
+    setups += 1
+    await asyncio.sleep(0.01)
+    page_or_context.url = site_url
+    page_or_context.loaded = True
+    return page_or_context
+
+  solver._setup_page = setupPage
+  results = await asyncio.gather(*[solver.solve("https://example.com", "KEY", page=page, timeout=1, shared_page=True) for _ in range(3)])
+  assert setups == 1
+  assert [r.token for r in results] == [f"TOKEN-{r.id}" for r in results]
+  assert [r.widget_selector for r in results] == [f"#w-{r.id}" for r in results]
+  # Every widget is removed once its solve is done, the page stays on the site
+  assert page.widgets == {}
+  assert page.url == "https://example.com/"
+
+
+def _rss(pid: int) -> int:
+  """Resident memory of the process and all its descendants, in bytes. Linux only"""
+  children: dict[int, list[int]] = {}
+  for stat in Path("/proc").glob("[0-9]*/stat"):
+    try:
+      fields = stat.read_text().rsplit(")", 1)[1].split()
+    except OSError:
+      continue
+    children.setdefault(int(fields[1]), []).append(int(stat.parent.name))
+  total, pending = 0, [pid]
+  while pending:
+    p = pending.pop()
+    pending.extend(children.get(p, []))
+    try:
+      total += int(Path(f"/proc/{p}/stat").read_text().rsplit(")", 1)[1].split()[21]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+      pass
+  return total
+
+
+async def _tokens_per_minute_per_gb(widgets_per_page: int) -> tuple[float, float, float]:
+  solver = TurnstileSolver(server=None, browser_position=None, headless=True, log_level=logging.WARNING)
+  pool = BrowserContextPool(
+    solver=solver,
+    max_contexts=1,
+    max_pages_per_context=BENCHMARK_PAGES,
+    single_instance=True,
+    min_idle=0,
+    widgets_per_page=widgets_per_page,
+  )
+  await pool.init()
+  siteUrl, siteKey = BENCHMARK_SITE
+  tokens = 0
+  rssSamples = []
+  endTime = time.monotonic() + BENCHMARK_DURATION
+
+  async def worker():
+    nonlocal tokens
+    while time.monotonic() < endTime:
+      async with pool.lease() as pagePool, pagePool.lease(key=siteUrl) as page:
+        if await solver.solve(siteUrl, siteKey, page=page, about_blank_on_finish=widgets_per_page == 1, shared_page=widgets_per_page > 1):
+          tokens += 1
+
+  async def sampleRss():
+    while True:
+      rssSamples.append(_rss(os.getpid()))
+      await asyncio.sleep(1)
+
+  sampler = asyncio.create_task(sampleRss())
+  startTime = time.monotonic()
+  try:
+    await asyncio.gather(*[worker() for _ in range(BENCHMARK_PAGES * widgets_per_page)])
+  finally:
+    sampler.cancel()
+    await pool.close()
+    await pool.browser.close()
+  tokensPerMinute = tokens / (time.monotonic() - startTime) * 60
+  rssGb = sum(rssSamples) / len(rssSamples) / 2 ** 30
+  return tokensPerMinute, rssGb, tokensPerMinute / rssGb
+
+
+@pytest.mark.skipif(not BENCHMARK, reason="Set TURNSTILE_BENCHMARK=1 to run the live benchmark")
+async def test_widgets_per_page_benchmark(logger: logging.Logger):
+  for widgetsPerPage in (1, 2, 4):
+    tokensPerMinute, rssGb, efficiency = await _tokens_per_minute_per_gb(widgetsPerPage)
+    logger.info(f"{widgetsPerPage} widgets per page on {BENCHMARK_PAGES} pages: {tokensPerMinute:.1f} tokens/min, {rssGb:.2f} GB RSS, {efficiency:.1f} tokens/min/GB")